@@ -0,0 +1,160 @@
+#!/usr/bin/python3
+import argparse
+import itertools
+import json
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from typing import List
+
+from bbq import BBQ
+from cache import GeneratorCache
+from passes import DeadSignalElimination
+from util import atomic_open
+
+
+def config_name(config: dict) -> str:
+    """Canonical (directory) name for a configuration."""
+    name = "l{}_b{}".format(config["num_bitmap_levels"],
+                            config["bitmap_width"])
+
+    if config["num_lps"] > 1: name += "_p{}".format(config["num_lps"])
+    return name
+
+
+def expand_grid(levels: List[int], num_lps: List[int],
+                bitmap_widths: List[int],
+                max_num_priorities: int=None) -> List[dict]:
+    """Returns the cross-product (levels x lps x bitmap_width)."""
+    configs = []
+    for (l, p, b) in itertools.product(levels, num_lps, bitmap_widths):
+        if max_num_priorities and (b ** l) > max_num_priorities: continue
+        configs.append({"num_bitmap_levels": l, "num_lps": p, "bitmap_width": b})
+
+    return configs
+
+
+def collapse_widths(configs: List[dict], specialize: bool) -> List[dict]:
+    """Returns the distinct configurations to generate. The bitmap width
+    is only baked into partitioned or specialized BBQs; for the others,
+    it is a module parameter (HEAP_BITMAP_WIDTH, set through BITMAP_WIDTH
+    in quartus/top.sv), so configurations that only differ in the width
+    share a single output (with a bitmap width of 0)."""
+    collapsed = []
+    for config in configs:
+        if (config["num_lps"] <= 1) and not specialize:
+            config = {**config, "bitmap_width": 0}
+        if config not in collapsed: collapsed.append(config)
+
+    return collapsed
+
+
+def generate_config(config: dict, output_dir: str, cache_dir: str,
+                    eliminate_dead_signals: bool, specialize: bool) -> dict:
+    """Generates a single configuration. Returns its manifest entry."""
+    entry = dict(config)
+    entry["name"] = config_name(config)
+    try:
+        bbq = BBQ(config["num_bitmap_levels"], config["num_lps"],
+                  config["bitmap_width"], specialize)
+
+    except ValueError as e:
+        entry["error"] = str(e)
+        return entry
+
+    if eliminate_dead_signals:
+        bbq.passes.append(DeadSignalElimination())
+
+    config_dir = os.path.join(output_dir, entry["name"])
+    os.makedirs(config_dir, exist_ok=True)
+    output = os.path.join(config_dir, "bbq.sv")
+
+    if cache_dir:
+        cache = GeneratorCache(cache_dir)
+        cache.install(bbq, output)
+        entry["cache_hit"] = cache.last_hit
+    else:
+        with atomic_open(output) as f:
+            bbq.write(f)
+
+    entry["output"] = os.path.relpath(output, output_dir)
+    entry["bitmap_width_is_parameter"] = not (
+        bbq.is_logically_partitioned or specialize)
+    entry["num_pipeline_stages"] = bbq.num_pipeline_stages
+    entry["fl_rd_delay"] = bbq.fl_rd_delay
+    entry["levels"] = [{"name": level.name(),
+                        "start_cycle": level.start_cycle,
+                        "end_cycle": level.end_cycle}
+                       for level in bbq.levels]
+    return entry
+
+
+def run_batch(configs: List[dict], output_dir: str, num_jobs: int,
+              cache_dir: str=None, eliminate_dead_signals: bool=False,
+              specialize: bool=False) -> dict:
+    """Generates all configurations in parallel. Returns the manifest."""
+    configs = collapse_widths(configs, specialize)
+    os.makedirs(output_dir, exist_ok=True)
+    with ProcessPoolExecutor(max_workers=num_jobs) as executor:
+        entries = list(executor.map(
+            generate_config, configs,
+            itertools.repeat(output_dir), itertools.repeat(cache_dir),
+            itertools.repeat(eliminate_dead_signals),
+            itertools.repeat(specialize)))
+
+    manifest = {"configs": entries}
+    with atomic_open(os.path.join(output_dir, "manifest.json")) as f:
+        json.dump(manifest, f, indent=4)
+        f.write("\n")
+
+    return manifest
+
+
+def main(argv: List[str]) -> None:
+    parser = argparse.ArgumentParser(
+        prog="bbq batch", description=("Generates BBQs for a list or grid of "
+                                       "configurations in a single process."))
+
+    parser.add_argument("output_dir", type=str)
+    parser.add_argument("--levels", type=int, nargs="+", default=[])
+    parser.add_argument("--num_lps", type=int, nargs="+", default=[1])
+    parser.add_argument("--bitmap_width", type=int, nargs="+", default=[0])
+    parser.add_argument("--max_num_priorities", type=int, default=None,
+                        help="Skip grid points with more priorities")
+    parser.add_argument("--configs", type=str, default=None,
+                        help=("JSON file with a list of configurations "
+                              "(num_bitmap_levels, num_lps, bitmap_width)"))
+    parser.add_argument("--jobs", type=int, default=os.cpu_count())
+    parser.add_argument("--eliminate_dead_signals", action="store_true",
+                        help="Remove signals that are never read")
+    parser.add_argument("--specialize", action="store_true",
+                        help="Bake the bitmap width into the generated code")
+    parser.add_argument("--cache_dir", type=str,
+                        default=os.environ.get("BBQ_CACHE_DIR"),
+                        help=("Directory for caching generated code "
+                              "(default: $BBQ_CACHE_DIR, if set)"))
+    args = parser.parse_args(argv)
+
+    configs = expand_grid(args.levels, args.num_lps, args.bitmap_width,
+                          args.max_num_priorities)
+    if args.configs:
+        with open(args.configs, "r") as f:
+            for config in json.load(f):
+                configs.append({"num_lps": 1, "bitmap_width": 0, **config})
+
+    if not configs:
+        parser.error("Specify --levels and/or --configs.")
+
+    manifest = run_batch(configs, args.output_dir, args.jobs,
+                         args.cache_dir, args.eliminate_dead_signals,
+                         args.specialize)
+
+    num_errors = sum(1 for e in manifest["configs"] if "error" in e)
+    print("Generated {} configuration(s) in {} ({} skipped)".format(
+        len(manifest["configs"]) - num_errors, args.output_dir, num_errors),
+        file=sys.stderr)
+
+    for entry in manifest["configs"]:
+        if "error" in entry:
+            print("Skipped {}: {}".format(entry["name"], entry["error"]),
+                  file=sys.stderr)
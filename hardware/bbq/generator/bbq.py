@@ -1,7 +1,12 @@
 #!/usr/bin/python3
+from __future__ import annotations
+
 import argparse
-import math
-from typing import List
+import json
+import os
+import sys
+import typing
+from typing import Callable, Dict, Iterable, List, TextIO, Tuple
 
 from bbq_level import BBQLevel
 from bbq_level_ingress import BBQLevelIngress
@@ -9,20 +14,55 @@ from bbq_level_lx import BBQLevelLX
 from bbq_level_pb import BBQLevelPB
 from bbq_level_steering import BBQLevelSteering
 from codegen import CodeGen
+from fragments import FragmentCache
+from cache import GeneratorCache
+from passes import DeadSignalElimination, Pass, UnusedParamElimination
 from toolz.itertoolz import partition
+from util import atomic_open, clog2, steering_levels
+
+# Hack for type hinting with circular imports
+if typing.TYPE_CHECKING: from simulator import Simulator
+
+
+def default_placement(num_bitmap_levels: int, first_level_id: int=1
+                      ) -> Tuple[Tuple[int, ...], Tuple[int, ...]]:
+    """Returns the bitmap levels whose bitmaps (L3 onward) and counters
+    (L2 onward) are stored in SRAM by default; others use registers."""
+    return (tuple(range(max(3, first_level_id), num_bitmap_levels + 1)),
+            tuple(range(max(2, first_level_id), num_bitmap_levels + 1)))
 
 
 class BBQ:
     """Class for generating configurable BBQs."""
+    fragments = FragmentCache()             # Memoized level fragments
+
     def __init__(self, num_bitmap_levels: int, num_lps: int=1,
-                 bitmap_width: int=0) -> None:
+                 bitmap_width: int=0, specialize: bool=False,
+                 entry_dwidth: int=17,
+                 max_num_entries: int=((1 << 17) - 1),
+                 calendar: bool=False, sram_bitmaps: Iterable[int]=None,
+                 sram_counters: Iterable[int]=None) -> None:
 
         # BBQ configuration
         self.num_lps = num_lps
         self.bitmap_width = bitmap_width
         self.num_bitmap_levels = num_bitmap_levels
+        self.specialized = specialize       # Bake in all parameters?
+        self.entry_dwidth = entry_dwidth    # Default entry data width
+        self.max_num_entries = max_num_entries  # Default queue size
+        self.calendar = calendar            # Circular priority space?
         self.validate_configuration() # Perform validation
 
+        # Bitmap levels whose bitmaps and counters are stored in SRAM
+        self.sram_bitmaps, self.sram_counters = default_placement(
+            num_bitmap_levels, self.first_level_id)
+        if sram_bitmaps is not None:
+            self.sram_bitmaps = tuple(sorted(set(sram_bitmaps)))
+        if sram_counters is not None:
+            self.sram_counters = tuple(sorted(set(sram_counters)))
+
+        self.validate_placement()
+
         # Generate ingress level
         start_cycle = 1
         self.levels : List[BBQLevel] = [
@@ -33,7 +73,7 @@ class BBQ:
         # Generate steering level
         start_level_id = 1
         if self.is_logically_partitioned:
-            start_level_id = int(math.log(num_lps, bitmap_width))
+            start_level_id = self.first_level_id - 1
             level = BBQLevelSteering(self, start_cycle,
                                      num_lps, start_level_id)
 
@@ -44,7 +84,8 @@ class BBQ:
         # Populate the list with all LX levels
         for level_id in range(start_level_id, self.num_bitmap_levels + 1):
             level = BBQLevelLX(self, start_cycle, level_id,
-                               (level_id >= 3), (level_id >= 2))
+                               (level_id in self.sram_bitmaps),
+                               (level_id in self.sram_counters))
 
             self.levels.append(level)
             start_cycle = level.end_cycle + 1
@@ -66,6 +107,9 @@ class BBQ:
 
         # Finally, instantiate backend
         self.codegen = CodeGen()
+        self.passes: List[Pass] = []        # Optimization passes
+        if self.specialized:
+            self.passes.append(UnusedParamElimination())
 
 
     @property
@@ -79,6 +123,40 @@ class BBQ:
         return bitmap_levels
 
 
+    @property
+    def config(self) -> dict:
+        """Returns the parameters that determine the generated code."""
+        return {
+            "num_bitmap_levels": self.num_bitmap_levels,
+            "num_lps": self.num_lps,
+            "bitmap_width": self.bitmap_width,
+            "passes": [p.name() for p in self.passes],
+            **({"entry_dwidth": self.entry_dwidth,
+                "max_num_entries": self.max_num_entries}
+               if self.specialized else {}),
+            **({"calendar": True} if self.calendar else {}),
+            **({"sram_bitmaps": list(self.sram_bitmaps),
+                "sram_counters": list(self.sram_counters)}
+               if not self.has_default_placement else {}),
+        }
+
+
+    @property
+    def has_default_placement(self) -> bool:
+        """Are bitmaps and counters placed in SRAM by default?"""
+        return (self.sram_bitmaps, self.sram_counters) == default_placement(
+            self.num_bitmap_levels, self.first_level_id)
+
+
+    @property
+    def first_level_id(self) -> int:
+        """ID of the first LX level (the ones before it are replaced
+        by the steering level in logically partitioned BBQs)."""
+        if not self.is_logically_partitioned: return 1
+        return steering_levels(self.num_bitmap_levels, self.bitmap_width,
+                               self.num_lps) + 1
+
+
     @property
     def is_logically_partitioned(self) -> bool:
         """Uses logical paritioning?"""
@@ -96,9 +174,103 @@ class BBQ:
                                  "logical partitioning is enabled.")
 
             # TODO(natre): Remove after implementing intra-level partitioning
-            if not math.log(self.num_lps, self.bitmap_width).is_integer():
-                raise ValueError("Number of logical partitions must be a "
-                                 "power of the bitmap width.")
+            steering_levels(self.num_bitmap_levels, self.bitmap_width,
+                            self.num_lps)
+
+        if self.calendar and self.is_logically_partitioned:
+            raise ValueError("Calendar mode does not support logical "
+                             "partitioning.")
+
+        if self.specialized:
+            if (self.bitmap_width < 2) or (
+                self.bitmap_width & (self.bitmap_width - 1)):
+                raise ValueError("Bitmap width must be specified (as a "
+                                 "power of 2) for specialized BBQs.")
+
+            if self.entry_dwidth < 1:
+                raise ValueError("Entry data width must be GEQ 1.")
+
+            if (self.max_num_entries < 1) or (
+                self.max_num_entries & (self.max_num_entries + 1)):
+                raise ValueError("Maximum number of entries must be of "
+                                 "the form (2^k - 1).")
+
+
+    def validate_placement(self) -> None:
+        """Validate the SRAM placement of bitmaps and counters."""
+        # Levels replaced by the steering level have no bitmaps
+        for level_ids in (self.sram_bitmaps, self.sram_counters):
+            if any((x < self.first_level_id) or
+                   (x > self.num_bitmap_levels) for x in level_ids):
+                raise ValueError("SRAM placements must be bitmap levels in "
+                                 "[{}, {}].".format(self.first_level_id,
+                                                    self.num_bitmap_levels))
+
+        # L1 is a single bitmap (and counters), addressed by bitmap index
+        if 1 in self.sram_bitmaps or 1 in self.sram_counters:
+            raise ValueError("L1 bitmaps and counters cannot be stored "
+                             "in SRAM.")
+
+
+    @property
+    def layout(self) -> tuple:
+        """Parameters that (along with its name) determine the code emitted
+        by each level. The bitmap width only matters if it is baked into
+        the code; otherwise, it's a parameter of the generated module."""
+        return (self.num_bitmap_levels, self.num_lps, self.specialized,
+                self.bitmap_width if (self.is_logically_partitioned or
+                                      self.specialized) else 0,
+                self.sram_bitmaps, self.sram_counters)
+
+
+    def fold(self, expr: str, value: int) -> str:
+        """Returns the literal value of a derived parameter if the BBQ
+        is specialized, else the SystemVerilog expression defining it."""
+        return str(value) if self.specialized else expr
+
+
+    @property
+    def num_priorities(self) -> int:
+        """Number of priorities (specialized BBQs only)."""
+        return self.bitmap_width ** self.num_bitmap_levels
+
+
+    @property
+    def entry_awidth(self) -> int:
+        """Entry address width (specialized BBQs only)."""
+        return clog2(self.max_num_entries)
+
+
+    @property
+    def parameters(self) -> List[str]:
+        """Module parameters that may be overridden."""
+        return ([] if self.is_logically_partitioned else
+                ["HEAP_BITMAP_WIDTH"]) + ["HEAP_ENTRY_DWIDTH",
+                                          "HEAP_MAX_NUM_ENTRIES"]
+
+
+    @property
+    def ports(self) -> List[Tuple[str, List[Tuple[str, str, str]]]]:
+        """Module I/O as (comment, [(direction, type, name)]) groups."""
+        return [
+            ("General I/O", [
+                ("input", "logic", "clk"),
+                ("input", "logic", "rst"),
+                ("output", "logic", "ready"),
+            ]),
+            ("Operation input", [
+                ("input", "logic", "in_valid"),
+                ("input", "heap_op_t", "in_op_type"),
+                ("input", "logic [HEAP_ENTRY_DWIDTH-1:0]", "in_he_data"),
+                ("input", "logic [HEAP_PRIORITY_BUCKETS_AWIDTH-1:0]", "in_he_priority"),
+            ]),
+            ("Operation output", [
+                ("output", "logic", "out_valid"),
+                ("output", "heap_op_t", "out_op_type"),
+                ("output", "logic [HEAP_ENTRY_DWIDTH-1:0]", "out_he_data"),
+                ("output", "logic [HEAP_PRIORITY_BUCKETS_AWIDTH-1:0]", "out_he_priority"),
+            ]),
+        ]
 
 
     def emit_prologue(self) -> None:
@@ -114,15 +286,32 @@ class BBQ:
             "or peek) every cycle.",
         ], True)
 
-        self.codegen.emit("module bbq #(")
+        self.emit_module_header("bbq", self.ports)
+
+
+    def emit_module_header(self, name: str, ports: List[Tuple[
+                           str, List[Tuple[str, str, str]]]]) -> None:
+        """Emit a module header with the BBQ's parameters and the given
+        I/O (as (comment, [(direction, type, name)]) groups)."""
+        self.codegen.emit("module {} #(".format(name))
         self.codegen.inc_level()
-        self.codegen.emit([
-            (None if self.is_logically_partitioned
-             else "parameter HEAP_BITMAP_WIDTH = 4,"),
+        if self.specialized:
+            self.codegen.emit([
+                (None if self.is_logically_partitioned else
+                 "parameter HEAP_BITMAP_WIDTH = {},".format(self.bitmap_width)),
 
-            "parameter HEAP_ENTRY_DWIDTH = 17,",
-            "parameter HEAP_MAX_NUM_ENTRIES = ((1 << 17) - 1),",
-        ])
+                "parameter HEAP_ENTRY_DWIDTH = {},".format(self.entry_dwidth),
+                "parameter HEAP_MAX_NUM_ENTRIES = {},".format(self.max_num_entries),
+            ])
+        else:
+            self.codegen.emit([
+                (None if self.is_logically_partitioned
+                 else "parameter HEAP_BITMAP_WIDTH = 4,"),
+
+                "parameter HEAP_ENTRY_DWIDTH = 17,",
+                "parameter HEAP_MAX_NUM_ENTRIES = ((1 << 17) - 1),",
+            ])
+        num_priorities_per_lp = self.num_priorities // self.num_lps
         if self.is_logically_partitioned:
             self.codegen.emit([
                 ("localparam HEAP_BITMAP_WIDTH = {}, {}".format(
@@ -131,80 +320,86 @@ class BBQ:
                 ("localparam HEAP_NUM_LPS = {}, {}".format(
                     self.num_lps, "// Number of logical BBQs")),
 
-                "localparam HEAP_LOGICAL_BBQ_AWIDTH = ($clog2(HEAP_NUM_LPS)),",
+                "localparam HEAP_LOGICAL_BBQ_AWIDTH = {},".format(self.fold(
+                    "($clog2(HEAP_NUM_LPS))", clog2(self.num_lps))),
             ])
         self.codegen.emit([
-            "localparam HEAP_ENTRY_AWIDTH = ($clog2(HEAP_MAX_NUM_ENTRIES)),",
+            "localparam HEAP_ENTRY_AWIDTH = {},".format(self.fold(
+                "($clog2(HEAP_MAX_NUM_ENTRIES))", self.entry_awidth)),
+
             ("localparam HEAP_NUM_LEVELS = {}, {}".format(
                 self.num_bitmap_levels, "// Number of bitmap tree levels")),
 
-            "localparam HEAP_NUM_PRIORITIES = (HEAP_BITMAP_WIDTH ** HEAP_NUM_LEVELS),",
+            "localparam HEAP_NUM_PRIORITIES = {},".format(self.fold(
+                "(HEAP_BITMAP_WIDTH ** HEAP_NUM_LEVELS)", self.num_priorities)),
         ])
         self.codegen.emit([
-            "localparam HEAP_PRIORITY_BUCKETS_AWIDTH = ($clog2(HEAP_NUM_PRIORITIES)){}"
-            .format("," if self.is_logically_partitioned else ""),
+            "localparam HEAP_PRIORITY_BUCKETS_AWIDTH = {}{}".format(self.fold(
+                "($clog2(HEAP_NUM_PRIORITIES))", clog2(self.num_priorities)),
+                "," if self.is_logically_partitioned else ""),
         ])
         if self.is_logically_partitioned:
             self.codegen.emit([
-                "localparam HEAP_NUM_PRIORITIES_PER_LP = (HEAP_NUM_PRIORITIES / HEAP_NUM_LPS),",
-                "localparam HEAP_PRIORITY_BUCKETS_LP_AWIDTH = ($clog2(HEAP_NUM_PRIORITIES_PER_LP))",
+                "localparam HEAP_NUM_PRIORITIES_PER_LP = {},".format(self.fold(
+                    "(HEAP_NUM_PRIORITIES / HEAP_NUM_LPS)", num_priorities_per_lp)),
+
+                "localparam HEAP_PRIORITY_BUCKETS_LP_AWIDTH = {}".format(self.fold(
+                    "($clog2(HEAP_NUM_PRIORITIES_PER_LP))",
+                    clog2(num_priorities_per_lp))),
             ])
 
         self.codegen.dec_level()
         self.codegen.emit(") (")
         self.codegen.inc_level()
+        self.emit_port_declarations(ports, ",", "")
 
-        self.codegen.comment("General I/O")
-        self.codegen.emit([
-            "input   logic                                       clk,",
-            "input   logic                                       rst,",
-            "output  logic                                       ready,",
-        ])
+        self.codegen.dec_level()
+        self.codegen.emit(");")
         self.codegen.emit()
 
-        self.codegen.comment("Operation input")
-        self.codegen.emit([
-            "input   logic                                       in_valid,",
-            "input   heap_op_t                                   in_op_type,",
-            "input   logic [HEAP_ENTRY_DWIDTH-1:0]               in_he_data,",
-            "input   logic [HEAP_PRIORITY_BUCKETS_AWIDTH-1:0]    in_he_priority,",
-        ])
-        self.codegen.emit()
 
-        self.codegen.comment("Operation output")
-        self.codegen.emit([
-            "output  logic                                       out_valid,",
-            "output  heap_op_t                                   out_op_type,",
-            "output  logic [HEAP_ENTRY_DWIDTH-1:0]               out_he_data,",
-            "output  logic [HEAP_PRIORITY_BUCKETS_AWIDTH-1:0]    out_he_priority",
-        ])
+    def emit_port_declarations(self, ports: List[Tuple[
+                               str, List[Tuple[str, str, str]]]],
+                               separator: str=";",
+                               terminator: str=";") -> None:
+        """Emit port declarations for the given I/O groups."""
+        for idx, (comment, group) in enumerate(ports):
+            if idx != 0: self.codegen.emit()
+            self.codegen.comment(comment)
 
-        self.codegen.dec_level()
-        self.codegen.emit(");")
-        self.codegen.emit()
+            last_group = (idx == (len(ports) - 1))
+            self.codegen.emit([
+                "{:<8}{:<44}{}{}".format(
+                    direction, type, name, terminator if (
+                    last_group and (i == (len(group) - 1))) else separator)
+
+                for i, (direction, type, name) in enumerate(group)
+            ])
 
 
     def emit_typedefs(self) -> None:
         """Emit param and type definitions."""
-        self.codegen.comment([
-            "Optimization: Subtree occupancy counters (StOCs) must represent",
-            "values in the range [0, HEAP_MAX_NUM_ENTRIES]. Consequently, to",
-            "support 2^k entries, every StOC must be (k + 1)-bits wide; this",
-            "is wasteful because the MSb is only ever used to encode maximum",
-            "occupancy (2^k). Instead, by supporting one less entry (2^k - 1)",
-            "we can reduce memory usage by using 1 fewer bit per StOC.",
-        ])
-        self.codegen.emit([
-            "localparam ROUNDED_MAX_NUM_ENTRIES = (1 << HEAP_ENTRY_AWIDTH);",
-        ])
-        self.codegen.start_conditional(
-            "if", "HEAP_MAX_NUM_ENTRIES != (ROUNDED_MAX_NUM_ENTRIES - 1)")
+        if self.specialized: self.emit_specialization_check()
+        else:
+            self.codegen.comment([
+                "Optimization: Subtree occupancy counters (StOCs) must represent",
+                "values in the range [0, HEAP_MAX_NUM_ENTRIES]. Consequently, to",
+                "support 2^k entries, every StOC must be (k + 1)-bits wide; this",
+                "is wasteful because the MSb is only ever used to encode maximum",
+                "occupancy (2^k). Instead, by supporting one less entry (2^k - 1)",
+                "we can reduce memory usage by using 1 fewer bit per StOC.",
+            ])
+            self.codegen.emit([
+                "localparam ROUNDED_MAX_NUM_ENTRIES = (1 << HEAP_ENTRY_AWIDTH);",
+            ])
+            self.codegen.start_conditional(
+                "if", "HEAP_MAX_NUM_ENTRIES != (ROUNDED_MAX_NUM_ENTRIES - 1)")
 
-        self.codegen.emit([
-            "$error(\"HEAP_MAX_NUM_ENTRIES must be of the form (2^k - 1)\");",
-        ])
-        self.codegen.end_conditional("if")
-        self.codegen.emit()
+            self.codegen.emit([
+                "$error(\"HEAP_MAX_NUM_ENTRIES must be of the form (2^k - 1)\");",
+            ])
+            self.codegen.end_conditional("if")
+            self.codegen.emit()
 
         self.codegen.emit([
             "integer i;",
@@ -222,15 +417,18 @@ class BBQ:
         # Emit the bitmap counts
         for i in range(1, (self.num_bitmap_levels + 1)):
             lhs = "localparam NUM_BITMAPS_L{}".format(i)
-            rhs = "= {};".format(1 if (i == 1) else
-                                 "(HEAP_BITMAP_WIDTH ** {})".format(i - 1))
+            rhs = "= {};".format(1 if (i == 1) else self.fold(
+                "(HEAP_BITMAP_WIDTH ** {})".format(i - 1),
+                self.bitmap_width ** (i - 1)))
 
             self.codegen.align_defs([(lhs, rhs)])
 
         # Emit the bitmap address widths
         for i in range(2, (self.num_bitmap_levels + 1)):
             lhs = "localparam BITMAP_L{}_AWIDTH".format(i)
-            rhs = "= ($clog2(NUM_BITMAPS_L{}));".format(i)
+            rhs = "= {};".format(self.fold(
+                "($clog2(NUM_BITMAPS_L{}))".format(i),
+                clog2(self.bitmap_width ** (i - 1))))
 
             self.codegen.align_defs([(lhs, rhs)])
 
@@ -238,31 +436,41 @@ class BBQ:
         # Emit the StOC counts
         for i in range(1, (self.num_bitmap_levels + 1)):
             lhs = "localparam NUM_COUNTERS_L{}".format(i)
-            rhs = "= {};".format("(HEAP_NUM_PRIORITIES)"
-                                 if (i == self.num_bitmap_levels)
-                                 else "(NUM_BITMAPS_L{})".format(i + 1))
+            rhs = "= {};".format(self.fold(
+                "(HEAP_NUM_PRIORITIES)" if (i == self.num_bitmap_levels)
+                else "(NUM_BITMAPS_L{})".format(i + 1), self.bitmap_width ** i))
 
             self.codegen.align_defs([(lhs, rhs)])
 
         # Emit counter width
         self.codegen.align_defs([(
             "localparam COUNTER_T_WIDTH",
-            "= (HEAP_ENTRY_AWIDTH + 1);"
+            "= {};".format(self.fold("(HEAP_ENTRY_AWIDTH + 1)",
+                                     self.entry_awidth + 1))
         )])
 
         # Emit the StOC address widths
         for i in range(1, (self.num_bitmap_levels + 1)):
             lhs = "localparam COUNTER_L{}_AWIDTH".format(i)
-            rhs = "= ($clog2(NUM_COUNTERS_L{}));".format(i)
+            rhs = "= {};".format(self.fold(
+                "($clog2(NUM_COUNTERS_L{}))".format(i),
+                clog2(self.bitmap_width ** i)))
 
             self.codegen.align_defs([(lhs, rhs)])
 
         self.codegen.emit()
         self.codegen.align_defs([
-            ("localparam WATERLEVEL_IDX",           "= (COUNTER_T_WIDTH - 1);"),
-            ("localparam LIST_T_WIDTH",             "= (HEAP_ENTRY_AWIDTH * 2);"),
-            ("localparam BITMAP_IDX_MASK",          "= (HEAP_BITMAP_WIDTH - 1);"),
-            ("localparam HEAP_LOG_BITMAP_WIDTH",    "= ($clog2(HEAP_BITMAP_WIDTH));"),
+            ("localparam WATERLEVEL_IDX",           "= {};".format(self.fold(
+                "(COUNTER_T_WIDTH - 1)", self.entry_awidth))),
+
+            ("localparam LIST_T_WIDTH",             "= {};".format(self.fold(
+                "(HEAP_ENTRY_AWIDTH * 2)", self.entry_awidth * 2))),
+
+            ("localparam BITMAP_IDX_MASK",          "= {};".format(self.fold(
+                "(HEAP_BITMAP_WIDTH - 1)", self.bitmap_width - 1))),
+
+            ("localparam HEAP_LOG_BITMAP_WIDTH",    "= {};".format(self.fold(
+                "($clog2(HEAP_BITMAP_WIDTH))", clog2(self.bitmap_width)))),
         ])
 
         self.codegen.emit()
@@ -297,6 +505,38 @@ class BBQ:
         self.codegen.emit()
 
 
+    def emit_level(self, level: BBQLevel, phase: str) -> None:
+        """Emit the given phase (emitter) of a level. Fragments are memoized
+        across BBQs, so generating the same level again (e.g., in a sweep
+        over bitmap widths or optimization passes) simply replays them."""
+        with self.codegen.owned_by(level.name()):
+            self.fragments.emit(
+                self.codegen, (phase, level.name(), self.layout),
+                lambda: getattr(level, phase)(self.codegen))
+
+
+    def emit_specialization_check(self) -> None:
+        """Emit a check that parameter overrides (if any) match the
+        values that a specialized BBQ's logic was generated for."""
+        params = [(x, getattr(self, y)) for (x, y) in [
+            ("HEAP_BITMAP_WIDTH", "bitmap_width"),
+            ("HEAP_ENTRY_DWIDTH", "entry_dwidth"),
+            ("HEAP_MAX_NUM_ENTRIES", "max_num_entries")]
+            if x in self.parameters]
+
+        self.codegen.comment("Specialized for: {}.".format(", ".join(
+            "{} = {}".format(x, v) for (x, v) in params)))
+
+        self.codegen.start_conditional("if", " || ".join(
+            "({} != {})".format(x, v) for (x, v) in params))
+
+        self.codegen.emit([
+            "$error(\"Parameters must match the specialized configuration\");",
+        ])
+        self.codegen.end_conditional("if")
+        self.codegen.emit()
+
+
     def emit_defs(self):
         """Emit common state logic."""
         self.codegen.comment("Heap state")
@@ -310,6 +550,11 @@ class BBQ:
 
                 self.codegen.emit("bitmap_t " + var)
 
+        # Emit the base of the circular priority space
+        if self.calendar:
+            self.codegen.emit("logic [HEAP_LOG_BITMAP_WIDTH-1:0] "
+                              "l1_bitmap_base; // L1 index of the base")
+
         # Emit register-based counters
         for level in self.bitmap_levels:
             if not level.sram_counters:
@@ -478,7 +723,7 @@ class BBQ:
             self.codegen.emit()
 
         for level in self.levels:
-            level.emit_stage_defs(self.codegen)
+            self.emit_level(level, "emit_stage_defs")
 
         # Init signals
         self.codegen.comment("Init signals")
@@ -544,6 +789,16 @@ class BBQ:
                 ("bitmap_t", ("ffs_{}_inst_lsb_onehot[{}:0];".
                               format(level.name(), (num_ffs_insts - 1)))),
             ])
+            if self.calendar and (level.id == 1):
+                self.codegen.align_defs([
+                    ("logic [HEAP_LOG_BITMAP_WIDTH-1:0]",
+                     "ffs_l1_inst_rotated_msb[{}:0];".format(
+                        num_ffs_insts - 1)),
+
+                    ("logic [HEAP_LOG_BITMAP_WIDTH-1:0]",
+                     "ffs_l1_inst_rotated_lsb[{}:0];".format(
+                        num_ffs_insts - 1)),
+                ])
             self.codegen.emit()
 
         self.codegen.start_ifdef("DEBUG")
@@ -580,7 +835,7 @@ class BBQ:
             ], "=")
 
         for level in self.levels:
-            level.emit_combinational_default_assigns(self.codegen)
+            self.emit_level(level, "emit_combinational_default_assigns")
 
         # Global defaults
         self.codegen.emit()
@@ -763,7 +1018,7 @@ class BBQ:
 
         self.codegen.start_conditional("else", None)
         for level in reversed(self.levels):
-            level.emit_state_dependent_combinational_logic(self.codegen)
+            self.emit_level(level, "emit_state_dependent_combinational_logic")
 
         self.codegen.end_conditional("else")
         self.codegen.end_block("always_comb")
@@ -777,7 +1032,7 @@ class BBQ:
         self.emit_combinational_default_assigns()
 
         for level in reversed(self.levels):
-            level.emit_state_agnostic_combinational_logic(self.codegen)
+            self.emit_level(level, "emit_state_agnostic_combinational_logic")
 
         self.codegen.start_ifdef("DEBUG")
         self.codegen.comment([
@@ -826,6 +1081,9 @@ class BBQ:
                 self.codegen.emit("{}_counters[i] <= 0;".format(level.name()))
                 self.codegen.end_for()
 
+        if self.calendar:
+            self.codegen.emit("l1_bitmap_base <= 0;")
+
         self.codegen.emit()
         self.codegen.comment("Reset pipeline stages")
         self.codegen.start_for("i", "i <= NUM_PIPELINE_STAGES")
@@ -994,6 +1252,21 @@ class BBQ:
         self.codegen.end_for()
         self.codegen.emit()
 
+        if self.calendar:
+            # The base follows the L1 index of the last deque-min, so
+            # the next one searches circularly from the current bucket.
+            cycle = self.bitmap_levels[0].start_cycle
+            self.codegen.comment("Advance the priority window's base")
+            self.codegen.start_conditional("if", [
+                "reg_valid_s[{0}] && reg_is_deque_min_s[{0}] &&".format(
+                    cycle - 1),
+                "!l1_bitmap_empty_s{}".format(cycle),
+            ])
+            self.codegen.emit("l1_bitmap_base <= l1_bitmap_idx_s{};"
+                              .format(cycle))
+            self.codegen.end_conditional("if")
+            self.codegen.emit()
+
         self.codegen.comment("Register R/W conflict signals")
         self.codegen.emit([
             "reg_pb_rdwr_conflict_r1 <= pb_rdwr_conflict;",
@@ -1039,7 +1312,7 @@ class BBQ:
 
         self.codegen.start_conditional("else", None)
         for level in reversed(self.levels):
-            level.emit_sequential_pipeline_logic(self.codegen)
+            self.emit_level(level, "emit_sequential_pipeline_logic")
 
         self.emit_sequential_common_logic()
         self.codegen.end_conditional("else")
@@ -1050,148 +1323,59 @@ class BBQ:
     def emit_module_instantiations(self) -> None:
         """Emit submodule instantiation code."""
         self.codegen.comment("Free list")
-        self.codegen.emit([
-            "sc_fifo #(",
-            "    .DWIDTH(HEAP_ENTRY_AWIDTH),",
-            "    .DEPTH(HEAP_MAX_NUM_ENTRIES),",
-            "    .IS_SHOWAHEAD(0),",
-            "    .IS_OUTDATA_REG(1)",
-            ")",
-            "free_list (",
-            "    .clock(clk),",
-            "    .data(fl_data),",
-            "    .rdreq(fl_rdreq),",
-            "    .wrreq(fl_wrreq),",
-            "    .empty(fl_empty),",
-            "    .full(),",
-            "    .q(fl_q),",
-            "    .usedw()",
-            ");",
+        self.codegen.instance("sc_fifo", "free_list", [
+            ("DWIDTH", "HEAP_ENTRY_AWIDTH"),
+            ("DEPTH", "HEAP_MAX_NUM_ENTRIES"),
+            ("IS_SHOWAHEAD", "0"),
+            ("IS_OUTDATA_REG", "1"),
+        ], [
+            ("clock", "clk"),
+            ("data", "fl_data"),
+            ("rdreq", "fl_rdreq"),
+            ("wrreq", "fl_wrreq"),
+            ("empty", "fl_empty"),
+            ("full", ""),
+            ("q", "fl_q"),
+            ("usedw", ""),
         ])
         self.codegen.emit()
 
-        self.codegen.comment("Heap entries")
-        self.codegen.emit([
-            "bram_simple2port #(",
-            "    .DWIDTH(HEAP_ENTRY_DWIDTH),",
-            "    .AWIDTH(HEAP_ENTRY_AWIDTH),",
-            "    .DEPTH(HEAP_MAX_NUM_ENTRIES),",
-            "    .IS_OUTDATA_REG(0)",
-            ")",
-            "heap_entries (",
-            "    .clock(clk),",
-            "    .data(he_data),",
-            "    .rden(he_rden),",
-            "    .wren(he_wren),",
-            "    .rdaddress(he_rdaddress),",
-            "    .wraddress(he_wraddress),",
-            "    .q(he_q)",
-            ");",
-        ])
-        self.codegen.emit()
+        for (comment, name, prefix, dwidth, awidth, depth) in [
+            ("Heap entries", "heap_entries", "he", "HEAP_ENTRY_DWIDTH",
+             "HEAP_ENTRY_AWIDTH", "HEAP_MAX_NUM_ENTRIES"),
 
-        self.codegen.comment("Next pointers")
-        self.codegen.emit([
-            "bram_simple2port #(",
-            "    .DWIDTH(HEAP_ENTRY_AWIDTH),",
-            "    .AWIDTH(HEAP_ENTRY_AWIDTH),",
-            "    .DEPTH(HEAP_MAX_NUM_ENTRIES),",
-            "    .IS_OUTDATA_REG(0)",
-            ")",
-            "next_pointers (",
-            "    .clock(clk),",
-            "    .data(np_data),",
-            "    .rden(np_rden),",
-            "    .wren(np_wren),",
-            "    .rdaddress(np_rdaddress),",
-            "    .wraddress(np_wraddress),",
-            "    .q(np_q)",
-            ");",
-        ])
-        self.codegen.emit()
+            ("Next pointers", "next_pointers", "np", "HEAP_ENTRY_AWIDTH",
+             "HEAP_ENTRY_AWIDTH", "HEAP_MAX_NUM_ENTRIES"),
 
-        self.codegen.comment("Previous pointers")
-        self.codegen.emit([
-            "bram_simple2port #(",
-            "    .DWIDTH(HEAP_ENTRY_AWIDTH),",
-            "    .AWIDTH(HEAP_ENTRY_AWIDTH),",
-            "    .DEPTH(HEAP_MAX_NUM_ENTRIES),",
-            "    .IS_OUTDATA_REG(0)",
-            ")",
-            "previous_pointers (",
-            "    .clock(clk),",
-            "    .data(pp_data),",
-            "    .rden(pp_rden),",
-            "    .wren(pp_wren),",
-            "    .rdaddress(pp_rdaddress),",
-            "    .wraddress(pp_wraddress),",
-            "    .q(pp_q)",
-            ");",
-        ])
-        self.codegen.emit()
+            ("Previous pointers", "previous_pointers", "pp", "HEAP_ENTRY_AWIDTH",
+             "HEAP_ENTRY_AWIDTH", "HEAP_MAX_NUM_ENTRIES"),
 
-        self.codegen.comment("Priority buckets")
-        self.codegen.emit([
-            "bram_simple2port #(",
-            "    .DWIDTH(LIST_T_WIDTH),",
-            "    .AWIDTH(HEAP_PRIORITY_BUCKETS_AWIDTH),",
-            "    .DEPTH(HEAP_NUM_PRIORITIES),",
-            "    .IS_OUTDATA_REG(0)",
-            ")",
-            "priority_buckets (",
-            "    .clock(clk),",
-            "    .data(pb_data),",
-            "    .rden(pb_rden),",
-            "    .wren(pb_wren),",
-            "    .rdaddress(pb_rdaddress),",
-            "    .wraddress(pb_wraddress),",
-            "    .q(pb_q)",
-            ");",
-        ])
-        self.codegen.emit()
+            ("Priority buckets", "priority_buckets", "pb", "LIST_T_WIDTH",
+             "HEAP_PRIORITY_BUCKETS_AWIDTH", "HEAP_NUM_PRIORITIES"),
+        ]:
+            self.codegen.comment(comment)
+            self.emit_bram_instance(name, prefix, dwidth, awidth, depth)
+            self.codegen.emit()
 
         for level in self.bitmap_levels:
             if level.sram_bitmap:
                 self.codegen.comment("L{} bitmaps".format(level.id))
-                self.codegen.emit([
-                    "bram_simple2port #(",
-                    "    .DWIDTH(HEAP_BITMAP_WIDTH),",
-                    "    .AWIDTH(BITMAP_L{}_AWIDTH),".format(level.id),
-                    "    .DEPTH(NUM_BITMAPS_L{}),".format(level.id),
-                    "    .IS_OUTDATA_REG(0)",
-                    ")",
-                    "bm_{} (".format(level.name()),
-                    "    .clock(clk),",
-                    "    .data(bm_{}_data),".format(level.name()),
-                    "    .rden(bm_{}_rden),".format(level.name()),
-                    "    .wren(bm_{}_wren),".format(level.name()),
-                    "    .rdaddress(bm_{}_rdaddress),".format(level.name()),
-                    "    .wraddress(bm_{}_wraddress),".format(level.name()),
-                    "    .q(bm_{}_q)".format(level.name()),
-                    ");",
-                ])
+                self.emit_bram_instance(
+                    "bm_{}".format(level.name()), "bm_{}".format(level.name()),
+                    "HEAP_BITMAP_WIDTH", "BITMAP_L{}_AWIDTH".format(level.id),
+                    "NUM_BITMAPS_L{}".format(level.id))
+
                 self.codegen.emit()
 
         for level in self.bitmap_levels:
             if level.sram_counters:
                 self.codegen.comment("L{} counters".format(level.id))
-                self.codegen.emit([
-                    "bram_simple2port #(",
-                    "    .DWIDTH(COUNTER_T_WIDTH),",
-                    "    .AWIDTH(COUNTER_L{}_AWIDTH),".format(level.id),
-                    "    .DEPTH(NUM_COUNTERS_L{}),".format(level.id),
-                    "    .IS_OUTDATA_REG(0)",
-                    ")",
-                    "counters_{} (".format(level.name()),
-                    "    .clock(clk),",
-                    "    .data(counter_{}_data),".format(level.name()),
-                    "    .rden(counter_{}_rden),".format(level.name()),
-                    "    .wren(counter_{}_wren),".format(level.name()),
-                    "    .rdaddress(counter_{}_rdaddress),".format(level.name()),
-                    "    .wraddress(counter_{}_wraddress),".format(level.name()),
-                    "    .q(counter_{}_q)".format(level.name()),
-                    ");",
-                ])
+                self.emit_bram_instance(
+                    "counters_{}".format(level.name()),
+                    "counter_{}".format(level.name()), "COUNTER_T_WIDTH",
+                    "COUNTER_L{}_AWIDTH".format(level.id),
+                    "NUM_COUNTERS_L{}".format(level.id))
+
                 self.codegen.emit()
 
         for level in self.bitmap_levels:
@@ -1208,42 +1392,165 @@ class BBQ:
                     bitmap = ("l1_bitmap" if (level.id == 1) else
                               "reg_{}_bitmap_s[{}]".format(level.name(), cycle))
 
-                self.codegen.emit([
-                    "ffs #(",
-                    "    .WIDTH_LOG(HEAP_LOG_BITMAP_WIDTH)",
-                    ")",
-                    "ffs_{}_inst{} (".format(level.name(), j),
-                    "    .x({}),".format(bitmap),
-                    "    .msb(ffs_{}_inst_msb[{}]),".format(level.name(), j),
-                    "    .lsb(ffs_{}_inst_lsb[{}]),".format(level.name(), j),
-                    "    .msb_onehot(ffs_{}_inst_msb_onehot[{}]),".format(level.name(), j),
-                    "    .lsb_onehot(ffs_{}_inst_lsb_onehot[{}]),".format(level.name(), j),
-                    "    .zero(ffs_{}_inst_zero[{}])".format(level.name(), j),
-                    ");",
+                if self.calendar and (level.id == 1):
+                    self.emit_rotated_ffs_instance(bitmap, j)
+                    continue
+
+                self.codegen.instance("ffs", "ffs_{}_inst{}".format(level.name(), j), [
+                    ("WIDTH_LOG", "HEAP_LOG_BITMAP_WIDTH"),
+                ], [
+                    ("x", bitmap),
+                    ("msb", "ffs_{}_inst_msb[{}]".format(level.name(), j)),
+                    ("lsb", "ffs_{}_inst_lsb[{}]".format(level.name(), j)),
+                    ("msb_onehot", "ffs_{}_inst_msb_onehot[{}]".format(level.name(), j)),
+                    ("lsb_onehot", "ffs_{}_inst_lsb_onehot[{}]".format(level.name(), j)),
+                    ("zero", "ffs_{}_inst_zero[{}]".format(level.name(), j)),
                 ])
                 self.codegen.emit()
 
 
+    def emit_rotated_ffs_instance(self, bitmap: str, j: int) -> None:
+        """Emit an L1 FFS instance for calendar mode. The bitmap is rotated
+        so that the base is its LSb, and the indices are rotated back;
+        the LSb is then the first set bit at or after the base (with
+        wrap-around), and the MSb the last one."""
+        self.codegen.instance("ffs", "ffs_l1_inst{}".format(j), [
+            ("WIDTH_LOG", "HEAP_LOG_BITMAP_WIDTH"),
+        ], [
+            ("x", "(({0} >> l1_bitmap_base) | ({0} << (HEAP_BITMAP_WIDTH - "
+                  "l1_bitmap_base)))".format(bitmap)),
+            ("msb", "ffs_l1_inst_rotated_msb[{}]".format(j)),
+            ("lsb", "ffs_l1_inst_rotated_lsb[{}]".format(j)),
+            ("msb_onehot", ""),
+            ("lsb_onehot", ""),
+            ("zero", "ffs_l1_inst_zero[{}]".format(j)),
+        ])
+        self.codegen.emit()
+
+        for midfix in ("msb", "lsb"):
+            self.codegen.emit([
+                ("assign ffs_l1_inst_{0}[{1}] = (ffs_l1_inst_rotated_{0}[{1}] + "
+                 "l1_bitmap_base);".format(midfix, j)),
+                ("assign ffs_l1_inst_{0}_onehot[{1}] = (1 << ffs_l1_inst_{0}[{1}]);"
+                 .format(midfix, j)),
+            ])
+        self.codegen.emit()
+
+
+    def emit_bram_instance(self, name: str, prefix: str, dwidth: str,
+                           awidth: str, depth: str) -> None:
+        """Emit a simple dual-port BRAM instantiation."""
+        self.codegen.instance("bram_simple2port", name, [
+            ("DWIDTH", dwidth),
+            ("AWIDTH", awidth),
+            ("DEPTH", depth),
+            ("IS_OUTDATA_REG", "0"),
+        ], [
+            ("clock", "clk"),
+            ("data", "{}_data".format(prefix)),
+            ("rden", "{}_rden".format(prefix)),
+            ("wren", "{}_wren".format(prefix)),
+            ("rdaddress", "{}_rdaddress".format(prefix)),
+            ("wraddress", "{}_wraddress".format(prefix)),
+            ("q", "{}_q".format(prefix)),
+        ])
+
+
     def emit_epilogue(self) -> None:
         """Emit module trailer."""
         self.codegen.emit("endmodule", indent_first=False,
                           offset=0, trailing_newline=False)
 
 
-    def generate(self) -> None:
-        """Generates the BBQ."""
-        self.emit_prologue()
-        self.emit_typedefs()
-        self.emit_defs()
-        self.emit_initial()
-        self.emit_state_dependent_combinational_logic()
-        self.emit_state_agnostic_combinational_logic()
-        self.emit_sequential_pipeline_logic()
-        self.emit_module_instantiations()
-        self.emit_epilogue()
+    @property
+    def phases(self) -> List[Tuple[str, Callable[[], None]]]:
+        """Code generation phases, in emission order."""
+        return [
+            ("prologue", self.emit_prologue),
+            ("typedefs", self.emit_typedefs),
+            ("defs", self.emit_defs),
+            ("initial", self.emit_initial),
+            ("state_dependent_combinational_logic",
+             self.emit_state_dependent_combinational_logic),
+            ("state_agnostic_combinational_logic",
+             self.emit_state_agnostic_combinational_logic),
+            ("sequential_pipeline_logic", self.emit_sequential_pipeline_logic),
+            ("module_instantiations", self.emit_module_instantiations),
+            ("epilogue", self.emit_epilogue),
+        ]
+
+
+    def generate(self, sink: TextIO=None) -> None:
+        """Generates the BBQ. If a sink is specified, the rendered
+        code is streamed to it phase by phase, and the IR is dropped
+        as it goes. Passes need the complete IR, so with passes, the
+        code is only rendered (and the IR kept) once complete."""
+        stream = (sink is not None) and (not self.passes)
+        for (_, phase) in self.phases:
+            phase()
+            if stream: self.codegen.flush(sink)
+
+        for p in self.passes:
+            p.run(self.codegen.nodes)
+
+        if (sink is not None) and (not stream): self.codegen.render(sink)
+
+
+    def write(self, sink: TextIO) -> None:
+        """Generates the BBQ and streams it to the given sink."""
+        self.generate(sink)
+        sink.write("\n")
+
+
+    def pipeline_layout(self) -> dict:
+        """Returns the pipeline layout: each level's stages and storage,
+        the number of pipeline stages, the free-list read delay, and the
+        latency (in cycles) from an op's issue to its output."""
+        return {
+            "bbq": self.config,
+            "levels": [level.describe() for level in self.levels],
+            "num_pipeline_stages": self.num_pipeline_stages,
+            "fl_rd_delay": self.fl_rd_delay,
+            "latency": self.num_pipeline_stages,
+        }
+
+
+    def simulator(self, params: Dict[str, int]=None) -> Simulator:
+        """Returns a cycle-accurate simulator for this BBQ, with the
+        given module parameters (e.g., HEAP_MAX_NUM_ENTRIES)."""
+        from simulator import Simulator
+        return Simulator(self, params)
+
+
+def format_pipeline_layout(layout: dict) -> str:
+    """Formats a pipeline layout (see BBQ.pipeline_layout) as text."""
+    lines = ["{:<10} {:>6} {:>6} {:>8}  {:<9} {}".format(
+        "Level", "Start", "End", "Latency", "Bitmaps", "Counters")]
+
+    for level in layout["levels"]:
+        storage = [("-" if x not in level else
+                    "sram" if level[x] else "registers")
+                   for x in ("sram_bitmap", "sram_counters")]
+
+        lines.append("{:<10} {:>6} {:>6} {:>8}  {:<9} {}".format(
+            level["name"], level["start_cycle"], level["end_cycle"],
+            level["latency"], *storage))
+
+    lines.append("")
+    lines.append("NUM_PIPELINE_STAGES: {}".format(
+        layout["num_pipeline_stages"]))
+    lines.append("Free list read delay: {}".format(layout["fl_rd_delay"]))
+    lines.append("Op latency: {} cycle(s)".format(layout["latency"]))
+    return "\n".join(lines)
 
 
 if __name__ == "__main__":
+    # Batch mode: bbq.py batch OUTPUT_DIR [options]
+    if sys.argv[1:2] == ["batch"]:
+        from batch import main
+        main(sys.argv[2:])
+        sys.exit(0)
+
     parser = argparse.ArgumentParser(
         prog="bbq", description=("Generates a SystemVerilog implementation of BBQ "
                                  "for the specified number of bitmap tree levels."))
@@ -1251,8 +1558,70 @@ if __name__ == "__main__":
     parser.add_argument("num_bitmap_levels", type=int)
     parser.add_argument("--num_lps", type=int, default=1)
     parser.add_argument("--bitmap_width", type=int, default=0)
+    parser.add_argument("--specialize", action="store_true",
+                        help=("Bake the bitmap width and entry sizes into "
+                              "the generated code (requires --bitmap_width)"))
+    parser.add_argument("--entry_dwidth", type=int, default=17,
+                        help="Entry data width (with --specialize)")
+    parser.add_argument("--max_num_entries", type=int, default=((1 << 17) - 1),
+                        help="Maximum number of entries (with --specialize)")
+    parser.add_argument("--calendar", action="store_true",
+                        help=("Treat priorities as a circular space of L1 "
+                              "buckets, searched from the L1 bucket of the "
+                              "last deque-min (within that bucket, lower "
+                              "priorities do not wrap around)"))
+    parser.add_argument("--sram_bitmaps", type=int, nargs="*", default=None,
+                        help=("Bitmap levels whose bitmaps are stored in "
+                              "SRAM (default: L3 onward)"))
+    parser.add_argument("--sram_counters", type=int, nargs="*", default=None,
+                        help=("Bitmap levels whose counters are stored in "
+                              "SRAM (default: L2 onward)"))
+    parser.add_argument("--output", type=str, default=None,
+                        help="Output path (default: stdout)")
+    parser.add_argument("--eliminate_dead_signals", action="store_true",
+                        help="Remove signals that are never read")
+    parser.add_argument("--report", nargs="?", const="text", default=None,
+                        choices=["text", "json"],
+                        help=("Print the pipeline layout (as text or JSON) "
+                              "instead of generating code"))
+    parser.add_argument("--cache_dir", type=str,
+                        default=os.environ.get("BBQ_CACHE_DIR"),
+                        help=("Directory for caching generated code "
+                              "(default: $BBQ_CACHE_DIR, if set)"))
     args = parser.parse_args()
 
-    bbq = BBQ(args.num_bitmap_levels, args.num_lps, args.bitmap_width)
-    bbq.generate()
-    print(bbq.codegen.out)
+    try:
+        bbq = BBQ(args.num_bitmap_levels, args.num_lps, args.bitmap_width,
+                  args.specialize, args.entry_dwidth, args.max_num_entries,
+                  args.calendar, args.sram_bitmaps, args.sram_counters)
+    except ValueError as e: parser.error(str(e))
+    if args.report is not None:
+        layout = bbq.pipeline_layout()
+        report = (json.dumps(layout, indent=4) if args.report == "json"
+                  else format_pipeline_layout(layout))
+
+        if args.output is None: print(report)
+        else:
+            with atomic_open(args.output) as f:
+                f.write(report + "\n")
+
+        sys.exit(0)
+
+    if args.eliminate_dead_signals:
+        bbq.passes.append(DeadSignalElimination())
+
+    if args.cache_dir:
+        cache = GeneratorCache(args.cache_dir)
+        if args.output is None: cache.copy(bbq, sys.stdout)
+        else: cache.install(bbq, args.output)
+        print(cache.report(), file=sys.stderr)
+
+    elif args.output is None: bbq.write(sys.stdout)
+    else:
+        with atomic_open(args.output) as f:
+            bbq.write(f)
+
+    # Passes only run if the code was (re-)generated
+    if not (args.cache_dir and cache.last_hit):
+        for p in bbq.passes:
+            print(p.report(), file=sys.stderr)
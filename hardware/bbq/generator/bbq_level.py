@@ -45,6 +45,16 @@ class BBQLevel(ABC):
         raise NotImplementedError()
 
 
+    def describe(self) -> dict:
+        """Returns the level's place in the pipeline."""
+        return {
+            "name": self.name(),
+            "start_cycle": self.start_cycle,
+            "end_cycle": self.end_cycle,
+            "latency": self.latency(),
+        }
+
+
     @abstractmethod
     def emit_stage_defs(self, cg: CodeGen) -> None:
         """Emit per-stage definitions."""
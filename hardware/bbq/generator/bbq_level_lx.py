@@ -6,6 +6,7 @@ import typing
 from bbq_level import BBQLevel
 from bbq_level_pb import BBQLevelPB
 from codegen import CodeGen
+from util import clog2
 
 # Hack for type hinting with circular imports
 if typing.TYPE_CHECKING: from bbq import BBQ
@@ -45,6 +46,13 @@ class BBQLevelLX(BBQLevel):
         return 1 + int(self.sram_bitmap) + int(self.sram_counters)
 
 
+    def describe(self) -> dict:
+        """Returns the level's place in the pipeline, and whether its
+        bitmaps and counters are stored in SRAM or registers."""
+        return {**super().describe(), "sram_bitmap": self.sram_bitmap,
+                "sram_counters": self.sram_counters}
+
+
     def emit_stage_defs(self, cg: CodeGen) -> None:
         """Emit per-stage definitions."""
         cycle = self.start_cycle
@@ -386,8 +394,10 @@ class BBQLevelLX(BBQLevel):
                     ("{}&& (reg_{}_bitmap_idx_s{} =="
                      .format(cg.tab(), self.name(), seq_cycle)),
 
-                    ("{}{}[{}][HEAP_LOG_BITMAP_WIDTH-1:0]));"
-                     .format(cg.tab(2), rhs_priority, seq_cycle + offset)),
+                    ("{}{}[{}][{}:0]));"
+                     .format(cg.tab(2), rhs_priority, seq_cycle + offset,
+                             self.bbq.fold("HEAP_LOG_BITMAP_WIDTH-1",
+                                           clog2(self.bbq.bitmap_width) - 1))),
                 ],
                 "=", True)
                 cg.emit()
@@ -599,12 +609,15 @@ class BBQLevelLX(BBQLevel):
 
         cg.comment("HEAP_OP_ENQUE")
         cg.start_case("default")
-        bitmap_idx_ub = ("({} * HEAP_LOG_BITMAP_WIDTH) - 1".format(
-                         (self.num_bitmap_levels - self.level_id) + 1))
-
-        bitmap_idx_lb = ("0" if self.is_leaf else
-                         "({} * HEAP_LOG_BITMAP_WIDTH)".format(
-                            self.num_bitmap_levels - self.level_id))
+        log_bitmap_width = clog2(self.bbq.bitmap_width)
+        num_levels_below = (self.num_bitmap_levels - self.level_id)
+        bitmap_idx_ub = self.bbq.fold(
+            "({} * HEAP_LOG_BITMAP_WIDTH) - 1".format(num_levels_below + 1),
+            ((num_levels_below + 1) * log_bitmap_width) - 1)
+
+        bitmap_idx_lb = ("0" if self.is_leaf else self.bbq.fold(
+                         "({} * HEAP_LOG_BITMAP_WIDTH)".format(num_levels_below),
+                         num_levels_below * log_bitmap_width))
         cg.emit([
             "{} = 0;".format(bitmap_empty_lhs),
 
@@ -846,8 +859,12 @@ class BBQLevelLX(BBQLevel):
                         .format(lhs, self.name(), cycle))
 
             if reg_counters:
+                counter_idx = (reg_bitmap_idx if (self.level_id == 1) else
+                               "{{reg_{}_addr_s[{}], {}}}".format(
+                                   self.name(), cycle - 1, reg_bitmap_idx))
+
                 cg.emit("{0}_counters[{1}] <= {0}_counter_s{2};"
-                        .format(self.name(), reg_bitmap_idx, cycle))
+                        .format(self.name(), counter_idx, cycle))
 
             cg.end_conditional("if")
             cg.emit()
@@ -865,8 +882,10 @@ class BBQLevelLX(BBQLevel):
                 ["{}_bitmap_s{}".format(self.next_level.name(),
                                         self.next_level.end_cycle),
 
-                 "{}_bitmaps[{}]".format(self.next_level.name(),
-                                         reg_bitmap_idx)],
+                 "{}_bitmaps[{}]".format(self.next_level.name(), (
+                     reg_bitmap_idx if (self.level_id == 1) else
+                     "{{reg_{}_addr_s[{}], {}}}".format(
+                         self.name(), cycle - 1, reg_bitmap_idx)))],
                 "<=", True, True)
 
             cg.emit()
@@ -1097,14 +1116,15 @@ class BBQLevelLX(BBQLevel):
             else:
                 cg.align_assignment(reg_counter_lhs, [
                     "(",
-                    ("reg_valid_s[{0}] && reg_{1}_addr_conflict_s{0}_s{2} &&"
+                    ("(reg_valid_s[{0}] && reg_{1}_addr_conflict_s{0}_s{2} &&"
                      .format(cycle, self.name(), cycle - 1)),
 
                     ("{0}({1}_{2}{3} == reg_{1}_{2}{3})) ?"
                      .format(cg.tab(), self.name(), "bitmap_idx_s", cycle)),
 
-                    ("{0}{1}_counter_s{2} : {1}_counters[{1}_bitmap_idx_s{3}]);"
-                     .format(cg.tab(), self.name(), cycle + 1, cycle))
+                    ("{0}{1}_counter_s{2} : {1}_counters[{{reg_{1}_addr_s[{4}], "
+                     "{1}_bitmap_idx_s{3}}}]);".format(
+                         cg.tab(), self.name(), cycle + 1, cycle, cycle - 1))
                 ],
                 "<=", True)
         cg.end_case() # READ_CARRY_DOWN
@@ -38,6 +38,13 @@ class BBQLevelSteering(BBQLevel):
         return 0
 
 
+    def describe(self) -> dict:
+        """Returns the level's place in the pipeline, and the bitmap
+        levels it replaces."""
+        return {**super().describe(), "num_lps": self.num_lps,
+                "level_id": self.level_id}
+
+
     def emit_stage_defs(self, cg: CodeGen) -> None:
         """Emit per-stage definitions."""
         cycle = self.start_cycle
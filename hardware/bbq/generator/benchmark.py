@@ -0,0 +1,324 @@
+#!/usr/bin/python3
+import argparse
+import datetime
+import json
+import platform
+import sys
+import time
+import tracemalloc
+from collections import defaultdict
+from typing import Callable, Dict, List, TextIO, Tuple
+
+import numpy as np
+
+from batch import config_name, expand_grid
+from bbq import BBQ
+from cache import GeneratorCache
+from codegen import CodeGen
+from ir import Node, walk
+from passes import DeadSignalElimination
+from reference import ReferenceModel, make_trace
+from simulator import HeapOp
+from util import atomic_open
+
+
+class LineCounter:
+    """Sink that counts rendered bytes and lines."""
+    def __init__(self) -> None:
+        self.num_bytes = 0                  # Bytes written
+        self.num_lines = 0                  # Lines written
+
+
+    def write(self, x: str) -> None:
+        self.num_bytes += len(x)
+        self.num_lines += x.count("\n")
+
+
+class StrConcatCodeGen(CodeGen):
+    """Reference backend that renders into a single growing str."""
+    def __init__(self) -> None:
+        super().__init__()
+        self.buffer = ""                    # Emitted code
+
+
+    @property
+    def out(self) -> str:
+        """Fetch the emitted code."""
+        self.buffer = ""
+        for chunk in self.chunks():
+            self.buffer += chunk
+
+        return self.buffer
+
+
+def time_generate(num_bitmap_levels: int, backend: type,
+                  num_runs: int) -> float:
+    """Returns the best-of-N wall time (in seconds) to generate a BBQ."""
+    best = float("inf")
+    for _ in range(num_runs):
+        BBQ.fragments.clear()
+        bbq = BBQ(num_bitmap_levels)
+        bbq.codegen = backend()
+
+        start = time.perf_counter()
+        bbq.generate()
+        _ = bbq.codegen.out
+        best = min(best, time.perf_counter() - start)
+
+    return best
+
+
+def run_codegen_benchmark(levels: List[int], num_runs: int) -> None:
+    """Compares the chunked and str-concat CodeGen backends."""
+    print("{:>6} {:>12} {:>12} {:>12} {:>8}".format(
+        "levels", "out (KiB)", "concat (ms)", "chunked (ms)", "speedup"))
+
+    for num_bitmap_levels in levels:
+        bbq = BBQ(num_bitmap_levels)
+        bbq.generate()
+        size = len(bbq.codegen.out) / 1024
+
+        concat = time_generate(num_bitmap_levels, StrConcatCodeGen, num_runs)
+        chunked = time_generate(num_bitmap_levels, CodeGen, num_runs)
+
+        print("{:>6} {:>12.1f} {:>12.2f} {:>12.2f} {:>7.2f}x".format(
+            num_bitmap_levels, size, concat * 1e3,
+            chunked * 1e3, concat / chunked))
+
+
+def mixed_trace(num_ops: int, run_length: int, num_priorities: int,
+                seed: int=0) -> np.ndarray:
+    """Returns a trace of enqueues and dequeues (deque-mins or maxes, at
+    random) in alternating runs of the given length (or, if it is 0, in
+    random order), after num_ops enqueues that fill the queue."""
+    rng = np.random.default_rng(seed)
+    if run_length: is_deque = (np.arange(num_ops) // run_length) % 2 == 1
+    else: is_deque = rng.random(num_ops) < 0.5
+
+    ops = np.where(is_deque, rng.integers(HeapOp.DEQUE_MIN,
+                                          HeapOp.DEQUE_MAX + 1, num_ops),
+                   HeapOp.ENQUE).astype(np.uint8)
+
+    ops = np.concatenate([np.full(num_ops, HeapOp.ENQUE, np.uint8), ops])
+    return make_trace(ops, np.arange(len(ops)),
+                      rng.integers(0, num_priorities, len(ops)))
+
+
+def run_reference_benchmark(levels: List[int], bitmap_width: int,
+                            run_lengths: List[int], num_ops: int,
+                            num_runs: int) -> None:
+    """Measures the reference model's throughput (best-of-N, in ops/s)
+    on mixed traces, by the length of their enqueue and dequeue runs
+    (excluding the enqueues that fill the queue)."""
+    print("{:>6} {:>6} {:>12} {:>12}".format(
+        "levels", "runs", "ops", "ops/s"))
+
+    for num_bitmap_levels in levels:
+        for run_length in run_lengths:
+            trace = mixed_trace(num_ops, run_length,
+                                bitmap_width ** num_bitmap_levels)
+            best = float("inf")
+            for _ in range(num_runs):
+                model = ReferenceModel(num_bitmap_levels, bitmap_width,
+                                       max_num_entries=(2 * num_ops))
+                model.run(trace[:num_ops])
+                start = time.perf_counter()
+                model.run(trace[num_ops:])
+                best = min(best, time.perf_counter() - start)
+
+            print("{:>6} {:>6} {:>12} {:>12.0f}".format(
+                num_bitmap_levels, run_length or "random",
+                num_ops, num_ops / best))
+
+
+def count_lines(node: Node, spacing: int) -> int:
+    """Returns the number of lines rendered for the given node."""
+    return sum(x.count("\n") for x in node.render(spacing))
+
+
+def lines_by_owner(bbq: BBQ) -> Dict[str, int]:
+    """Returns the number of emitted lines attributed to each level
+    (blocks are only charged for their own headers and footers)."""
+    counts: Dict[str, int] = defaultdict(int)
+    spacing = bbq.codegen.spacing
+    for node in walk(bbq.codegen.nodes):
+        num_lines = count_lines(node, spacing) - sum(
+            count_lines(x, spacing) for x in node.children())
+
+        counts[node.owner or "bbq"] += num_lines
+
+    return dict(counts)
+
+
+def make_bbq(config: dict, eliminate_dead_signals: bool) -> BBQ:
+    """Instantiates a BBQ (with passes) for the given configuration."""
+    bbq = BBQ(config["num_bitmap_levels"], config["num_lps"],
+              config["bitmap_width"])
+
+    if eliminate_dead_signals:
+        bbq.passes.append(DeadSignalElimination())
+
+    return bbq
+
+
+def profile_phases(bbq: BBQ, sink: TextIO,
+                   trace_memory: bool) -> List[Tuple[str, float, int]]:
+    """Generates the given BBQ one phase at a time. Returns the wall time
+    (in seconds) and, if tracing memory, the peak memory allocated (in
+    bytes) by each phase, including optimization passes and rendering."""
+    phases: List[Tuple[str, Callable[[], None]]] = list(bbq.phases)
+    for p in bbq.passes:
+        phases.append(("pass:{}".format(p.name()),
+                       lambda p=p: p.run(bbq.codegen.nodes)))
+
+    phases.append(("render", lambda: bbq.codegen.render(sink)))
+
+    results = []
+    for (name, phase) in phases:
+        if trace_memory:
+            tracemalloc.reset_peak()
+            (base, _) = tracemalloc.get_traced_memory()
+
+        start = time.perf_counter()
+        phase()
+        elapsed = time.perf_counter() - start
+
+        peak = 0
+        if trace_memory:
+            peak = tracemalloc.get_traced_memory()[1] - base
+
+        results.append((name, elapsed, peak))
+
+    return results
+
+
+def profile_config(config: dict, num_runs: int,
+                   eliminate_dead_signals: bool=False) -> dict:
+    """Profiles the generator for a single configuration."""
+    entry = dict(config)
+    entry["name"] = config_name(config)
+    try: make_bbq(config, False)
+    except ValueError as e:
+        entry["error"] = str(e)
+        return entry
+
+    # Wall time (best-of-N), measured without tracing overheads.
+    # Each run starts with a cold fragment cache (see BBQ.emit_level).
+    times: Dict[str, float] = {}
+    for _ in range(num_runs):
+        BBQ.fragments.clear()
+        bbq = make_bbq(config, eliminate_dead_signals)
+        for (name, elapsed, _) in profile_phases(bbq, LineCounter(), False):
+            times[name] = min(times.get(name, float("inf")), elapsed)
+
+    # Time to regenerate the same BBQ with a warm fragment cache
+    bbq = make_bbq(config, eliminate_dead_signals)
+    warm_time = sum(x for (_, x, _) in profile_phases(
+        bbq, LineCounter(), False))
+
+    # Peak memory, measured over a separate (traced) run
+    BBQ.fragments.clear()
+    sink = LineCounter()
+    bbq = make_bbq(config, eliminate_dead_signals)
+    tracemalloc.start()
+    try: memory = profile_phases(bbq, sink, True)
+    finally: tracemalloc.stop()
+
+    entry["phases"] = [{"name": name, "time_ms": times[name] * 1e3,
+                        "peak_memory_kib": peak / 1024}
+                       for (name, _, peak) in memory]
+
+    entry["total_time_ms"] = sum(times.values()) * 1e3
+    entry["warm_total_time_ms"] = warm_time * 1e3
+    entry["output_bytes"] = sink.num_bytes
+    entry["output_lines"] = sink.num_lines
+    entry["num_pipeline_stages"] = bbq.num_pipeline_stages
+
+    # Emitted lines per level, and per level class
+    lines = lines_by_owner(bbq)
+    classes = {level.name(): type(level).__name__ for level in bbq.levels}
+    by_class: Dict[str, int] = defaultdict(int)
+    for (owner, num_lines) in lines.items():
+        by_class[classes.get(owner, "BBQ")] += num_lines
+
+    entry["lines_by_level"] = lines
+    entry["lines_by_level_class"] = dict(by_class)
+    return entry
+
+
+def run_profile_suite(configs: List[dict], num_runs: int,
+                      eliminate_dead_signals: bool) -> dict:
+    """Profiles the generator across the given configurations."""
+    results = {
+        "timestamp": datetime.datetime.now(
+            datetime.timezone.utc).isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "source_digest": GeneratorCache.get_source_digest(),
+        "num_runs": num_runs,
+        "configs": [],
+    }
+    for config in configs:
+        entry = profile_config(config, num_runs, eliminate_dead_signals)
+        results["configs"].append(entry)
+
+        if "error" in entry:
+            print("{:<12} skipped: {}".format(entry["name"], entry["error"]),
+                  file=sys.stderr)
+        else:
+            print("{:<12} {:>10.2f} ms {:>10} lines".format(
+                entry["name"], entry["total_time_ms"],
+                entry["output_lines"]), file=sys.stderr)
+
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        prog="benchmark", description="Benchmarks the BBQ generator.")
+
+    parser.add_argument("--levels", type=int, nargs="+", default=None)
+    parser.add_argument("--num_runs", type=int, default=5)
+    parser.add_argument("--profile", action="store_true",
+                        help=("Profile each generation phase across the "
+                              "configuration space (levels x lps x width)"))
+    parser.add_argument("--reference", action="store_true",
+                        help=("Measure the reference model's throughput on "
+                              "mixed traces"))
+    parser.add_argument("--run_lengths", type=int, nargs="+",
+                        default=[0, 64, 256, 1024],
+                        help=("Lengths of the enqueue and dequeue runs in "
+                              "mixed traces (0 for random order)"))
+    parser.add_argument("--num_ops", type=int, default=200000,
+                        help="Ops per mixed trace (after filling the queue)")
+    parser.add_argument("--num_lps", type=int, nargs="+", default=[1, 4])
+    parser.add_argument("--bitmap_width", type=int, nargs="+",
+                        default=[0, 2, 4, 8])
+    parser.add_argument("--eliminate_dead_signals", action="store_true",
+                        help="Also profile dead-signal elimination")
+    parser.add_argument("--output", type=str, default=None,
+                        help="Output path for profiling results (JSON)")
+    args = parser.parse_args()
+
+    if args.reference:
+        run_reference_benchmark(args.levels or [2, 3], 32, args.run_lengths,
+                                args.num_ops, args.num_runs)
+        sys.exit(0)
+
+    if not args.profile:
+        run_codegen_benchmark(args.levels or [1, 2, 4, 8, 12, 15],
+                              args.num_runs)
+        sys.exit(0)
+
+    configs = expand_grid(args.levels or list(range(1, 16)),
+                          args.num_lps, args.bitmap_width)
+
+    results = run_profile_suite(configs, args.num_runs,
+                                args.eliminate_dead_signals)
+
+    if args.output is None:
+        json.dump(results, sys.stdout, indent=4)
+        sys.stdout.write("\n")
+    else:
+        with atomic_open(args.output) as f:
+            json.dump(results, f, indent=4)
+            f.write("\n")
@@ -0,0 +1,100 @@
+#!/usr/bin/python3
+from __future__ import annotations
+
+import filecmp
+import glob
+import hashlib
+import json
+import os
+import shutil
+import typing
+from typing import TextIO
+
+from util import atomic_open
+
+# Hack for type hinting with circular imports
+if typing.TYPE_CHECKING: from bbq import BBQ
+
+# Generator modules that determine the generated code (analysis tools,
+# such as the simulator or the DSE driver, do not invalidate the cache)
+SOURCE_PATTERNS = ("bbq*.py", "codegen.py", "fragments.py", "ir.py",
+                   "passes.py", "util.py")
+
+
+class GeneratorCache:
+    """Content-addressed on-disk cache of generated BBQs. Entries are
+    keyed by the BBQ configuration and the generator's source code
+    (i.e., the modules that affect generation; see SOURCE_PATTERNS)."""
+    source_digest: str = None               # Digest of generator sources
+
+    def __init__(self, cache_dir: str) -> None:
+        self.cache_dir = cache_dir          # Cache directory
+        self.hits = 0                       # Number of cache hits
+        self.misses = 0                     # Number of cache misses
+        self.last_hit = False               # Was the last lookup a hit?
+        os.makedirs(cache_dir, exist_ok=True)
+
+
+    @classmethod
+    def get_source_digest(cls) -> str:
+        """Returns a digest of the generator's source files."""
+        if cls.source_digest is None:
+            sha = hashlib.sha256()
+            src_dir = os.path.dirname(os.path.abspath(__file__))
+            paths = {path for pattern in SOURCE_PATTERNS for path in
+                     glob.glob(os.path.join(src_dir, pattern))}
+            for path in sorted(paths):
+                sha.update(os.path.basename(path).encode())
+                with open(path, "rb") as f:
+                    sha.update(hashlib.sha256(f.read()).digest())
+
+            cls.source_digest = sha.hexdigest()
+
+        return cls.source_digest
+
+
+    def key(self, bbq: BBQ) -> str:
+        """Returns the cache key for the given BBQ."""
+        sha = hashlib.sha256()
+        sha.update(json.dumps(bbq.config, sort_keys=True).encode())
+        sha.update(self.get_source_digest().encode())
+        return sha.hexdigest()
+
+
+    def fetch(self, bbq: BBQ) -> str:
+        """Returns the path to the cached code for the given
+        BBQ, generating (and caching) it if required."""
+        path = os.path.join(self.cache_dir, "{}.sv".format(self.key(bbq)))
+        self.last_hit = os.path.isfile(path)
+
+        if self.last_hit: self.hits += 1
+        else:
+            self.misses += 1
+            with atomic_open(path) as f:
+                bbq.write(f)
+
+        return path
+
+
+    def copy(self, bbq: BBQ, sink: TextIO) -> None:
+        """Streams the code for the given BBQ to the sink."""
+        with open(self.fetch(bbq), "r") as f:
+            shutil.copyfileobj(f, sink)
+
+
+    def install(self, bbq: BBQ, output: str) -> None:
+        """Writes the code for the given BBQ to output. If output
+        is already up-to-date, it is left untouched so that its
+        timestamp (used for incremental compilation) is stable."""
+        path = self.fetch(bbq)
+        if (os.path.isfile(output) and
+            filecmp.cmp(path, output, shallow=False)): return
+
+        with open(path, "r") as src, atomic_open(output) as dst:
+            shutil.copyfileobj(src, dst)
+
+
+    def report(self) -> str:
+        """Summary of cache lookups."""
+        return "[cache] {} hit(s), {} miss(es) in {}".format(
+            self.hits, self.misses, self.cache_dir)
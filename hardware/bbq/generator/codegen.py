@@ -1,15 +1,54 @@
 #!/usr/bin/python3
 import math
-from collections import deque
-from typing import List, Tuple
+import re
+from contextlib import contextmanager
+from typing import Iterator, List, TextIO, Tuple
+
+from ir import (Assign, Block, CaseItem, Comment, Conditional, Decl,
+                Enum, For, Ifdef, Instance, Node, Raw, Switch, Text)
+
+# Single-line statements that are lifted into structured IR nodes
+DECL_RE = re.compile(r"^((?:logic|integer|\w+_t)(?: \[[^\]]*\])?) (\w+)(.*;.*)$")
+ASSIGN_RE = re.compile(r"^(assign )?(\w[^\s=<]*) (<=|=) (.*;.*)$")
 
 class CodeGen:
-    """Backend for generating SystemVerilog code."""
+    """Backend for generating SystemVerilog code. Emitted code is
+    recorded as IR (see ir.py) and only rendered to text on demand."""
     def __init__(self) -> None:
-        self.out = ""                       # Emitted code
+        self.nodes: List[Node] = []         # Top-level IR nodes
         self.level = 0                      # Current indent level
         self.spacing = 4                    # Spacing per indent level
-        self.stack = deque()                # Stack for tracking blocks
+        self.stack: List[Block] = []        # Stack for tracking blocks
+        self.owner: str = None              # Owner of emitted nodes
+
+
+    @property
+    def out(self) -> str:
+        """Fetch the emitted code."""
+        return "".join(self.chunks())
+
+
+    def chunks(self) -> Iterator[str]:
+        """Renders the IR, yielding chunks of code."""
+        for node in self.nodes:
+            yield from node.render(self.spacing)
+
+
+    def render(self, sink: TextIO) -> None:
+        """Streams the rendered code to the given sink."""
+        for chunk in self.chunks():
+            sink.write(chunk)
+
+
+    def flush(self, sink: TextIO) -> None:
+        """Streams the completed top-level nodes to the given
+        sink, and drops them (keeping any still-open block)."""
+        num_done = len(self.nodes) - (1 if self.stack else 0)
+        for node in self.nodes[:num_done]:
+            for chunk in node.render(self.spacing):
+                sink.write(chunk)
+
+        del self.nodes[:num_done]
 
 
     @property
@@ -22,6 +61,27 @@ class CodeGen:
         """Creates multi-tab indents."""
         return " " * self.spacing * num
 
+
+    def append(self, node: Node) -> None:
+        """Append an IR node to the current block."""
+        node.owner = self.owner
+        if self.stack: self.stack[-1].body.append(node)
+        else: self.nodes.append(node)
+
+
+    @contextmanager
+    def owned_by(self, owner: str) -> Iterator[None]:
+        """Attributes nodes emitted within the context to owner."""
+        prev_owner, self.owner = self.owner, owner
+        try: yield
+        finally: self.owner = prev_owner
+
+
+    def write(self, x: str) -> None:
+        """Append raw (pre-formatted) code to the output."""
+        self.append(Raw(self.level, x))
+
+
     def inc_level(self) -> None:
         """Add indentation."""
         self.level += 1
@@ -33,47 +93,49 @@ class CodeGen:
         self.level -= 1
 
 
-    def _format_str(self, x: str, offset: int) -> str:
-        """Formats a string with the current indent."""
-        assert isinstance(x, str) # Sanity check
-        if not x: return x # Leave empty strings
-        return (" " * (self.indent + offset)) + x
+    def _lift(self, x: str) -> Node:
+        """Lifts a single line of code into an IR node."""
+        match = DECL_RE.match(x)
+        if match:
+            return Decl(self.level, match.group(1),
+                        match.group(2), match.group(3))
+
+        match = ASSIGN_RE.match(x)
+        if match:
+            return Assign(self.level, match.group(2),
+                          ("assign" if match.group(1) else
+                           match.group(3)), match.group(4))
+
+        return Text(self.level, [x])
 
 
     def emit(self, x: str | List[str]="", indent_first: bool=True,
              offset: int=0, trailing_newline: bool=True) -> None:
         """Emit str (or list thereof) with the current indent."""
-        if isinstance(x, str):
-            if x: # Not an empty string
-                self.out += (self._format_str(x, offset)
-                             if indent_first else x)
+        if isinstance(x, str): x = [x]
+        else: assert isinstance(x, list) # Sanity check
 
-        elif isinstance(x, list):
-            first = True
+        # Common case: one statement per line
+        if indent_first and trailing_newline and (offset == 0):
+            num_lines = 0
             for v in x:
                 if v is None: continue
-                self.out += ((self._format_str(v, offset) if indent_first else v)
-                             if first else "\n{}".format(self._format_str(v, offset)))
+                self.append(self._lift(v))
+                num_lines += 1
 
-                first = False # First valid value
+            if num_lines == 0: self.append(Text(self.level, [""]))
 
-        # Sanity check
-        else: assert False
-        if trailing_newline: self.out += "\n"
+        else:
+            self.append(Text(self.level, x, indent_first,
+                             offset, trailing_newline))
 
 
     def comment(self, x: str | List[str], is_block: bool=False) -> None:
         """Emits a block or inline comment."""
-        if is_block: self.emit("/**")
+        if isinstance(x, str): x = [x]
+        else: assert isinstance(x, list)
 
-        prefix = " * " if is_block else "// "
-        if isinstance(x, str):
-            self.emit(prefix + x)
-        else:
-            assert isinstance(x, list)
-            for v in x: self.emit(prefix + v)
-
-        if is_block: self.emit(" */")
+        self.append(Comment(self.level, x, is_block))
 
 
     def enum(self, name: str, values: List[str]) -> None:
@@ -88,29 +150,17 @@ class CodeGen:
         logictype = ("logic" if (log_num_values == 1) else
                      "logic [{}:0]".format(log_num_values - 1))
 
-        self.emit("typedef enum {} {{".format(logictype))
-        self.inc_level()
-
-        for idx in range(len(values)):
-            self.emit(values[idx], True, 0, False)
-            if idx != (len(values) - 1): self.out += ","
-            self.emit()
-
-        self.dec_level()
-        self.emit("}} {};".format(name))
+        self.append(Enum(self.level, name, logictype, values))
 
 
     def align_assignment(self, lhs: str, rhs: str | List[str],
                          assign: str, tab_indent: bool=False) -> None:
         """Emit code of type: lhs = (rhs... (multi-line))."""
-        assign_str = "{} {} ".format(lhs, assign)
-        self.emit(assign_str, True, 0, False)
-
         # Account for additional brace/bracket
         offset = (self.spacing if tab_indent
-                  else (len(assign_str) + 1))
+                  else (len("{} {} ".format(lhs, assign)) + 1))
 
-        self.emit(rhs, False, offset, True)
+        self.append(Assign(self.level, lhs, assign, rhs, offset))
 
 
     def align_defs(self, defs: List[Tuple], align : int=40) -> None:
@@ -119,7 +169,14 @@ class CodeGen:
             if rhs is None: continue
             padding = align - len(lhs)
             assert padding > 0 # Sanity check
-            self.emit(lhs + (" " * padding) + rhs)
+
+            # Not a signal (e.g., localparam <name> = <value>;)
+            match = re.match(r"(\w+)(.*)$", rhs)
+            if not match:
+                self.append(Text(self.level, [lhs + (" " * padding) + rhs]))
+            else:
+                self.append(Decl(self.level, lhs, match.group(1),
+                                 match.group(2), align))
 
 
     def _align_ternary_value(self, value: str | List[str],
@@ -206,94 +263,92 @@ class CodeGen:
             value[-1] = value[-1] + ");"
             output_list.extend(value)
 
-        self.emit(output_list)
+        prefix = "{} {} ".format(lhs, assign)
+        assert output_list[0].startswith(prefix)
+        output_list[0] = output_list[0][len(prefix):]
+        self.append(Assign(self.level, lhs, assign, output_list, 0))
+
+
+    def instance(self, module: str, name: str,
+                 params: List[Tuple[str, str]],
+                 ports: List[Tuple[str, str]]) -> None:
+        """Emit a module instantiation."""
+        self.append(Instance(self.level, module, name, params, ports))
+
+
+    def _open(self, block: Block, indent: bool=True) -> None:
+        """Start a new block."""
+        self.append(block)
+        self.stack.append(block)
+        if indent: self.inc_level()
+
+
+    def _close(self, cls: type, header: str=None,
+               indent: bool=True) -> None:
+        """End the current block."""
+        if indent: self.dec_level()
+        block = self.stack.pop()
+        assert type(block) is cls # Sanity check
+        if header is not None: assert block.header == header
 
 
     def start_block(self, name: str) -> None:
         """Start a generic begin/end block."""
-        self.emit("{} begin".format(name))
-        self.stack.append(name)
-        self.inc_level()
+        self._open(Block(self.level, name))
 
 
     def end_block(self, name: str) -> None:
         """End generic begin/end block."""
-        self.dec_level()
-        self.emit("end")
-        assert self.stack.pop() == name
+        self._close(Block, name)
 
 
     def start_conditional(self, type: str, condition:
                           str | List[str]) -> None:
         """Start a conditional (if, else) block."""
         assert type in ["if", "else", "else if"]
-
-        if type == "else":
-            self.emit("else begin")
-        else:
-            self.emit("{} (".format(type), True, 0, False)
-            self.emit(condition, False, len(type) + 2, False)
-            self.emit(") begin", False, 0, True)
-
-        self.stack.append(type)
-        self.inc_level()
+        self._open(Conditional(self.level, type,
+                               None if type == "else" else condition))
 
 
     def end_conditional(self, type: str) -> None:
         """Ends the current conditional block."""
-        self.dec_level()
-        self.emit("end")
-        assert self.stack.pop() == type
+        self._close(Conditional, type)
 
 
     def start_for(self, var: str, condition: str) -> None:
         """Start a for block."""
-        self.emit("for ({0} = 0; {1}; {0} = {0} + 1) begin"
-                  .format(var, condition))
-
-        self.stack.append("for")
-        self.inc_level()
+        self._open(For(self.level, var, condition))
 
 
     def end_for(self) -> None:
         """Ends for block."""
-        self.dec_level()
-        self.emit("end")
-        assert self.stack.pop() == "for"
+        self._close(For)
 
 
     def start_switch(self, name: str) -> None:
         """Start a new switch/case block."""
-        self.emit("case ({})".format(name))
-        self.stack.append("switch")
+        self._open(Switch(self.level, name), False)
 
 
     def end_switch(self) -> None:
         """End case block."""
-        self.emit("endcase")
-        assert self.stack.pop() == "switch"
+        self._close(Switch, None, False)
 
 
     def start_case(self, casename: str) -> None:
         """Start a new switch/case statement."""
-        self.emit("{}: begin".format(casename))
-        self.stack.append("case")
-        self.inc_level()
+        self._open(CaseItem(self.level, casename))
 
 
     def end_case(self) -> None:
         """End current case."""
-        self.dec_level()
-        self.emit("end")
-        assert self.stack.pop() == "case"
+        self._close(CaseItem)
 
     def start_ifdef(self, condition: str) -> None:
         """Start a new ifdef block."""
-        self.emit("`ifdef {}".format(condition))
-        self.stack.append("ifdef")
+        self._open(Ifdef(self.level, condition), False)
 
 
     def end_ifdef(self) -> None:
         """End current ifdef block."""
-        self.emit("`endif")
-        assert self.stack.pop() == "ifdef"
+        self._close(Ifdef, None, False)
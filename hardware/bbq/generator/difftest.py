@@ -0,0 +1,367 @@
+#!/usr/bin/python3
+from __future__ import annotations
+
+import argparse
+import shlex
+import subprocess
+import sys
+import tempfile
+from abc import ABC, abstractmethod
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from bbq import BBQ
+from golden import TB_OUTPUT_DELAY, GoldenGenerator
+from reference import TRACE_DTYPE, make_trace
+from simulator import HeapOp, Simulator
+
+# A trace with the arrival cycle of each op (as read by golden.py)
+CYCLE_TRACE_DTYPE = np.dtype(TRACE_DTYPE.descr + [("cycle", np.int64)])
+
+
+class Backend(ABC):
+    """Represents a simulator that runs a BBQ's RTL. Backends replay
+    golden stimulus (see GoldenGenerator.generate), and check that the
+    outputs match the expected ones, cycle by cycle."""
+    @abstractmethod
+    def name(self) -> str:
+        """Canonical backend name."""
+        raise NotImplementedError()
+
+
+    @abstractmethod
+    def mismatch(self, golden: dict) -> Optional[str]:
+        """Runs the stimulus. Returns a description of the first output
+        that does not match the expected one (or None, if all match)."""
+        raise NotImplementedError()
+
+
+class SimulatorBackend(Backend):
+    """Runs the cycle-accurate simulator, which is compiled from the
+    same IR as the generated RTL."""
+    def __init__(self, generator: GoldenGenerator) -> None:
+        bbq = generator.analyzer.bbq
+        self.bbq = bbq
+        self.params = {
+            "HEAP_ENTRY_DWIDTH": generator.data_width,
+            "HEAP_MAX_NUM_ENTRIES": generator.analyzer.max_num_entries,
+        }
+        if not bbq.is_logically_partitioned:
+            self.params["HEAP_BITMAP_WIDTH"] = generator.analyzer.bitmap_width
+
+        self.drain_cycles = bbq.num_pipeline_stages + 1
+
+
+    def name(self) -> str:
+        return "simulator"
+
+
+    def run(self, golden: dict) -> List[Tuple[int, int, int, int]]:
+        """Returns the (cycle, op, priority, data) of each output."""
+        simulator = Simulator(self.bbq, self.params)
+        simulator.reset()
+
+        stimulus = golden["stimulus"]
+        cycles = golden["stimulus_cycles"].tolist()
+        ops = list(zip(stimulus["op_type"].tolist(),
+                       stimulus["data"].tolist(),
+                       stimulus["priority"].tolist()))
+
+        # Output cycles follow the testbench's convention (TEST_GOLDEN)
+        outputs = []
+        num_cycles = (cycles[-1] if cycles else 0) + self.drain_cycles
+        (idx, cycle) = (0, 0)
+        while cycle < num_cycles:
+            if idx < len(ops) and cycles[idx] == cycle:
+                result = simulator.tick(True, *ops[idx])
+                idx += 1
+            else: result = simulator.tick()
+
+            if result is not None:
+                (op, data, priority) = result
+                outputs.append((cycle + 1 + TB_OUTPUT_DELAY,
+                                int(op), priority, data))
+            cycle += 1
+
+        return outputs
+
+
+    def mismatch(self, golden: dict) -> Optional[str]:
+        outputs = self.run(golden)
+        expected = golden["expected"]
+        expected = list(zip(golden["expected_cycles"].tolist(),
+                            expected["op_type"].tolist(),
+                            expected["priority"].tolist(),
+                            expected["data"].tolist()))
+
+        for (i, (x, y)) in enumerate(zip(expected, outputs)):
+            if x != y:
+                return ("Output {}: expected {}, got {}".format(
+                    i, format_output(x), format_output(y)))
+
+        if len(outputs) != len(expected):
+            return "Expected {} output(s), got {}".format(
+                len(expected), len(outputs))
+
+        return None
+
+
+class TestbenchBackend(Backend):
+    """Runs an external HDL simulator on the TEST_GOLDEN testcase of
+    tb/bbq/tb_bbq.sv: writes the golden files to the working directory,
+    runs the given command there, and looks for the testcase's verdict
+    in its output. The BBQ's parameters must match the testbench's."""
+    def __init__(self, generator: GoldenGenerator, command: str,
+                 working_dir: str, timeout: float=None) -> None:
+        self.generator = generator
+        self.command = shlex.split(command)
+        self.working_dir = working_dir
+        self.timeout = timeout
+
+
+    def name(self) -> str:
+        return "testbench"
+
+
+    def mismatch(self, golden: dict) -> Optional[str]:
+        self.generator.write(self.working_dir, golden)
+        result = subprocess.run(self.command, cwd=self.working_dir,
+                                capture_output=True, text=True,
+                                timeout=self.timeout)
+
+        for line in result.stdout.splitlines():
+            if line.startswith("PASS TEST_GOLDEN"): return None
+            if line.startswith("FAIL"): return line
+
+        return "No verdict (exit code {}): {}".format(
+            result.returncode, (result.stdout + result.stderr)[-512:])
+
+
+# Backends selectable from the command line
+BACKENDS: Dict[str, type] = {
+    "simulator": SimulatorBackend,
+    "testbench": TestbenchBackend,
+}
+
+
+def format_output(output: Tuple[int, int, int, int]) -> str:
+    """Renders a (cycle, op, priority, data) output."""
+    (cycle, op, priority, data) = output
+    return "({}, data: {}, priority: {}) at cycle {}".format(
+        HeapOp(op).name, data, priority, cycle)
+
+
+class DiffTester:
+    """Randomized differential tester. Generates random workloads for a
+    BBQ, runs them through the reference model and an RTL backend, and
+    diffs the outputs; on a mismatch, shrinks the workload to a minimal
+    reproducer. Workloads mix enqueues, deque-mins and deque-maxes, swing
+    between near-empty and near-full occupancy (so the ingress stage also
+    drops ops), and favor back-to-back ops to the same priority bucket."""
+    def __init__(self, generator: GoldenGenerator, backend: Backend,
+                 spacing: int=2, max_shrink_runs: int=2000) -> None:
+        self.generator = generator
+        self.backend = backend
+        self.spacing = spacing              # Minimum cycles between ops
+        self.max_shrink_runs = max_shrink_runs
+        self.num_runs = 0                   # Backend runs so far
+
+
+    def random_workload(self, num_ops: int,
+                        rng: np.random.Generator) -> np.ndarray:
+        """Returns a random workload (CYCLE_TRACE_DTYPE records)."""
+        analyzer = self.generator.analyzer
+        num_priorities = (analyzer.bitmap_width **
+                          analyzer.bbq.num_bitmap_levels)
+        capacity = analyzer.max_num_entries
+
+        workload = np.zeros(num_ops, dtype=CYCLE_TRACE_DTYPE)
+        (occupancy, filling, cycle) = (0, True, 0)
+        recent: List[int] = [int(rng.integers(num_priorities))]
+        for i in range(num_ops):
+            # Alternate between filling up and draining the queue
+            if occupancy >= capacity: filling = (rng.random() < 0.1)
+            elif occupancy <= 0: filling = (rng.random() > 0.1)
+            elif rng.random() < 0.02: filling = not filling
+
+            enque = rng.random() < (0.8 if filling else 0.2)
+
+            # Reuse a recent bucket, a neighboring one, or a random one
+            choice = rng.random()
+            priority = recent[int(rng.integers(len(recent)))]
+            if choice >= 0.6: priority = int(rng.integers(num_priorities))
+            elif choice >= 0.4:
+                priority = (priority ^ int(rng.integers(1, analyzer.
+                    bitmap_width))) % num_priorities
+
+            recent = (recent + [priority])[-4:]
+            if enque: occupancy = min(occupancy + 1, capacity)
+            else: occupancy = max(occupancy - 1, 0)
+
+            workload[i] = (HeapOp.ENQUE if enque else
+                           int(rng.integers(HeapOp.DEQUE_MIN,
+                                            HeapOp.DEQUE_MAX + 1)),
+                           i, priority, cycle)
+
+            # Mostly back-to-back ops, with occasional idle cycles
+            cycle += self.spacing
+            if rng.random() < 0.1:
+                cycle += int(rng.integers(1, analyzer.latency))
+
+        return workload
+
+
+    def mismatch(self, workload: np.ndarray) -> Optional[str]:
+        """Runs a workload on the backend, and diffs the outputs."""
+        self.num_runs += 1
+        trace = make_trace(workload["op_type"], workload["data"],
+                           workload["priority"])
+        golden = self.generator.generate(trace, workload["cycle"],
+                                         self.spacing)
+        return self.backend.mismatch(golden)
+
+
+    def shrink(self, workload: np.ndarray) -> np.ndarray:
+        """Returns a (locally) minimal workload that still mismatches:
+        removes chunks of ops, closes idle gaps between them, and then
+        simplifies each op (its type, priority and data)."""
+        budget = self.num_runs + self.max_shrink_runs
+        def fails(candidate: np.ndarray) -> bool:
+            return (self.num_runs < budget and
+                    self.mismatch(candidate) is not None)
+
+        # Remove chunks of ops, halving the chunk size
+        chunk = len(workload) // 2
+        while chunk >= 1:
+            start = 0
+            while start < len(workload):
+                candidate = np.delete(workload, np.s_[start:start + chunk])
+                if len(candidate) and fails(candidate): workload = candidate
+                else: start += chunk
+
+            chunk //= 2
+
+        # Close idle gaps (all at once, then one at a time)
+        candidate = workload.copy()
+        candidate["cycle"] = 0
+        if fails(candidate): workload = candidate
+        for i in range(len(workload)):
+            gap = workload["cycle"][i] - (workload["cycle"][i - 1]
+                                          if i else 0)
+            if gap == 0: continue
+
+            candidate = workload.copy()
+            candidate["cycle"][i:] -= gap
+            if fails(candidate): workload = candidate
+
+        # Simplify ops: prefer deque-mins, low priorities and small data
+        for i in range(len(workload)):
+            for (field, value) in (("op_type", HeapOp.DEQUE_MIN),
+                                   ("priority", 0), ("data", i)):
+                if field == "op_type" and (
+                        workload[i]["op_type"] != HeapOp.DEQUE_MAX): continue
+
+                if workload[field][i] == value: continue
+
+                candidate = workload.copy()
+                candidate[field][i] = value
+                if fails(candidate): workload = candidate
+
+        return workload
+
+
+    def run(self, num_workloads: int, num_ops: int,
+            seed: int=0) -> Optional[Tuple[np.ndarray, str]]:
+        """Tests random workloads. Returns the first mismatching one
+        (shrunk) and its mismatch, or None if all of them match."""
+        for i in range(num_workloads):
+            rng = np.random.default_rng((seed, i))
+            workload = self.random_workload(num_ops, rng)
+            if self.mismatch(workload) is None: continue
+
+            workload = self.shrink(workload)
+            return (workload, self.mismatch(workload))
+
+        return None
+
+
+def format_workload(workload: np.ndarray) -> str:
+    """Renders a workload as a table of ops."""
+    lines = ["{:>8} {:<18} {:>10} {:>10}".format(
+        "Cycle", "Op", "Priority", "Data")]
+    for (op, data, priority, cycle) in workload.tolist():
+        lines.append("{:>8} {:<18} {:>10} {:>10}".format(
+            cycle, "HEAP_OP_" + HeapOp(op).name, priority, data))
+
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        prog="difftest", description=("Differentially tests a BBQ's RTL "
+                                      "against the reference model on "
+                                      "random workloads."))
+
+    parser.add_argument("num_bitmap_levels", type=int)
+    parser.add_argument("--num_lps", type=int, default=1)
+    parser.add_argument("--calendar", action="store_true",
+                        help="Use a circular priority space (of L1 buckets)")
+    parser.add_argument("--bitmap_width", type=int, default=4)
+    parser.add_argument("--max_num_entries", type=int, default=31)
+    parser.add_argument("--data_width", type=int, default=16)
+    parser.add_argument("--backend", type=str, default="simulator",
+                        choices=sorted(BACKENDS))
+    parser.add_argument("--command", type=str, default=None,
+                        help=("Command that runs TEST_GOLDEN (for the "
+                              "testbench backend)"))
+    parser.add_argument("--working_dir", type=str, default=None,
+                        help=("Directory the command runs in, and the golden "
+                              "files are written to (for the testbench "
+                              "backend; default: a temporary directory)"))
+    parser.add_argument("--num_workloads", type=int, default=100)
+    parser.add_argument("--num_ops", type=int, default=200)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--spacing", type=int, default=2,
+                        help=("Minimum number of cycles between ops (at 1, "
+                              "dependent dequeues may not match the RTL)"))
+    parser.add_argument("--max_shrink_runs", type=int, default=2000)
+    parser.add_argument("--output", type=str, default=None,
+                        help=("Output path for a mismatching workload (.npy, "
+                              "replayable with golden.py --trace)"))
+    args = parser.parse_args()
+
+    try:
+        bbq = BBQ(args.num_bitmap_levels, args.num_lps,
+                  args.bitmap_width if args.num_lps > 1 else 0,
+                  calendar=args.calendar)
+        generator = GoldenGenerator(bbq, args.bitmap_width,
+                                    args.max_num_entries, args.data_width)
+    except ValueError as e: parser.error(str(e))
+
+    kwargs = {}
+    if args.backend == "testbench":
+        if args.command is None:
+            parser.error("The testbench backend requires --command.")
+        kwargs = {"command": args.command, "working_dir": (
+            args.working_dir or tempfile.mkdtemp(prefix="difftest_"))}
+
+    backend = BACKENDS[args.backend](generator, **kwargs)
+
+    tester = DiffTester(generator, backend, args.spacing,
+                        args.max_shrink_runs)
+    result = tester.run(args.num_workloads, args.num_ops, args.seed)
+    if result is None:
+        print("[difftest] {} workload(s) of {} op(s) matched ({})".format(
+            args.num_workloads, args.num_ops, backend.name()),
+            file=sys.stderr)
+        sys.exit(0)
+
+    (workload, mismatch) = result
+    print(format_workload(workload))
+    print("[difftest] Mismatch ({}, {} op(s) after {} run(s)): {}".format(
+        backend.name(), len(workload), tester.num_runs, mismatch),
+        file=sys.stderr)
+    if args.output is not None:
+        np.save(args.output, workload)
+    sys.exit(1)
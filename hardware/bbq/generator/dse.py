@@ -0,0 +1,645 @@
+#!/usr/bin/python3
+from __future__ import annotations
+
+import argparse
+import hashlib
+import itertools
+import json
+import math
+import os
+import re
+import shutil
+import sqlite3
+import subprocess
+import sys
+import threading
+import time
+from abc import ABC, abstractmethod
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+from batch import config_name, expand_grid
+from bbq import BBQ
+from cache import GeneratorCache
+from passes import DeadSignalElimination
+from resources import ResourceEstimator, top_params
+from util import atomic_open
+
+# Root of the BBQ project (src, ip, quartus, ...)
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Spec keys (and defaults) that are swept over
+SPEC_DEFAULTS = {
+    "levels": [],
+    "num_lps": [1],
+    "bitmap_width": [32],
+    "element_bits": [17],
+    "seeds": [0],
+    "freq_mhz": [300],
+}
+
+
+def sweep_config_name(config: dict) -> str:
+    """Canonical name for a swept configuration."""
+    name = "{}_n{}".format(config_name(config), config["element_bits"])
+    for key in ("sram_bitmaps", "sram_counters"):
+        if config.get(key) is not None:
+            name += "_{}{}".format("".join(x[0] for x in key.split("_")),
+                                   "-".join(map(str, config[key])) or "none")
+
+    return name
+
+
+def job_name(job: dict) -> str:
+    """Canonical (directory) name for a synthesis job."""
+    return "{}_s{}_f{}".format(sweep_config_name(job), job["seed"],
+                               job["freq_mhz"])
+
+
+def job_config(job: dict) -> dict:
+    """Returns a job's configuration (i.e., sans seed and frequency)."""
+    return {x: v for (x, v) in job.items() if x not in ("seed", "freq_mhz")}
+
+
+def job_key(job: dict) -> str:
+    """Key identifying a job's result in the store."""
+    return json.dumps(job, sort_keys=True)
+
+
+def expand_configs(spec: dict) -> List[dict]:
+    """Returns the configurations of a sweep spec: the cross-product of
+    its levels, num_lps, bitmap_width and element_bits (skipping grid
+    points with more than max_num_priorities), plus the listed configs."""
+    spec = {**SPEC_DEFAULTS, **spec}
+    configs = []
+    for config in expand_grid(spec["levels"], spec["num_lps"],
+                              spec["bitmap_width"],
+                              spec.get("max_num_priorities")):
+        for element_bits in spec["element_bits"]:
+            configs.append({**config, "element_bits": element_bits})
+
+    for config in spec.get("configs", []):
+        configs.append({"num_lps": 1, "bitmap_width": 32,
+                        "element_bits": 17, **config})
+
+    return configs
+
+
+def expand_spec(spec: dict) -> List[dict]:
+    """Returns the jobs of a sweep spec: each of its configurations,
+    synthesized for every seed and target frequency."""
+    spec = {**SPEC_DEFAULTS, **spec}
+    jobs = []
+    for (config, seed, freq) in itertools.product(
+            expand_configs(spec), spec["seeds"], spec["freq_mhz"]):
+        jobs.append({**config, "seed": seed, "freq_mhz": freq})
+
+    return jobs
+
+
+def make_bbq(job: dict, eliminate_dead_signals: bool=False) -> BBQ:
+    """Returns the BBQ for a job's configuration."""
+    bbq = BBQ(job["num_bitmap_levels"], job["num_lps"],
+              job["bitmap_width"] if job["num_lps"] > 1 else 0,
+              sram_bitmaps=job.get("sram_bitmaps"),
+              sram_counters=job.get("sram_counters"))
+
+    if eliminate_dead_signals:
+        bbq.passes.append(DeadSignalElimination())
+
+    return bbq
+
+
+class Synthesizer(ABC):
+    """Represents a synthesis flow. Given a job and its generated BBQ
+    source, runs it in the job's (empty) working directory, and returns
+    a dict with its outcome: whether timing is met at the target
+    frequency (timing_met), the achieved fmax (fmax_mhz) and worst setup
+    slack (slack_ns), and, if known, the ALMs, registers and M20Ks used
+    (alms, registers, m20ks). Raises an exception if the flow fails."""
+    @abstractmethod
+    def name(self) -> str:
+        """Canonical synthesizer name."""
+        raise NotImplementedError()
+
+
+    @abstractmethod
+    def memory_mb(self, job: dict) -> int:
+        """Peak memory (in MB) the job is expected to take."""
+        raise NotImplementedError()
+
+
+    @abstractmethod
+    def run(self, job: dict, bbq_path: str, work_dir: str) -> dict:
+        """Synthesizes the job. Returns its outcome."""
+        raise NotImplementedError()
+
+
+class QuartusSynthesizer(Synthesizer):
+    """Runs the flow of scripts/synthesize.sh (minus the assembler) on
+    a lightweight copy of the project: the Quartus project files and the
+    PLL are copied (the latter generated for the target frequency, as in
+    setup.sh), while the sources are symlinked."""
+    def __init__(self, job_memory_mb: int=16384, keep_files: bool=False,
+                 project_dir: str=PROJECT_DIR) -> None:
+        self.job_memory_mb = job_memory_mb
+        self.keep_files = keep_files        # Keep the Quartus database?
+        self.project_dir = project_dir
+
+
+    def name(self) -> str:
+        return "quartus"
+
+
+    def memory_mb(self, job: dict) -> int:
+        return self.job_memory_mb
+
+
+    def setup(self, bbq_path: str, work_dir: str, freq_mhz: int) -> None:
+        """Populates the working directory."""
+        src_dir = os.path.join(work_dir, "src")
+        os.makedirs(src_dir)
+        for name in os.listdir(os.path.join(self.project_dir, "src")):
+            if name == "bbq.sv": continue
+            os.symlink(os.path.join(self.project_dir, "src", name),
+                       os.path.join(src_dir, name))
+
+        shutil.copyfile(bbq_path, os.path.join(src_dir, "bbq.sv"))
+        shutil.copytree(os.path.join(self.project_dir, "quartus"),
+                        os.path.join(work_dir, "quartus"),
+                        ignore=shutil.ignore_patterns(
+                            "output_files", "qdb", "tmp-clearbox", "*.log"))
+
+        ip_dir = os.path.join(work_dir, "ip")
+        os.makedirs(ip_dir)
+        with open(os.path.join(self.project_dir, "ip",
+                               "my_pll.tcl.template"), "r") as f:
+            tcl = f.read().replace("{{{out_freq}}}", "{}.0".format(freq_mhz))
+        with open(os.path.join(ip_dir, "my_pll.tcl"), "w") as f:
+            f.write(tcl)
+
+
+    def run(self, job: dict, bbq_path: str, work_dir: str) -> dict:
+        if job["freq_mhz"] != int(job["freq_mhz"]):
+            raise ValueError("Target frequency must be an integer.")
+
+        self.setup(bbq_path, work_dir, int(job["freq_mhz"]))
+        ip_dir = os.path.join(work_dir, "ip")
+        quartus_dir = os.path.join(work_dir, "quartus")
+        project = ["bbq", "-c", "bbq"]
+        settings = ["--read_settings_files=on", "--write_settings_files=off"]
+
+        steps = [
+            (ip_dir, ["qsys-script", "--script=my_pll.tcl",
+                      "--quartus-project=../quartus/bbq.qsf"]),
+            (quartus_dir, ["quartus_ipgenerate", "bbq"]),
+            (quartus_dir, ["quartus_syn"] + settings + project + [
+                "--set=VERILOG_MACRO={}={}".format(x, v) for (x, v) in (
+                    ("BITMAP_WIDTH", job["bitmap_width"]),
+                    ("ELEMENT_BITS", job["element_bits"]),
+                    ("NUM_LEVELS", job["num_bitmap_levels"]))]),
+            (quartus_dir, ["quartus_fit"] + settings + project + [
+                "--seed={}".format(job["seed"])]),
+            (quartus_dir, ["quartus_sta"] + project + ["--mode=finalize"]),
+        ]
+        with open(os.path.join(work_dir, "quartus.log"), "w") as log:
+            for (cwd, command) in steps:
+                result = subprocess.run(command, cwd=cwd, stdout=log,
+                                        stderr=subprocess.STDOUT)
+                if result.returncode != 0:
+                    raise RuntimeError("{} exited with code {}".format(
+                        command[0], result.returncode))
+
+        # Keep the reports, and (optionally) drop the rest
+        output_dir = os.path.join(quartus_dir, "output_files")
+        for name in ("bbq.sta.rpt", "bbq.fit.summary"):
+            shutil.copy(os.path.join(output_dir, name), work_dir)
+
+        if not self.keep_files:
+            shutil.rmtree(quartus_dir)
+            shutil.rmtree(ip_dir)
+
+        with open(os.path.join(work_dir, "bbq.sta.rpt"), "r") as f:
+            outcome = parse_timing_report(f.read())
+        with open(os.path.join(work_dir, "bbq.fit.summary"), "r") as f:
+            outcome.update(parse_fit_summary(f.read()))
+
+        return outcome
+
+
+def parse_timing_report(report: str) -> dict:
+    """Parses a Quartus timing report (bbq.sta.rpt). The fmax and slack
+    are the worst across clocks and timing models."""
+    (fmaxes, slacks, in_setup) = ([], [], False)
+    for line in report.splitlines():
+        match = re.match(r"^;\s*([\d.]+) MHz\s*;\s*([\d.]+) MHz\s*;", line)
+        if match: fmaxes.append(float(match.group(2)))
+
+        if "Setup Summary" in line: in_setup = True
+        elif not line.strip(): in_setup = False
+        elif in_setup:
+            match = re.match(r"^;\s*\S+\s*;\s*(-?[\d.]+)\s*;", line)
+            if match: slacks.append(float(match.group(1)))
+
+    return {
+        "timing_met": (("Timing requirements not met" not in report) and
+                       not any(x < 0 for x in slacks)),
+        "fmax_mhz": min(fmaxes) if fmaxes else None,
+        "slack_ns": min(slacks) if slacks else None,
+    }
+
+
+def parse_fit_summary(summary: str) -> dict:
+    """Parses a Quartus fitter summary (bbq.fit.summary)."""
+    fields = {"alms": "Logic utilization (in ALMs)",
+              "registers": "Total dedicated logic registers",
+              "m20ks": "Total RAM Blocks"}
+
+    outcome = dict.fromkeys(fields)
+    for line in summary.splitlines():
+        (name, _, value) = line.partition(" : ")
+        for (x, field) in fields.items():
+            if name.strip() == field:
+                outcome[x] = int(value.split("/")[0].replace(",", ""))
+
+    return outcome
+
+
+class StubSynthesizer(Synthesizer):
+    """Stands in for Quartus (e.g., to test the driver or a sweep spec).
+    Reports a made-up, but deterministic, fmax that drops as bitmaps
+    widen and the queue grows, with a few percent of seed-dependent
+    noise. No resources are reported."""
+    def __init__(self, delay: float=0.0, job_memory_mb: int=64) -> None:
+        self.delay = delay                  # Seconds per job
+        self.job_memory_mb = job_memory_mb
+
+
+    def name(self) -> str:
+        return "stub"
+
+
+    def memory_mb(self, job: dict) -> int:
+        return self.job_memory_mb
+
+
+    def fmax_mhz(self, job: dict) -> float:
+        """Returns the job's (made-up) fmax."""
+        config = {x: v for (x, v) in job.items() if x != "freq_mhz"}
+        digest = hashlib.sha256(job_key(config).encode()).digest()
+        noise = (int.from_bytes(digest[:4], "big") / 0xffffffff) - 0.5
+
+        return round(600.0 * (1 + 0.04 * noise) / (
+            1 + 0.1 * math.log2(max(2, job["bitmap_width"])) +
+            0.02 * job["element_bits"] + 0.1 * (job["num_lps"] > 1)), 2)
+
+
+    def run(self, job: dict, bbq_path: str, work_dir: str) -> dict:
+        time.sleep(self.delay)
+        fmax = self.fmax_mhz(job)
+        slack = round(1000.0 / job["freq_mhz"] - 1000.0 / fmax, 3)
+        return {"timing_met": slack >= 0, "fmax_mhz": fmax,
+                "slack_ns": slack, "alms": None, "registers": None,
+                "m20ks": None}
+
+
+# Synthesizers selectable from the command line
+SYNTHESIZERS: Dict[str, type] = {
+    "quartus": QuartusSynthesizer,
+    "stub": StubSynthesizer,
+}
+
+
+class ResultStore:
+    """SQLite store of synthesis results, keyed by job. Results are
+    committed as soon as they are recorded, so an interrupted sweep
+    loses (at most) the jobs that were running."""
+    COLUMNS = [
+        ("key", "TEXT PRIMARY KEY"), ("name", "TEXT"),
+        ("num_bitmap_levels", "INTEGER"), ("num_lps", "INTEGER"),
+        ("bitmap_width", "INTEGER"), ("element_bits", "INTEGER"),
+        ("seed", "INTEGER"), ("freq_mhz", "REAL"),
+        ("status", "TEXT"),                 # "done" or "error"
+        ("timing_met", "INTEGER"), ("fmax_mhz", "REAL"), ("slack_ns", "REAL"),
+        ("alms", "INTEGER"), ("registers", "INTEGER"), ("m20ks", "INTEGER"),
+        ("duration", "REAL"), ("error", "TEXT"), ("synthesizer", "TEXT"),
+        ("source_digest", "TEXT"), ("finished_at", "REAL"),
+    ]
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.db = sqlite3.connect(path)
+        self.db.row_factory = sqlite3.Row
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("CREATE TABLE IF NOT EXISTS results ({})".format(
+            ", ".join("{} {}".format(x, t) for (x, t) in self.COLUMNS)))
+        self.db.commit()
+
+
+    def finished(self, retry_errors: bool=False) -> set:
+        """Returns the keys of the jobs that need not be run again."""
+        query = "SELECT key FROM results"
+        if retry_errors: query += " WHERE status = 'done'"
+        return {row["key"] for row in self.db.execute(query)}
+
+
+    def record(self, job: dict, row: dict) -> None:
+        """Records (or replaces) the result of a job."""
+        row = {**{x: job.get(x) for (x, _) in self.COLUMNS},
+               "key": job_key(job), "name": job_name(job), **row}
+
+        self.db.execute("INSERT OR REPLACE INTO results ({}) VALUES ({})".format(
+            ", ".join(x for (x, _) in self.COLUMNS),
+            ", ".join("?" for _ in self.COLUMNS)),
+            [row.get(x) for (x, _) in self.COLUMNS])
+        self.db.commit()
+
+
+    def results(self, where: str="1", args: tuple=()) -> List[dict]:
+        """Returns the recorded results matching the SQL condition."""
+        return [dict(row) for row in self.db.execute(
+            "SELECT * FROM results WHERE {} ORDER BY name".format(where), args)]
+
+
+    def close(self) -> None:
+        self.db.close()
+
+
+def available_memory_mb() -> Optional[int]:
+    """Returns the memory available for new processes, if known."""
+    try:
+        with open("/proc/meminfo", "r") as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) // 1024
+
+    except OSError: pass
+    return None
+
+
+class WorkerPool:
+    """Runs jobs on a bounded number of threads, reserving each job's
+    expected memory: a job only starts if it fits in the memory left by
+    the running ones (or if nothing else is running). When the next job
+    does not fit, smaller ones further down the queue are started."""
+    def __init__(self, max_workers: int,
+                 memory_budget_mb: Optional[int]=None) -> None:
+        self.max_workers = max_workers
+        self.memory_budget_mb = memory_budget_mb
+
+
+    def run(self, jobs: List[dict], fn: Callable[[dict], dict],
+            memory_mb: Callable[[dict], int]
+            ) -> Iterator[Tuple[dict, Future]]:
+        """Runs fn on every job. Yields each job and its (completed)
+        future as soon as it finishes. Jobs appended to the list in the
+        meantime are run as well."""
+        pending = jobs
+        running: Dict[Future, Tuple[dict, int]] = {}
+        reserved = 0
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            try:
+                while pending or running:
+                    idx = 0
+                    while (idx < len(pending) and
+                           len(running) < self.max_workers):
+                        memory = memory_mb(pending[idx])
+                        if (running and (self.memory_budget_mb is not None) and
+                            (reserved + memory > self.memory_budget_mb)):
+                            idx += 1
+                            continue
+
+                        job = pending.pop(idx)
+                        running[executor.submit(fn, job)] = (job, memory)
+                        reserved += memory
+
+                    (done, _) = wait(running, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        (job, memory) = running.pop(future)
+                        reserved -= memory
+                        yield (job, future)
+
+            except BaseException:
+                for future in running: future.cancel()
+                raise
+
+
+class Driver:
+    """Design-space exploration driver. Generates each job's BBQ (via
+    the BBQ API, and the generator cache, if any), synthesizes it in a
+    per-job working directory, and streams the results into a store.
+    Jobs whose results are already stored are skipped, so a sweep can
+    be resumed after an interruption."""
+    def __init__(self, synthesizer: Synthesizer, store: ResultStore,
+                 work_dir: str, pool: WorkerPool, cache_dir: str=None,
+                 eliminate_dead_signals: bool=False) -> None:
+        self.synthesizer = synthesizer
+        self.store = store
+        self.work_dir = work_dir
+        self.pool = pool
+        self.cache = GeneratorCache(cache_dir) if cache_dir else None
+        self.eliminate_dead_signals = eliminate_dead_signals
+        self.generate_lock = threading.Lock()
+
+
+    def plan(self, jobs: List[dict], retry_errors: bool=False,
+             max_registers: int=None, max_m20ks: int=None
+             ) -> Tuple[List[dict], List[Tuple[dict, str]]]:
+        """Returns the jobs left to run, and the skipped ones (with the
+        reason). Jobs are skipped if their results are already stored,
+        if their configuration is invalid, or if they are not estimated
+        to fit the register and M20K budgets."""
+        finished = self.store.finished(retry_errors)
+        (todo, skipped, fits) = ([], [], {})
+        for job in jobs:
+            if job_key(job) in finished:
+                skipped.append((job, "finished"))
+                continue
+
+            config = job_key(job_config(job))
+            if config not in fits:
+                fits[config] = self.check(job, max_registers, max_m20ks)
+
+            if fits[config] is None: todo.append(job)
+            else: skipped.append((job, fits[config]))
+
+        return (todo, skipped)
+
+
+    def check(self, job: dict, max_registers: int=None,
+              max_m20ks: int=None) -> Optional[str]:
+        """Returns why a job's configuration cannot be synthesized (or
+        None, if it is valid and estimated to fit the budgets)."""
+        try: bbq = make_bbq(job)
+        except ValueError as e: return str(e)
+
+        if (max_registers is None) and (max_m20ks is None): return None
+        params = top_params(job["bitmap_width"], job["element_bits"])
+        totals = ResourceEstimator(bbq).estimate({
+            x: v for (x, v) in params.items()
+            if x in bbq.parameters})["totals"]
+
+        if (((max_registers is not None) and
+             (totals["register_bits"] > max_registers)) or
+            ((max_m20ks is not None) and (totals["m20ks"] > max_m20ks))):
+            return "does not fit"
+
+        return None
+
+
+    def generate(self, job: dict, path: str) -> None:
+        """Generates the job's BBQ source."""
+        with self.generate_lock:
+            bbq = make_bbq(job, self.eliminate_dead_signals)
+            if self.cache: self.cache.install(bbq, path)
+            else:
+                with atomic_open(path) as f:
+                    bbq.write(f)
+
+
+    def run_job(self, job: dict) -> dict:
+        """Generates and synthesizes a job. Returns its outcome."""
+        work_dir = os.path.join(self.work_dir, job_name(job))
+        shutil.rmtree(work_dir, ignore_errors=True)
+        os.makedirs(work_dir)
+
+        bbq_path = os.path.join(work_dir, "bbq.sv")
+        self.generate(job, bbq_path)
+        return self.synthesizer.run(job, bbq_path, work_dir)
+
+
+    def run(self, jobs: List[dict]) -> Iterator[Tuple[dict, dict]]:
+        """Runs the jobs. Yields each job and its stored result. Jobs
+        appended to the list in the meantime are run as well."""
+        def timed(job: dict) -> Tuple[dict, float]:
+            start = time.time()
+            return (self.run_job(job), time.time() - start)
+
+        for (job, future) in self.pool.run(jobs, timed,
+                                           self.synthesizer.memory_mb):
+            row = {"synthesizer": self.synthesizer.name(),
+                   "source_digest": GeneratorCache.get_source_digest(),
+                   "finished_at": time.time()}
+            try:
+                (outcome, duration) = future.result()
+                row.update(outcome, status="done", duration=duration)
+
+            except Exception as e:
+                row.update(status="error", error="{}: {}".format(
+                    type(e).__name__, e))
+
+            self.store.record(job, row)
+            yield (job, row)
+
+
+def format_result(row: dict) -> str:
+    """Summarizes a stored result."""
+    if row["status"] == "error": return "error ({})".format(row["error"])
+    return "{} (fmax {} MHz, slack {} ns) in {:.1f}s".format(
+        "met" if row["timing_met"] else "not met",
+        row["fmax_mhz"], row["slack_ns"], row["duration"])
+
+
+def add_arguments(parser: argparse.ArgumentParser) -> None:
+    """Adds the arguments of the driver (and synthesizers)."""
+    parser.add_argument("spec", type=str,
+                        help="JSON sweep spec (see README)")
+    parser.add_argument("--db", type=str, default="dse.sqlite",
+                        help="SQLite database for the results")
+    parser.add_argument("--work_dir", type=str, default="dse",
+                        help="Directory for the jobs' working directories")
+    parser.add_argument("--synthesizer", type=str, default="quartus",
+                        choices=sorted(SYNTHESIZERS))
+    parser.add_argument("--jobs", type=int, default=4,
+                        help="Maximum number of concurrent jobs")
+    parser.add_argument("--max_memory_mb", type=int, default=None,
+                        help=("Memory budget for concurrent jobs (default: "
+                              "the memory available at startup)"))
+    parser.add_argument("--job_memory_mb", type=int, default=None,
+                        help="Expected peak memory of each job")
+    parser.add_argument("--keep_files", action="store_true",
+                        help="Keep each job's Quartus project and database")
+    parser.add_argument("--stub_delay", type=float, default=0.0,
+                        help="Seconds each stub synthesis takes")
+    parser.add_argument("--cache_dir", type=str,
+                        default=os.environ.get("BBQ_CACHE_DIR"),
+                        help=("Directory for caching generated code "
+                              "(default: $BBQ_CACHE_DIR, if set)"))
+
+
+def load_spec(parser: argparse.ArgumentParser, path: str) -> dict:
+    """Reads and checks a sweep spec."""
+    with open(path, "r") as f:
+        spec = json.load(f)
+
+    unknown = set(spec) - set(SPEC_DEFAULTS) - {
+        "configs", "max_num_priorities", "max_registers", "max_m20ks",
+        "eliminate_dead_signals"}
+    if unknown:
+        parser.error("Unknown spec key(s): {}".format(
+            ", ".join(sorted(unknown))))
+
+    return spec
+
+
+def make_driver(args: argparse.Namespace, spec: dict) -> Driver:
+    """Returns the driver configured by the arguments and spec."""
+    kwargs = {}
+    if args.job_memory_mb is not None:
+        kwargs["job_memory_mb"] = args.job_memory_mb
+    if args.synthesizer == "quartus": kwargs["keep_files"] = args.keep_files
+    else: kwargs["delay"] = args.stub_delay
+    synthesizer = SYNTHESIZERS[args.synthesizer](**kwargs)
+
+    memory_budget = (args.max_memory_mb if args.max_memory_mb is not None
+                     else available_memory_mb())
+
+    os.makedirs(args.work_dir, exist_ok=True)
+    return Driver(synthesizer, ResultStore(args.db), args.work_dir,
+                  WorkerPool(args.jobs, memory_budget), args.cache_dir,
+                  spec.get("eliminate_dead_signals", False))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        prog="dse", description=("Synthesizes the BBQ configurations of a "
+                                 "sweep spec, storing the results."))
+
+    add_arguments(parser)
+    parser.add_argument("--retry_errors", action="store_true",
+                        help="Re-run jobs whose synthesis failed")
+    parser.add_argument("--dry_run", action="store_true",
+                        help="Only list the jobs that would run")
+    args = parser.parse_args()
+
+    spec = load_spec(parser, args.spec)
+    driver = make_driver(args, spec)
+    (jobs, skipped) = driver.plan(expand_spec(spec), args.retry_errors,
+                                  spec.get("max_registers"),
+                                  spec.get("max_m20ks"))
+
+    num_finished = sum(1 for (_, x) in skipped if x == "finished")
+    print("[dse] {} job(s) to run, {} already finished, {} skipped".format(
+        len(jobs), num_finished, len(skipped) - num_finished),
+        file=sys.stderr)
+    for (job, reason) in skipped:
+        if reason != "finished":
+            print("[dse] Skipping {}: {}".format(job_name(job), reason),
+                  file=sys.stderr)
+
+    if args.dry_run:
+        for job in jobs: print(job_name(job))
+        sys.exit(0)
+
+    num_jobs = len(jobs)
+    try:
+        for (idx, (job, row)) in enumerate(driver.run(jobs)):
+            print("[dse] ({}/{}) {}: {}".format(
+                idx + 1, num_jobs, job_name(job), format_result(row)),
+                file=sys.stderr)
+
+    except KeyboardInterrupt:
+        sys.exit("[dse] Interrupted; re-run to resume.")
+
+    finally: driver.store.close()
@@ -0,0 +1,275 @@
+#!/usr/bin/python3
+from __future__ import annotations
+
+import argparse
+import json
+import sys
+from typing import Dict, List, Optional, Tuple
+
+from dse import (SPEC_DEFAULTS, ResultStore, add_arguments, expand_configs,
+                 job_config, job_key, load_spec, make_driver,
+                 sweep_config_name)
+from util import atomic_open
+
+
+def implied_fmax(row: dict) -> Optional[float]:
+    """Returns the fmax (in MHz) implied by a run's worst setup slack
+    at its target frequency (or the reported fmax, lacking a slack)."""
+    if row["status"] != "done": return None
+    if row["slack_ns"] is not None:
+        period = 1000.0 / row["freq_mhz"] - row["slack_ns"]
+        if period > 0: return 1000.0 / period
+
+    return row["fmax_mhz"]
+
+
+class FmaxSearch:
+    """Searches for the highest integral target frequency at which any
+    of the given seeds closes timing for a configuration (as in
+    scripts/bisect_fmax.sh, which tries each seed in turn, and bisects
+    between the highest frequency that met timing and the lowest one
+    at which every seed failed). The search state is recovered from the
+    result store, so runs from earlier sweeps and searches are reused.
+
+    With warm starts, rather than bisecting blindly, each frequency is
+    predicted: from the slack of the configuration's latest runs (the
+    best fmax they imply), or, before its first run, from the fmax achieved
+    by similar configurations (with the same levels, and the adjacent
+    bitmap width or element bits). Predictions are kept at least one
+    precision away from the bounds, and whenever two steps in a row
+    fail to halve the search interval, the next step bisects."""
+    def __init__(self, config: dict, seeds: List[int], store: ResultStore,
+                 min_freq: int=50, max_freq: int=600, precision: int=3,
+                 warm_start: bool=True) -> None:
+        if precision < 1:
+            raise ValueError("Precision must be greater than 0.")
+
+        self.config = config
+        self.seeds = seeds
+        self.store = store
+        self.min_freq = min_freq
+        self.max_freq = max_freq
+        self.precision = precision
+        self.warm_start = warm_start
+        self.num_runs = 0                   # Syntheses run by this search
+
+
+    def similar(self, config: dict) -> bool:
+        """Is config the same as ours, but for the bitmap width or the
+        element bits?"""
+        ignored = ("bitmap_width", "element_bits")
+        return ({x: v for (x, v) in config.items() if x not in ignored} ==
+                {x: v for (x, v) in self.config.items() if x not in ignored})
+
+
+    def results(self) -> Tuple[List[dict], Dict[str, List[dict]]]:
+        """Returns this configuration's results (oldest first), and
+        those of the other configurations with the same levels."""
+        (own, others) = ([], {})
+        for row in self.store.results(
+                "num_bitmap_levels = ? AND num_lps = ?",
+                (self.config["num_bitmap_levels"], self.config["num_lps"])):
+            # Frequencies are stored as reals; keep the job's own
+            job = json.loads(row["key"])
+            (config, row) = (job_config(job),
+                             {**row, "freq_mhz": job["freq_mhz"]})
+            if config == self.config: own.append(row)
+            elif self.similar(config):
+                others.setdefault(job_key(config), []).append(row)
+
+        own.sort(key=lambda x: x["finished_at"] or 0)
+        return (own, others)
+
+
+    def neighbor_estimate(self, others: Dict[str, List[dict]]
+                          ) -> Optional[float]:
+        """Returns the mean fmax achieved by the nearest configurations
+        (with a narrower and a wider bitmap, or fewer and more element
+        bits) whose fmax is known."""
+        fmaxes = {}
+        for rows in others.values():
+            fmax = max((x for x in map(implied_fmax, rows) if x), default=None)
+            if fmax is not None:
+                config = job_config(json.loads(rows[0]["key"]))
+                fmaxes[(config["bitmap_width"], config["element_bits"])] = fmax
+
+        estimates = []
+        (width, bits) = (self.config["bitmap_width"],
+                         self.config["element_bits"])
+        for (axis, value) in ((0, width), (1, bits)):
+            points = [(k[axis], v) for (k, v) in fmaxes.items()
+                      if k[1 - axis] == (bits, width)[axis]]
+            below = [p for p in points if p[0] < value]
+            above = [p for p in points if p[0] > value]
+            if below: estimates.append(max(below)[1])
+            if above: estimates.append(min(above)[1])
+
+        return (sum(estimates) / len(estimates)) if estimates else None
+
+
+    def attempts(self, rows: List[dict]) -> List[Tuple[int, bool]]:
+        """Returns the frequencies that were decided (met by some seed,
+        or failed by every seed), and whether each was met, in the order
+        they were decided."""
+        (attempts, failed) = ([], {})
+        for row in rows:
+            freq = row["freq_mhz"]
+            if any(f == freq for (f, _) in attempts): continue
+            if (row["status"] == "done") and row["timing_met"]:
+                attempts.append((freq, True))
+            else:
+                failed.setdefault(freq, set()).add(row["seed"])
+                if failed[freq] >= set(self.seeds):
+                    attempts.append((freq, False))
+
+        return attempts
+
+
+    def bounds(self, attempts: List[Tuple[int, bool]]) -> Tuple[int, int]:
+        """Returns the highest frequency known to meet timing (or 0), and
+        the lowest higher one known to fail (or the maximum frequency)."""
+        lower = max((f for (f, met) in attempts if met), default=0)
+        upper = min((f for (f, met) in attempts if (not met) and (f > lower)),
+                    default=self.max_freq)
+        return (lower, upper)
+
+
+    def stalled(self, attempts: List[Tuple[int, bool]]) -> bool:
+        """Did each of the last two decided frequencies fail to halve
+        the search interval?"""
+        widths = [upper - lower for (lower, upper) in (
+            self.bounds(attempts[:i]) for i in range(len(attempts) + 1))]
+        return (len(widths) >= 3) and all(
+            2 * y > x for (x, y) in zip(widths[-3:-1], widths[-2:]))
+
+
+    def next_job(self) -> Optional[dict]:
+        """Returns the next job to run (or None, once the search ends)."""
+        (rows, others) = self.results()
+        attempts = self.attempts(rows)
+        (lower, upper) = self.bounds(attempts)
+
+        # Resume a frequency whose seeds have not all been tried
+        decided = {f for (f, _) in attempts}
+        for row in reversed(rows):
+            freq = row["freq_mhz"]
+            if (freq in decided) or not (lower < freq < upper): continue
+            tried = {x["seed"] for x in rows if x["freq_mhz"] == freq}
+            seed = next(x for x in self.seeds if x not in tried)
+            return {**self.config, "seed": seed, "freq_mhz": freq}
+
+        if upper - lower <= self.precision: return None
+
+        # Bisect, unless there is a prediction (and the search is not
+        # stalled)
+        freq = (lower + upper) // 2
+        if self.warm_start and not self.stalled(attempts):
+            # Best seed at the latest frequency, or the neighbors'
+            latest = [x for x in rows if implied_fmax(x)]
+            prediction = (max(implied_fmax(x) for x in latest if
+                              x["freq_mhz"] == latest[-1]["freq_mhz"])
+                          if latest else self.neighbor_estimate(others))
+
+            if ((prediction is not None) and
+                (upper - lower > 2 * self.precision)):
+                freq = min(max(int(prediction), lower + self.precision,
+                               self.min_freq), upper - self.precision)
+
+        if freq < self.min_freq: return None
+        return {**self.config, "seed": self.seeds[0], "freq_mhz": freq}
+
+
+    def result(self) -> dict:
+        """Returns the search's outcome: the highest frequency that met
+        timing (if any), the first seed that met it, and the number of
+        syntheses (run by this search, and in total)."""
+        (rows, _) = self.results()
+        (lower, upper) = self.bounds(self.attempts(rows))
+        seed = next((x["seed"] for x in rows if x["freq_mhz"] == lower and
+                     x["status"] == "done" and x["timing_met"]), None)
+
+        return {**self.config, "name": sweep_config_name(self.config),
+                "fmax_mhz": lower or None, "seed": seed,
+                "upper_mhz": upper, "num_runs": self.num_runs,
+                "total_runs": len(rows)}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        prog="fmax", description=("Searches for the fmax of the BBQ "
+                                  "configurations of a sweep spec."))
+
+    add_arguments(parser)
+    parser.add_argument("--min_freq", type=int, default=50,
+                        help="Give up below this frequency (MHz)")
+    parser.add_argument("--max_freq", type=int, default=600,
+                        help="Upper bound of the search (MHz)")
+    parser.add_argument("--precision", type=int, default=3,
+                        help="Width of the final search interval (MHz)")
+    parser.add_argument("--cold", action="store_true",
+                        help=("Bisect blindly (as bisect_fmax.sh), rather "
+                              "than predicting frequencies"))
+    parser.add_argument("--output", type=str, default=None,
+                        help="Output path for the fmax of each config (JSON)")
+    args = parser.parse_args()
+    if args.precision < 1:
+        parser.error("Precision must be greater than 0.")
+
+    spec = load_spec(parser, args.spec)
+    driver = make_driver(args, spec)
+    seeds = spec.get("seeds", SPEC_DEFAULTS["seeds"])
+
+    # Configurations that are invalid or do not fit are skipped
+    searches = []
+    for config in expand_configs(spec):
+        reason = driver.check(config, spec.get("max_registers"),
+                              spec.get("max_m20ks"))
+        if reason is not None:
+            print("[fmax] Skipping {}: {}".format(
+                sweep_config_name(config), reason), file=sys.stderr)
+        else:
+            searches.append(FmaxSearch(config, seeds, driver.store,
+                                       args.min_freq, args.max_freq,
+                                       args.precision, not args.cold))
+
+    # Searches run one job at a time, with (at most) as many searches
+    # in flight as workers, so later ones are warm-started from earlier
+    (queue, owners, results) = ([], {}, {})
+    waiting = list(reversed(searches))
+    def advance(search: FmaxSearch) -> None:
+        job = search.next_job()
+        while job is None:
+            result = results[id(search)] = search.result()
+            print("[fmax] {}: {} after {} synthesis run(s)".format(
+                result["name"], "{} MHz (seed {})".format(
+                    result["fmax_mhz"], result["seed"])
+                if result["fmax_mhz"] else "did not meet timing",
+                result["total_runs"]), file=sys.stderr)
+
+            if not waiting: return
+            search = waiting.pop()
+            job = search.next_job()
+
+        queue.append(job)
+        owners[job_key(job)] = search
+
+    try:
+        while waiting and (len(queue) < args.jobs): advance(waiting.pop())
+
+        for (job, row) in driver.run(queue):
+            search = owners.pop(job_key(job))
+            search.num_runs += 1
+            advance(search)
+
+    except KeyboardInterrupt:
+        sys.exit("[fmax] Interrupted; re-run to resume.")
+
+    finally: driver.store.close()
+
+    if args.output is not None:
+        with atomic_open(args.output) as f:
+            json.dump([results[id(x)] for x in searches], f, indent=4)
+            f.write("\n")
+
+    print("[fmax] {} synthesis run(s) in total".format(
+        sum(search.num_runs for search in searches)), file=sys.stderr)
@@ -0,0 +1,67 @@
+#!/usr/bin/python3
+import copy
+from typing import Callable, Dict, Hashable, List
+
+from codegen import CodeGen
+from ir import Block, Node
+
+
+class FragmentCache:
+    """In-memory cache of IR fragments (e.g., the code emitted by a BBQ
+    level for a given phase). Fragments are replayed by cloning their
+    blocks; leaf nodes are never mutated once emitted, so are shared."""
+    def __init__(self, max_size: int=4096) -> None:
+        self.fragments: Dict[Hashable, List[Node]] = {} # Cached fragments
+        self.max_size = max_size            # Maximum number of fragments
+        self.hits = 0                       # Number of cache hits
+        self.misses = 0                     # Number of cache misses
+
+
+    @staticmethod
+    def clone(nodes: List[Node]) -> List[Node]:
+        """Returns a copy of the given IR that shares its leaves."""
+        output: List[Node] = []
+        for node in nodes:
+            if isinstance(node, Block):
+                block = copy.copy(node)
+                block.body = FragmentCache.clone(node.body)
+                node = block
+
+            output.append(node)
+
+        return output
+
+
+    def emit(self, cg: CodeGen, key: Hashable,
+             emitter: Callable[[], None]) -> None:
+        """Emits the fragment with the given key into cg, invoking
+        the emitter (and caching its output) on a cache miss."""
+        container = cg.stack[-1].body if cg.stack else cg.nodes
+        key = (key, cg.level)
+
+        fragment = self.fragments.get(key)
+        if fragment is not None:
+            self.hits += 1
+            container.extend(self.clone(fragment))
+            return
+
+        self.misses += 1
+        start, depth = len(container), len(cg.stack)
+        emitter()
+        assert len(cg.stack) == depth # Sanity check
+
+        if len(self.fragments) >= self.max_size:
+            del self.fragments[next(iter(self.fragments))]
+
+        self.fragments[key] = self.clone(container[start:])
+
+
+    def clear(self) -> None:
+        """Drops all cached fragments."""
+        self.fragments.clear()
+
+
+    def report(self) -> str:
+        """Summary of cache lookups."""
+        return "[fragments] {} hit(s), {} miss(es)".format(
+            self.hits, self.misses)
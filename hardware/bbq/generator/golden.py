@@ -0,0 +1,171 @@
+#!/usr/bin/python3
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import sys
+from typing import TextIO
+
+import numpy as np
+
+from bbq import BBQ
+from hazards import HazardAnalyzer, random_trace
+from reference import make_trace
+from simulator import HeapOp
+from util import atomic_open
+
+# Cycles between the testbench driving an op, and sampling its output
+TB_OUTPUT_DELAY = 1
+
+
+class GoldenGenerator:
+    """Generates golden stimulus and expected-output files for the BBQ
+    testbench (TEST_GOLDEN in tb/bbq/tb_bbq.sv). Each op is issued in
+    the cycle given by its arrival and the minimum spacing between ops;
+    the expected outputs (and the ops dropped by the ingress stage) are
+    obtained from the functional reference model. Records are lines of
+    whitespace-separated hex fields, streamed by the TB with $fscanf:
+    stimulus lines are (cycle, op, priority, data), and expected lines
+    are (cycle, op, priority, data) of each output, in order. Cycles
+    count from the first cycle after the BBQ is ready."""
+    def __init__(self, bbq: BBQ, bitmap_width: int=None,
+                 max_num_entries: int=None, data_width: int=64) -> None:
+        self.analyzer = HazardAnalyzer(bbq, bitmap_width, max_num_entries)
+        self.data_width = data_width
+        self.priority_width = max(1, (
+            self.analyzer.bitmap_width ** bbq.num_bitmap_levels - 1
+        ).bit_length())
+
+        # Output cycle, relative to the op's stimulus cycle
+        self.output_delay = self.analyzer.latency + TB_OUTPUT_DELAY
+
+
+    def generate(self, trace: np.ndarray, arrivals: np.ndarray=None,
+                 spacing: int=2) -> dict:
+        """Returns the stimulus and expected outputs for the given trace,
+        as a dict of (stimulus, expected) TRACE_DTYPE arrays, and their
+        cycles (stimulus_cycles, expected_cycles) and spacing."""
+        if (self.data_width < 64) and np.any(
+                trace["data"] >> np.uint64(self.data_width)):
+            raise ValueError("Data exceeds {} bits.".format(self.data_width))
+
+        if arrivals is None: arrivals = np.zeros(len(trace), dtype=np.int64)
+        issued = self.analyzer.schedule(arrivals.astype(np.int64), spacing)
+        (admitted, _) = self.analyzer.admit(trace, issued)
+        expected = self.analyzer.reference_model().run(trace[admitted])
+
+        return {
+            "stimulus": trace,
+            "stimulus_cycles": issued,
+            "expected": expected,
+            "expected_cycles": issued[admitted] + self.output_delay,
+            "spacing": spacing,
+        }
+
+
+    def write_records(self, f: TextIO, records: np.ndarray,
+                      cycles: np.ndarray) -> None:
+        """Writes (cycle, op, priority, data) records as hex lines."""
+        line = "{{:08x}} {{:x}} {{:0{}x}} {{:0{}x}}\n".format(
+            (self.priority_width + 3) // 4, (self.data_width + 3) // 4)
+
+        for (cycle, op, priority, data) in zip(
+                cycles.tolist(), records["op_type"].tolist(),
+                records["priority"].tolist(), records["data"].tolist()):
+            f.write(line.format(cycle, op, priority, data))
+
+
+    def write(self, directory: str, golden: dict) -> dict:
+        """Writes the stimulus and expected outputs (stimulus.hex and
+        expected.hex), and a manifest (golden.json) describing them, to
+        the given directory. Returns the manifest."""
+        os.makedirs(directory, exist_ok=True)
+        with atomic_open(os.path.join(directory, "stimulus.hex")) as f:
+            self.write_records(f, golden["stimulus"],
+                               golden["stimulus_cycles"])
+
+        with atomic_open(os.path.join(directory, "expected.hex")) as f:
+            self.write_records(f, golden["expected"],
+                               golden["expected_cycles"])
+
+        bbq = self.analyzer.bbq
+        stimulus = golden["stimulus"]
+        num_cycles = int(golden["expected_cycles"][-1] + 1 if len(
+            golden["expected"]) else 0)
+
+        manifest = {
+            "bbq": bbq.config,
+            "parameters": {
+                "HEAP_BITMAP_WIDTH": self.analyzer.bitmap_width,
+                "HEAP_ENTRY_DWIDTH": self.data_width,
+                "HEAP_MAX_NUM_ENTRIES": self.analyzer.max_num_entries,
+            },
+            "priority_width": self.priority_width,
+            "spacing": golden["spacing"],
+            "output_delay": self.output_delay,
+            "num_ops": len(stimulus),
+            "num_enques": int(np.sum(stimulus["op_type"] == HeapOp.ENQUE)),
+            "num_outputs": len(golden["expected"]),
+            "num_dropped": len(stimulus) - len(golden["expected"]),
+            "num_cycles": num_cycles,
+        }
+        with atomic_open(os.path.join(directory, "golden.json")) as f:
+            json.dump(manifest, f, indent=4)
+            f.write("\n")
+
+        return manifest
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        prog="golden", description=("Generates stimulus and expected-output "
+                                    "files for the BBQ testbench."))
+
+    parser.add_argument("num_bitmap_levels", type=int)
+    parser.add_argument("--num_lps", type=int, default=1)
+    parser.add_argument("--calendar", action="store_true",
+                        help="Use a circular priority space (of L1 buckets)")
+    parser.add_argument("--bitmap_width", type=int, default=32)
+    parser.add_argument("--max_num_entries", type=int, default=127)
+    parser.add_argument("--data_width", type=int, default=64)
+    parser.add_argument("--trace", type=str, default=None,
+                        help=("Trace file (.npy of TRACE_DTYPE records, with "
+                              "an optional 'cycle' field of arrival cycles)"))
+    parser.add_argument("--random", type=int, default=None,
+                        help="Use a trace of this many random ops instead")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--spacing", type=int, default=2,
+                        help=("Minimum number of cycles between ops (at 1, "
+                              "dependent dequeues may not match the RTL)"))
+    parser.add_argument("--output_dir", type=str, default=".",
+                        help="Output directory for the golden files")
+    args = parser.parse_args()
+
+    try:
+        bbq = BBQ(args.num_bitmap_levels, args.num_lps,
+                  args.bitmap_width if args.num_lps > 1 else 0,
+                  calendar=args.calendar)
+        generator = GoldenGenerator(bbq, args.bitmap_width,
+                                    args.max_num_entries, args.data_width)
+    except ValueError as e: parser.error(str(e))
+
+    if args.trace is not None:
+        records = np.load(args.trace)
+        arrivals = (records["cycle"] if "cycle" in records.dtype.names
+                    else None)
+        trace = make_trace(records["op_type"], records["data"],
+                           records["priority"])
+    elif args.random is not None:
+        arrivals = None
+        trace = random_trace(generator.analyzer.reference_model(),
+                             args.random, args.seed)
+    else:
+        parser.error("Specify --trace or --random.")
+
+    golden = generator.generate(trace, arrivals, args.spacing)
+    manifest = generator.write(args.output_dir, golden)
+    print("[golden] {} op(s) ({} dropped), {} output(s) over {} cycle(s)"
+          .format(manifest["num_ops"], manifest["num_dropped"],
+                  manifest["num_outputs"], manifest["num_cycles"]),
+          file=sys.stderr)
@@ -0,0 +1,378 @@
+#!/usr/bin/python3
+from __future__ import annotations
+
+import argparse
+import json
+import re
+import sys
+from collections import deque
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+from bbq import BBQ
+from bbq_level_lx import BBQLevelLX
+from reference import ReferenceModel, make_trace
+from simulator import HeapOp
+from util import atomic_open
+
+# Address conflicts are tracked between ops up to this many cycles apart
+MAX_CONFLICT_DISTANCE = 4
+
+
+class HazardAnalyzer:
+    """Trace-driven model of a BBQ's pipeline hazards. The generated
+    pipeline never stalls; instead, it detects ops in flight that touch
+    the same bitmap (reg_<level>_addr_conflict_*) or priority bucket
+    (reg_pb_addr_conflict_*), and forwards state between them, skips
+    PB reads that collide with writes (pb_rdwr_conflict), and bypasses
+    entries that are dequeued right after they are enqueued into an
+    empty bucket (reg_pb_data_conflict). The ingress stage, however,
+    drops enqueues if the free list is empty, and dequeues from empty
+    partitions. The path of each op through the bitmap tree is obtained
+    from the functional reference model."""
+    def __init__(self, bbq: BBQ, bitmap_width: int=None,
+                 max_num_entries: int=None) -> None:
+        self.bbq = bbq
+        model = ReferenceModel.for_bbq(bbq, bitmap_width, max_num_entries)
+        self.bitmap_width = model.bitmap_width
+        self.max_num_entries = model.max_num_entries
+
+        # Hazard paths (named after the conflict signals they track),
+        # and the divisor that maps a bucket to the address they compare.
+        width = self.bitmap_width
+        self.paths: Dict[str, int] = {}
+        for level in bbq.levels:
+            if isinstance(level, BBQLevelLX) and level.level_id >= 2:
+                self.paths["{}_addr_conflict".format(level.name())] = (
+                    width ** (bbq.num_bitmap_levels - level.level_id + 1))
+
+        self.paths["pb_addr_conflict"] = 1
+
+        # PB reads are disabled if the PB is written in the same cycle
+        pb = bbq.levels[-1]
+        self.rdwr_distance = pb.end_cycle - pb.prev_level.end_cycle
+
+        # Addresses freed by dequeues are returned to the free list by
+        # the PB's last stage; until then, enqueues may find it empty.
+        self.recycle_distance = pb.end_cycle
+        self.latency = bbq.num_pipeline_stages # Issue-to-output latency
+
+
+    def reference_model(self) -> ReferenceModel:
+        """Returns an empty reference model of the analyzed BBQ."""
+        return ReferenceModel.for_bbq(self.bbq, self.bitmap_width,
+                                      self.max_num_entries)
+
+
+    @staticmethod
+    def schedule(arrivals: np.ndarray, spacing: int=1) -> np.ndarray:
+        """Returns the cycle each op is issued in, given the cycles they
+        arrive in (in order) and the minimum spacing between ops."""
+        offsets = np.arange(len(arrivals), dtype=np.int64) * spacing
+        return np.maximum.accumulate(arrivals - offsets) + offsets
+
+
+    def admit(self, trace: np.ndarray,
+              issued: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """Returns which ops enter the pipeline (the ingress stage drops
+        enqueues that find the free list empty, and dequeues from empty
+        partitions), and the bucket that each admitted op accesses."""
+        is_enque = (trace["op_type"] == HeapOp.ENQUE)
+        dequeues = issued[~is_enque]
+        recycled = np.searchsorted(dequeues, issued - self.recycle_distance,
+                                   side="right")
+        available = (self.max_num_entries + recycled -
+                     (np.cumsum(is_enque) - is_enque))
+
+        admitted = np.ones(len(trace), dtype=bool)
+        if np.all(available[is_enque] > 0):
+            try: return (admitted, self.reference_model().run(
+                trace)["priority"])
+            except ValueError: pass
+
+        # Some ops are dropped; replay the trace one op at a time
+        model = self.reference_model()
+        partitions = model.roots()
+        (num_free, freed, buckets) = (self.max_num_entries, deque(), [])
+        for (i, (op, data, priority, cycle)) in enumerate(zip(
+                trace["op_type"].tolist(), trace["data"].tolist(),
+                trace["priority"].tolist(), issued.tolist())):
+            while freed and freed[0] <= (cycle - self.recycle_distance):
+                freed.popleft()
+                num_free += 1
+
+            if op == HeapOp.ENQUE:
+                if num_free == 0:
+                    admitted[i] = False
+                    continue
+
+                num_free -= 1
+                model.enqueue(data, priority)
+                buckets.append(priority)
+
+            elif partitions[model.partition(priority)] == 0:
+                admitted[i] = False
+
+            else:
+                buckets.append(model.dequeue(op, priority)[1])
+                freed.append(cycle)
+
+        return (admitted, np.array(buckets, dtype=np.int64))
+
+
+    def report(self, hazards: Dict[str, Dict[int, int]],
+               arrivals: np.ndarray, issued: np.ndarray,
+               admitted: np.ndarray, latencies: np.ndarray,
+               num_stalls: int) -> dict:
+        """Summarizes hazard counts, latencies and throughput."""
+        num_ops = len(issued)
+        (values, counts) = np.unique(latencies, return_counts=True)
+        arrival_span = int(arrivals[-1] - arrivals[0]) + 1 if num_ops else 0
+        issue_span = int(issued[-1] - issued[0]) + 1 if num_ops else 0
+        num_dropped = int(np.count_nonzero(~admitted))
+        stats = (lambda f: float(f(latencies)) if len(latencies) else 0.0)
+
+        return {
+            "num_ops": num_ops,
+            "hazards": {path: {str(d): n for (d, n) in sorted(x.items())}
+                        for (path, x) in hazards.items()},
+            "latency": {
+                "histogram": dict(zip(map(str, values.tolist()),
+                                      counts.tolist())),
+                "mean": stats(np.mean),
+                "p50": stats(lambda x: np.percentile(x, 50)),
+                "p99": stats(lambda x: np.percentile(x, 99)),
+                "max": int(stats(np.max)),
+            },
+            "throughput": {
+                "offered_ops_per_cycle": num_ops / max(arrival_span, 1),
+                "issued_ops_per_cycle": num_ops / max(issue_span, 1),
+                "queued_ops": int(np.count_nonzero(issued != arrivals)),
+                "stalls": num_stalls,
+                "dropped": num_dropped,
+                "sustained": bool(np.array_equal(issued, arrivals) and
+                                  num_stalls == 0 and num_dropped == 0),
+            },
+        }
+
+
+    def predict(self, trace: np.ndarray, arrivals: np.ndarray=None,
+                spacing: int=1) -> dict:
+        """Predicts the hazards, per-op latency and throughput for the
+        given trace (TRACE_DTYPE records) arriving in the given cycles
+        (by default, one op per cycle). Exact for ops issued at least
+        two cycles apart; at one op per cycle, a dequeue may access a
+        different bucket in the RTL than in the reference model, so the
+        counts are estimates (see measure())."""
+        if arrivals is None: arrivals = np.arange(len(trace), dtype=np.int64)
+        arrivals = np.asarray(arrivals, dtype=np.int64)
+        issued = self.schedule(arrivals, spacing)
+        (admitted, buckets) = self.admit(trace, issued)
+
+        # Only admitted ops proceed through the pipeline
+        cycles = issued[admitted]
+        is_enque = (trace["op_type"][admitted] == HeapOp.ENQUE)
+
+        # Bucket occupancy before each op
+        order = np.argsort(buckets, kind="stable")
+        deltas = np.where(is_enque, 1, -1)[order]
+        totals = np.cumsum(deltas)
+        starts = np.flatnonzero(np.diff(buckets[order], prepend=-1))
+        totals -= np.repeat(totals[starts] - deltas[starts],
+                            np.diff(np.append(starts, len(order))))
+        occupancy = np.empty(len(cycles), dtype=np.int64)
+        occupancy[order] = totals - deltas
+
+        hazards = {path: {} for path in self.paths}
+        hazards["pb_rdwr_conflict"] = {}
+        hazards["pb_data_conflict"] = {}
+        for distance in range(1, MAX_CONFLICT_DISTANCE + 1):
+            # Pair each op with the one issued distance cycles earlier
+            older = np.searchsorted(cycles, cycles - distance)
+            paired = (cycles[np.minimum(older, len(cycles) - 1)] ==
+                      (cycles - distance))
+            younger = np.flatnonzero(paired)
+            older = older[paired]
+
+            for (path, divisor) in self.paths.items():
+                same = ((buckets[younger] // divisor) ==
+                        (buckets[older] // divisor))
+                hazards[path][distance] = int(np.count_nonzero(same))
+
+                if path != "pb_addr_conflict": continue
+                if distance == self.rdwr_distance:
+                    hazards["pb_rdwr_conflict"][distance] = (
+                        hazards[path][distance])
+                if distance == 1:
+                    hazards["pb_data_conflict"][distance] = int(
+                        np.count_nonzero(same & is_enque[older] &
+                                         (occupancy[older] == 0) &
+                                         ~is_enque[younger]))
+
+        latencies = (cycles - arrivals[admitted]) + self.latency
+        return self.report(hazards, arrivals, issued, admitted, latencies, 0)
+
+
+    def measure(self, trace: np.ndarray, arrivals: np.ndarray=None,
+                spacing: int=1, params: Dict[str, int]=None) -> dict:
+        """Same as predict(), but runs the trace on the cycle-accurate
+        simulator and counts the cycles each conflict signal fires."""
+        params = {"HEAP_MAX_NUM_ENTRIES": self.max_num_entries,
+                  **(params or {})}
+        if "HEAP_BITMAP_WIDTH" in self.bbq.parameters:
+            params.setdefault("HEAP_BITMAP_WIDTH", self.bitmap_width)
+
+        sim = self.bbq.simulator(params)
+        sim.reset()
+
+        # Conflict signals, by path and distance
+        signals: List[Tuple[str, str, int]] = []
+        for name in sim.values:
+            match = re.match(r"^(\w+_addr_conflict)_s(\d+)_s(\d+)$", name)
+            if match and match.group(1) in self.paths:
+                signals.append((name, match.group(1), int(match.group(2)) -
+                                int(match.group(3))))
+
+        pb_start = self.bbq.levels[-1].start_cycle
+        signals.append(("pb_rdwr_conflict", "pb_rdwr_conflict",
+                        self.rdwr_distance))
+        signals.append(("reg_pb_data_conflict_s{}".format(pb_start),
+                        "pb_data_conflict", 1))
+
+        hazards = {path: {} for (_, path, _) in signals}
+        for (_, path, distance) in signals: hazards[path][distance] = 0
+
+        # Ops that the ingress stage drops never reach the output
+        valid = "valid_s{}".format(self.bbq.levels[0].start_cycle)
+
+        if arrivals is None: arrivals = np.arange(len(trace), dtype=np.int64)
+        arrivals = np.asarray(arrivals, dtype=np.int64)
+        issued = self.schedule(arrivals, spacing)
+        admitted = np.ones(len(trace), dtype=bool)
+        ops = enumerate(zip(issued.tolist(), trace["op_type"].tolist(),
+                            trace["data"].tolist(), trace["priority"].tolist()))
+
+        latencies = []
+        in_flight = deque()
+        num_stalls = 0
+        op = next(ops, None)
+        start = sim.cycle - (issued[0] if len(issued) else 0)
+        while (op is not None) or in_flight:
+            if (op is not None) and (sim.cycle - start) == op[1][0]:
+                if not sim["ready"]: num_stalls += 1
+                output = sim.tick(True, *op[1][1:])
+                if sim[valid]: in_flight.append(sim.cycle - 1)
+                else: admitted[op[0]] = False
+                op = next(ops, None)
+            else: output = sim.tick()
+
+            if output is not None:
+                latencies.append(sim.cycle - in_flight.popleft())
+
+            for (name, path, distance) in signals:
+                if sim[name]: hazards[path][distance] += 1
+
+        latencies = (np.array(latencies, dtype=np.int64) +
+                     (issued - arrivals)[admitted])
+        return self.report(hazards, arrivals, issued, admitted,
+                           latencies, num_stalls)
+
+
+def random_trace(model: ReferenceModel, num_ops: int,
+                 seed: int=0) -> np.ndarray:
+    """Returns a trace of uniformly random enqueues and dequeues (only
+    into non-full queues, and from non-empty partitions)."""
+    rng = np.random.default_rng(seed)
+    ops = np.zeros(num_ops, dtype=np.uint8)
+    priorities = rng.integers(0, model.num_priorities, num_ops)
+    dequeues = rng.integers(HeapOp.DEQUE_MIN, HeapOp.DEQUE_MAX + 1, num_ops)
+    coins = rng.random(num_ops).tolist()
+
+    partitions = model.roots()
+    for (i, priority) in enumerate(priorities.tolist()):
+        dequeue = partitions[model.partition(priority)] != 0
+        if (len(model) < model.max_num_entries) and (
+                not dequeue or coins[i] < 0.5):
+            model.enqueue(i, priority)
+        else:
+            ops[i] = dequeues[i]
+            model.dequeue(int(ops[i]), priority)
+
+    return make_trace(ops, np.arange(num_ops), priorities)
+
+
+def format_report(report: dict) -> str:
+    """Renders a report as a human-readable table."""
+    lines = ["{:<24} {}".format("Hazard path", "Count (by distance)")]
+    for (path, counts) in report["hazards"].items():
+        lines.append("{:<24} {}".format(path, ", ".join(
+            "{}: {}".format(d, n) for (d, n) in counts.items())))
+
+    latency = report["latency"]
+    throughput = report["throughput"]
+    lines.append("Latency (cycles): mean {:.2f}, p50 {:.0f}, p99 {:.0f}, "
+                 "max {}".format(latency["mean"], latency["p50"],
+                                 latency["p99"], latency["max"]))
+    lines.append("Throughput (ops/cycle): offered {:.3f}, issued {:.3f} "
+                 "({} queued, {} stalled, {} dropped); sustained: {}".format(
+                     throughput["offered_ops_per_cycle"],
+                     throughput["issued_ops_per_cycle"],
+                     throughput["queued_ops"], throughput["stalls"],
+                     throughput["dropped"],
+                     "yes" if throughput["sustained"] else "no"))
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        prog="hazards", description=("Predicts the pipeline hazards, latency "
+                                     "and throughput of a BBQ for a trace."))
+
+    parser.add_argument("num_bitmap_levels", type=int)
+    parser.add_argument("--num_lps", type=int, default=1)
+    parser.add_argument("--calendar", action="store_true",
+                        help="Use a circular priority space (of L1 buckets)")
+    parser.add_argument("--bitmap_width", type=int, default=None)
+    parser.add_argument("--max_num_entries", type=int, default=None)
+    parser.add_argument("--trace", type=str, default=None,
+                        help=("Trace file (.npy of TRACE_DTYPE records, with "
+                              "an optional 'cycle' field of arrival cycles)"))
+    parser.add_argument("--random", type=int, default=None,
+                        help="Use a trace of this many random ops instead")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--spacing", type=int, default=1,
+                        help="Minimum number of cycles between ops")
+    parser.add_argument("--simulate", action="store_true",
+                        help="Measure on the cycle-accurate simulator")
+    parser.add_argument("--output", type=str, default=None,
+                        help="Output path for the report (JSON)")
+    args = parser.parse_args()
+
+    try:
+        bbq = BBQ(args.num_bitmap_levels, args.num_lps,
+                  args.bitmap_width or 0, calendar=args.calendar)
+        analyzer = HazardAnalyzer(bbq, args.bitmap_width,
+                                  args.max_num_entries)
+    except ValueError as e: parser.error(str(e))
+    if args.trace is not None:
+        records = np.load(args.trace)
+        arrivals = (records["cycle"] if "cycle" in records.dtype.names
+                    else None)
+        trace = make_trace(records["op_type"], records["data"],
+                           records["priority"])
+    elif args.random is not None:
+        arrivals = None
+        trace = random_trace(analyzer.reference_model(),
+                             args.random, args.seed)
+    else:
+        parser.error("Specify --trace or --random.")
+
+    report = (analyzer.measure(trace, arrivals, args.spacing) if args.simulate
+              else analyzer.predict(trace, arrivals, args.spacing))
+
+    print(format_report(report), file=sys.stderr)
+    if args.output is not None:
+        with atomic_open(args.output) as f:
+            json.dump(report, f, indent=4)
+            f.write("\n")
@@ -0,0 +1,381 @@
+#!/usr/bin/python3
+from __future__ import annotations
+
+import re
+from typing import Iterator, List, Tuple
+
+# Matches identifiers (signals, params, types) in SystemVerilog code
+IDENTIFIER_RE = re.compile(r"\b[A-Za-z_]\w*\b")
+
+
+def base_name(x: str) -> str:
+    """Returns the signal name for an lvalue (e.g., x[3].head -> x)."""
+    match = IDENTIFIER_RE.match(x)
+    return match.group(0) if match else x
+
+
+class Node:
+    """Base class for SystemVerilog IR nodes."""
+    __slots__ = ("level", "owner")
+
+    def __init_subclass__(cls, **kwargs) -> None:
+        # IR graphs hold many nodes; none of them may carry a __dict__
+        super().__init_subclass__(**kwargs)
+        assert "__slots__" in cls.__dict__, (
+            "{} must declare __slots__".format(cls.__name__))
+
+
+    def __init__(self, level: int) -> None:
+        self.level = level                  # Indent level
+        self.owner: str = None              # Emitting level (if any)
+
+
+    def render(self, spacing: int) -> Iterator[str]:
+        """Yields the code for this node."""
+        raise NotImplementedError()
+
+
+    def text(self) -> Iterator[str]:
+        """Yields the code fragments that may reference signals."""
+        return iter(())
+
+
+    def reads(self) -> Iterator[str]:
+        """Yields identifiers read by this node."""
+        for x in self.text():
+            yield from IDENTIFIER_RE.findall(x)
+
+
+    def children(self) -> List[Node]:
+        """Returns the child nodes (if any)."""
+        return []
+
+
+class Raw(Node):
+    """Pre-formatted code, rendered verbatim."""
+    __slots__ = ("code",)
+
+    def __init__(self, level: int, code: str) -> None:
+        super().__init__(level)
+        self.code = code
+
+
+    def render(self, spacing: int) -> Iterator[str]:
+        yield self.code
+
+
+    def text(self) -> Iterator[str]:
+        yield self.code
+
+
+class Text(Node):
+    """Free-form line(s) of code at the current indent."""
+    __slots__ = ("lines", "indent_first", "offset", "newline")
+
+    def __init__(self, level: int, lines: List[str], indent_first: bool=True,
+                 offset: int=0, newline: bool=True) -> None:
+        super().__init__(level)
+        self.lines = lines                  # Lines of code
+        self.indent_first = indent_first    # Indent the first line?
+        self.offset = offset                # Additional indent
+        self.newline = newline              # Emit a trailing newline?
+
+
+    def render(self, spacing: int) -> Iterator[str]:
+        prefix = " " * (self.level * spacing + self.offset)
+        first = True
+        for x in self.lines:
+            if x is None: continue
+            if first:
+                yield ((prefix + x) if (x and self.indent_first) else x)
+            else:
+                yield "\n{}".format((prefix + x) if x else x)
+
+            first = False # First valid line
+
+        if self.newline: yield "\n"
+
+
+    def text(self) -> Iterator[str]:
+        yield from (x for x in self.lines if x is not None)
+
+
+class Comment(Node):
+    """Block or inline comment."""
+    __slots__ = ("lines", "is_block")
+
+    def __init__(self, level: int, lines: List[str], is_block: bool) -> None:
+        super().__init__(level)
+        self.lines = lines                  # Comment text
+        self.is_block = is_block            # Block-style comment?
+
+
+    def render(self, spacing: int) -> Iterator[str]:
+        prefix = " " * (self.level * spacing)
+        if self.is_block: yield "{}/**\n".format(prefix)
+
+        midfix = " * " if self.is_block else "// "
+        for x in self.lines:
+            yield "{}{}{}\n".format(prefix, midfix, x)
+
+        if self.is_block: yield "{} */\n".format(prefix)
+
+
+class Enum(Node):
+    """Enum typedef."""
+    __slots__ = ("name", "logictype", "values")
+
+    def __init__(self, level: int, name: str,
+                 logictype: str, values: List[str]) -> None:
+        super().__init__(level)
+        self.name = name                    # Type name
+        self.logictype = logictype          # Underlying type
+        self.values = values                # Enum values
+
+
+    def render(self, spacing: int) -> Iterator[str]:
+        prefix = " " * (self.level * spacing)
+        yield "{}typedef enum {} {{\n".format(prefix, self.logictype)
+        for idx, x in enumerate(self.values):
+            yield "{}{}{}{}\n".format(
+                prefix, " " * spacing, x,
+                "," if (idx != (len(self.values) - 1)) else "")
+
+        yield "{}}} {};\n".format(prefix, self.name)
+
+
+class Decl(Node):
+    """Signal declaration: <type> <name><suffix>."""
+    __slots__ = ("type", "name", "suffix", "align")
+
+    def __init__(self, level: int, type: str, name: str,
+                 suffix: str, align: int=None) -> None:
+        super().__init__(level)
+        self.type = type                    # Signal type
+        self.name = name                    # Signal name
+        self.suffix = suffix                # Dims, initializer, comment
+        self.align = align                  # Column to align the name to
+
+
+    def render(self, spacing: int) -> Iterator[str]:
+        padding = 1 if self.align is None else (self.align - len(self.type))
+        yield "{}{}{}{}{}\n".format(" " * (self.level * spacing),
+                                    self.type, " " * padding,
+                                    self.name, self.suffix)
+
+
+    def text(self) -> Iterator[str]:
+        yield self.type
+        yield self.suffix.split("//")[0]
+
+
+class Assign(Node):
+    """Blocking, non-blocking or continuous assignment."""
+    __slots__ = ("lhs", "op", "rhs", "offset")
+
+    def __init__(self, level: int, lhs: str, op: str,
+                 rhs: str | List[str], offset: int=0) -> None:
+        super().__init__(level)
+        self.lhs = lhs                      # Assigned lvalue
+        self.op = op                        # One of: =, <=, assign
+        self.rhs = rhs                      # Value (incl. ';' terminator)
+        self.offset = offset                # Continuation line offset
+
+
+    @property
+    def target(self) -> str:
+        """Name of the assigned signal."""
+        return base_name(self.lhs)
+
+
+    def render(self, spacing: int) -> Iterator[str]:
+        prefix = " " * (self.level * spacing)
+        if self.op == "assign":
+            yield "{}assign {} = ".format(prefix, self.lhs)
+        else:
+            yield "{}{} {} ".format(prefix, self.lhs, self.op)
+
+        if isinstance(self.rhs, str): yield self.rhs
+        else:
+            first = True
+            for x in self.rhs:
+                if x is None: continue
+                yield (x if first else "\n{}".format(
+                       (prefix + " " * self.offset + x) if x else x))
+                first = False
+
+        yield "\n"
+
+
+    def text(self) -> Iterator[str]:
+        # Index expressions in the LHS are reads
+        yield self.lhs[len(self.target):]
+        if isinstance(self.rhs, str): yield self.rhs.split("//")[0]
+        else: yield from (x for x in self.rhs if x is not None)
+
+
+class Instance(Node):
+    """Module instantiation."""
+    __slots__ = ("module", "name", "params", "ports")
+
+    def __init__(self, level: int, module: str, name: str,
+                 params: List[Tuple[str, str]],
+                 ports: List[Tuple[str, str]]) -> None:
+        super().__init__(level)
+        self.module = module                # Module type
+        self.name = name                    # Instance name
+        self.params = params                # (param, value) pairs
+        self.ports = ports                  # (port, signal) pairs
+
+
+    def render(self, spacing: int) -> Iterator[str]:
+        prefix = " " * (self.level * spacing)
+        inner = prefix + " " * spacing
+        if self.params:
+            yield "{}{} #(\n".format(prefix, self.module)
+            for i, (param, value) in enumerate(self.params):
+                yield "{}.{}({}){}\n".format(
+                    inner, param, value,
+                    "," if (i != (len(self.params) - 1)) else "")
+
+            yield "{})\n{}{} (\n".format(prefix, prefix, self.name)
+        else:
+            yield "{}{} {} (\n".format(prefix, self.module, self.name)
+
+        for i, (port, signal) in enumerate(self.ports):
+            yield "{}.{}({}){}\n".format(
+                inner, port, signal,
+                "," if (i != (len(self.ports) - 1)) else "")
+
+        yield "{});\n".format(prefix)
+
+
+    def text(self) -> Iterator[str]:
+        for _, value in self.params: yield value
+        for _, signal in self.ports: yield signal
+
+
+class Block(Node):
+    """Generic begin/end block (e.g., always_comb)."""
+    __slots__ = ("header", "body")
+
+    def __init__(self, level: int, header: str) -> None:
+        super().__init__(level)
+        self.header = header                # Block header
+        self.body: List[Node] = []          # Nested nodes
+
+
+    def children(self) -> List[Node]:
+        return self.body
+
+
+    def render_header(self, prefix: str) -> Iterator[str]:
+        yield "{}{} begin\n".format(prefix, self.header)
+
+
+    def render_footer(self, prefix: str) -> Iterator[str]:
+        yield "{}end\n".format(prefix)
+
+
+    def render(self, spacing: int) -> Iterator[str]:
+        prefix = " " * (self.level * spacing)
+        yield from self.render_header(prefix)
+        for node in self.body:
+            yield from node.render(spacing)
+
+        yield from self.render_footer(prefix)
+
+
+class Conditional(Block):
+    """If/else if/else block."""
+    __slots__ = ("condition",)
+
+    def __init__(self, level: int, type: str,
+                 condition: str | List[str]) -> None:
+        super().__init__(level, type)
+        self.condition = condition          # Condition (None for else)
+
+
+    def render_header(self, prefix: str) -> Iterator[str]:
+        if self.header == "else":
+            yield "{}else begin\n".format(prefix)
+            return
+
+        yield "{}{} (".format(prefix, self.header)
+        yield from Text(0, ([self.condition] if isinstance(self.condition, str)
+                            else self.condition), False,
+                        len(prefix) + len(self.header) + 2, False).render(0)
+        yield ") begin\n"
+
+
+    def text(self) -> Iterator[str]:
+        if self.condition is None: return
+        if isinstance(self.condition, str): yield self.condition
+        else: yield from (x for x in self.condition if x is not None)
+
+
+class For(Block):
+    """For loop."""
+    __slots__ = ("var", "condition")
+
+    def __init__(self, level: int, var: str, condition: str) -> None:
+        super().__init__(level, "for")
+        self.var = var                      # Loop variable
+        self.condition = condition          # Loop condition
+
+
+    def render_header(self, prefix: str) -> Iterator[str]:
+        yield "{0}for ({1} = 0; {2}; {1} = {1} + 1) begin\n".format(
+            prefix, self.var, self.condition)
+
+
+    def text(self) -> Iterator[str]:
+        yield self.var
+        yield self.condition
+
+
+class Switch(Block):
+    """Case statement."""
+    __slots__ = ()
+
+    def render_header(self, prefix: str) -> Iterator[str]:
+        yield "{}case ({})\n".format(prefix, self.header)
+
+
+    def render_footer(self, prefix: str) -> Iterator[str]:
+        yield "{}endcase\n".format(prefix)
+
+
+    def text(self) -> Iterator[str]:
+        yield self.header
+
+
+class CaseItem(Block):
+    """Case item within a switch."""
+    __slots__ = ()
+
+    def render_header(self, prefix: str) -> Iterator[str]:
+        yield "{}{}: begin\n".format(prefix, self.header)
+
+
+    def text(self) -> Iterator[str]:
+        yield self.header
+
+
+class Ifdef(Block):
+    """Preprocessor ifdef block."""
+    __slots__ = ()
+
+    def render_header(self, prefix: str) -> Iterator[str]:
+        yield "{}`ifdef {}\n".format(prefix, self.header)
+
+
+    def render_footer(self, prefix: str) -> Iterator[str]:
+        yield "{}`endif\n".format(prefix)
+
+
+def walk(nodes: List[Node]) -> Iterator[Node]:
+    """Pre-order traversal of the IR."""
+    for node in nodes:
+        yield node
+        yield from walk(node.children())
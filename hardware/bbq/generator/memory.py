@@ -0,0 +1,420 @@
+#!/usr/bin/python3
+from __future__ import annotations
+
+from array import array
+from typing import Dict, Tuple
+
+import numpy as np
+
+# Memories tracked by the model (named after the RTL's instances)
+MEMORIES = ("heap_entries", "next_pointers", "previous_pointers",
+            "priority_buckets", "free_list")
+
+# Occupancy of each memory (in valid words; for the free list, its depth)
+OCCUPANCY_DTYPE = np.dtype([(name, np.int64) for name in MEMORIES])
+
+
+def pointer_dtype(max_num_entries: int) -> np.dtype:
+    """Returns the narrowest unsigned dtype that holds an entry address
+    (i.e., a HEAP_ENTRY_AWIDTH-bit pointer)."""
+    for dtype in (np.uint8, np.uint16, np.uint32):
+        if max_num_entries <= (np.iinfo(dtype).max + 1):
+            return np.dtype(dtype)
+
+    return np.dtype(np.uint64)
+
+
+class MemoryModel:
+    """Array-backed model of the memories behind BBQ's priority buckets,
+    with the RTL's layout: entry data (heap_entries), next and previous
+    pointers (next_pointers, previous_pointers), a {head, tail} list per
+    bucket (priority_buckets), and a ring of free addresses (free_list,
+    an sc_fifo initialized with every address). Enqueues push entries at
+    the head of their bucket (the new entry's next pointer is the old
+    head, whose previous pointer is the new entry); dequeues pop from the
+    tail (through previous pointers), or from the head (through next
+    pointers) for ops the RTL recolors. State is held in flat arrays of
+    the narrowest pointer type, with no per-entry objects. Optionally,
+    the occupancy of each memory is sampled every sample_period ops."""
+    min_vectorized_walks = 8                # See pop_batch
+
+    def __init__(self, num_priorities: int, max_num_entries: int,
+                 sample_period: int=0) -> None:
+        pointer = pointer_dtype(max_num_entries)
+        self.num_priorities = num_priorities
+        self.max_num_entries = max_num_entries
+        self.sample_period = sample_period  # Ops per sample (0 if none)
+
+        self.entries = np.zeros(max_num_entries, dtype=np.uint64)
+        self.next = np.zeros(max_num_entries, dtype=pointer)
+        self.prev = np.zeros(max_num_entries, dtype=pointer)
+        self.heads = np.zeros(num_priorities, dtype=pointer)
+        self.tails = np.zeros(num_priorities, dtype=pointer)
+        self.counts = np.zeros(num_priorities, dtype=pointer_dtype(
+            max_num_entries + 1))           # Entries per bucket
+        self.free_list = np.arange(max_num_entries, dtype=pointer)
+        self.fl_head = 0                    # Next free address (index)
+
+        self.size = 0                       # Valid heap entries
+        self.num_buckets = 0                # Non-empty buckets
+        self.num_ops = 0                    # Pushes and pops so far
+        self.peak_size = 0                  # High-water marks
+        self.peak_num_buckets = 0
+        self.peak_num_pointers = 0
+
+        # (op, size, num_buckets) samples
+        self.samples = (array("q"), array("q"), array("q"))
+
+        # Per-op accesses go through memoryviews of the arrays above,
+        # which are several times faster than indexing NumPy scalars.
+        self.views = {name: memoryview(getattr(self, name)) for name in (
+            "entries", "next", "prev", "heads", "tails", "counts",
+            "free_list")}
+
+
+    def __len__(self) -> int:
+        return self.size
+
+
+    @property
+    def nbytes(self) -> int:
+        """Total size of the model's arrays (in bytes)."""
+        return sum(x.nbytes for x in (self.entries, self.next, self.prev,
+                                      self.heads, self.tails, self.counts,
+                                      self.free_list))
+
+
+    def sample(self) -> None:
+        """Records the current occupancy."""
+        for (x, value) in zip(self.samples, (self.num_ops, self.size,
+                                             self.num_buckets)):
+            x.append(value)
+
+
+    def push(self, bucket: int, data: int) -> int:
+        """Enqueues data at the head of the given bucket. Returns the
+        entry's address (popped from the free list)."""
+        if self.size == self.max_num_entries:
+            raise ValueError("Enqueue into a full queue.")
+
+        views = self.views
+        address = views["free_list"][self.fl_head]
+        self.fl_head = (self.fl_head + 1) % self.max_num_entries
+        views["entries"][address] = data
+
+        # As in the RTL, the next pointer is written even if the bucket
+        # is empty (in which case it is never followed).
+        head = views["heads"][bucket]
+        views["next"][address] = head
+        count = views["counts"][bucket]
+        views["counts"][bucket] = count + 1
+        views["heads"][bucket] = address
+        if count == 0:
+            views["tails"][bucket] = address
+            self.num_buckets += 1
+            if self.num_buckets > self.peak_num_buckets:
+                self.peak_num_buckets = self.num_buckets
+        else: views["prev"][head] = address
+
+        size = self.size + 1
+        self.size = size
+        if size > self.peak_size: self.peak_size = size
+        if (size - self.num_buckets) > self.peak_num_pointers:
+            self.peak_num_pointers = size - self.num_buckets
+        self.num_ops += 1
+        if self.sample_period and not (self.num_ops % self.sample_period):
+            self.sample()
+        return address
+
+
+    def pop(self, bucket: int, from_head: bool=False) -> Tuple[int, int]:
+        """Dequeues the oldest entry of the given bucket (or the newest,
+        from its head), and returns its address to the free list. Returns
+        the entry's (data, address)."""
+        views = self.views
+        count = views["counts"][bucket]
+        if count == 0: raise ValueError("Dequeue from an empty bucket.")
+
+        if from_head:
+            address = views["heads"][bucket]
+            views["heads"][bucket] = views["next"][address]
+        else:
+            address = views["tails"][bucket]
+            views["tails"][bucket] = views["prev"][address]
+
+        views["counts"][bucket] = count - 1
+        if count == 1: self.num_buckets -= 1
+
+        tail = (self.fl_head + self.max_num_entries - self.size)
+        views["free_list"][tail % self.max_num_entries] = address
+        self.size -= 1
+        self.num_ops += 1
+        if self.sample_period and not (self.num_ops % self.sample_period):
+            self.sample()
+        return (views["entries"][address], address)
+
+
+    def push_batch(self, buckets: np.ndarray, data: np.ndarray) -> None:
+        """Pushes a run of entries with vectorized updates (equivalent to
+        pushing them one at a time, in order)."""
+        count = len(buckets)
+        if self.size + count > self.max_num_entries:
+            raise ValueError("Enqueue into a full queue.")
+        if not count: return
+
+        # Allocate addresses (in order) and write the entries
+        addresses = self.free_list[(self.fl_head + np.arange(count)) %
+                                   self.max_num_entries]
+        self.fl_head = (self.fl_head + count) % self.max_num_entries
+        self.entries[addresses] = data
+
+        # Group the entries by bucket, preserving their order
+        order = np.argsort(buckets, kind="stable")
+        sorted_buckets = buckets[order].astype(np.int64)
+        addresses = addresses[order]
+        first = np.ones(count, dtype=bool)
+        first[1:] = (sorted_buckets[1:] != sorted_buckets[:-1])
+        last = np.ones(count, dtype=bool)
+        last[:-1] = first[1:]
+
+        # Link each entry to the one pushed before it (in its bucket),
+        # and the first one to the bucket's head
+        chained = ~first[1:]
+        self.next[addresses[1:][chained]] = addresses[:-1][chained]
+        self.prev[addresses[:-1][chained]] = addresses[1:][chained]
+
+        idx = sorted_buckets[first]
+        empty = (self.counts[idx] == 0)
+        self.next[addresses[first]] = self.heads[idx]
+        self.prev[self.heads[idx[~empty]]] = addresses[first][~empty]
+        self.tails[idx[empty]] = addresses[first][empty]
+        self.heads[idx] = addresses[last]
+        self.counts[idx] += np.diff(np.append(np.flatnonzero(first),
+                                              count)).astype(self.counts.dtype)
+
+        # Samples within the run (non-empty buckets only ever increase)
+        if self.sample_period:
+            opened = np.zeros(count, dtype=np.int64)
+            opened[order[first][empty]] = 1
+            ops = self.num_ops + np.arange(1, count + 1)
+            sampled = (ops % self.sample_period == 0)
+            for (x, values) in zip(self.samples, (
+                    ops, self.size + np.arange(1, count + 1),
+                    self.num_buckets + np.cumsum(opened))):
+                x.extend(values[sampled].tolist())
+
+        self.num_ops += count
+        self.size += count
+        self.num_buckets += int(np.count_nonzero(empty))
+        self.peak_size = max(self.peak_size, self.size)
+        self.peak_num_buckets = max(self.peak_num_buckets, self.num_buckets)
+        self.peak_num_pointers = max(self.peak_num_pointers,
+                                     self.size - self.num_buckets)
+
+
+    def pop_batch(self, buckets: np.ndarray) -> np.ndarray:
+        """Pops the oldest entry of each of the given buckets, in order
+        (equivalent to popping them one at a time, from their tails).
+        Returns the popped entries' data."""
+        count = len(buckets)
+        if not count: return np.zeros(0, dtype=np.uint64)
+
+        # Group the pops by bucket, preserving their order
+        order = np.argsort(buckets, kind="stable")
+        sorted_buckets = buckets[order].astype(np.int64)
+        first = np.ones(count, dtype=bool)
+        first[1:] = (sorted_buckets[1:] != sorted_buckets[:-1])
+        starts = np.flatnonzero(first)
+        idx = sorted_buckets[starts]
+        takes = np.diff(np.append(starts, count))
+        if np.any(self.counts[idx] < takes):
+            raise ValueError("Dequeue from an empty bucket.")
+
+        # Walk the buckets' lists from their tails (through previous
+        # pointers), one step of every walk at a time; the last few
+        # (long) walks are finished one bucket at a time
+        addresses = np.empty(count, dtype=self.prev.dtype)
+        (current, positions, remaining) = (self.tails[idx], starts, takes)
+        while True:
+            addresses[positions] = current
+            live = (remaining > 1)
+            if np.count_nonzero(live) < self.min_vectorized_walks: break
+            current = self.prev[current[live]]
+            positions = positions[live] + 1
+            remaining = remaining[live] - 1
+
+        prev = self.views["prev"]
+        walked = memoryview(addresses)
+        for (address, position, take) in zip(
+                current[live].tolist(), positions[live].tolist(),
+                remaining[live].tolist()):
+            for i in range(position + 1, position + take):
+                address = prev[address]
+                walked[i] = address
+
+        self.tails[idx] = self.prev[addresses[starts + takes - 1]]
+
+        # Return the addresses (in pop order) to the free list
+        popped = np.empty(count, dtype=addresses.dtype)
+        popped[order] = addresses
+        tail = self.fl_head + self.max_num_entries - self.size
+        self.free_list[(tail + np.arange(count)) %
+                       self.max_num_entries] = popped
+
+        self.counts[idx] -= takes.astype(self.counts.dtype)
+        emptied = (self.counts[idx] == 0)
+
+        # Samples within the run (non-empty buckets only ever decrease)
+        if self.sample_period:
+            closed = np.zeros(count, dtype=np.int64)
+            closed[order[starts + takes - 1][emptied]] = 1
+            ops = self.num_ops + np.arange(1, count + 1)
+            sampled = (ops % self.sample_period == 0)
+            for (x, values) in zip(self.samples, (
+                    ops, self.size - np.arange(1, count + 1),
+                    self.num_buckets - np.cumsum(closed))):
+                x.extend(values[sampled].tolist())
+
+        self.num_ops += count
+        self.size -= count
+        self.num_buckets -= int(np.count_nonzero(emptied))
+        return self.entries[popped]
+
+
+    def occupancy(self, size: np.ndarray,
+                  num_buckets: np.ndarray) -> np.ndarray:
+        """Returns the occupancy of each memory (OCCUPANCY_DTYPE records)
+        given the number of valid entries and non-empty buckets. Every
+        entry holds a valid next (previous) pointer, except the tail
+        (head) of each bucket."""
+        occupancy = np.zeros(len(size), dtype=OCCUPANCY_DTYPE)
+        occupancy["heap_entries"] = size
+        occupancy["next_pointers"] = size - num_buckets
+        occupancy["previous_pointers"] = size - num_buckets
+        occupancy["priority_buckets"] = num_buckets
+        occupancy["free_list"] = self.max_num_entries - size
+        return occupancy
+
+
+    def history(self) -> Tuple[np.ndarray, np.ndarray]:
+        """Returns the sampled ops (counting from 1), and the occupancy
+        of each memory after them."""
+        (ops, size, num_buckets) = (np.frombuffer(x, dtype=np.int64)
+                                    if len(x) else np.zeros(0, np.int64)
+                                    for x in self.samples)
+        return (ops.copy(), self.occupancy(size, num_buckets))
+
+
+    def peaks(self) -> Dict[str, int]:
+        """Returns the high-water mark of each memory (for the free list,
+        its low-water mark, i.e., the minimum depth)."""
+        return {
+            "heap_entries": self.peak_size,
+            "next_pointers": self.peak_num_pointers,
+            "previous_pointers": self.peak_num_pointers,
+            "priority_buckets": self.peak_num_buckets,
+            "free_list": self.max_num_entries - self.peak_size,
+        }
+
+
+if __name__ == "__main__":
+    import argparse
+    import json
+    import sys
+
+    # Imported here, since the reference model is built on this module
+    from bbq import BBQ
+    from hazards import random_trace
+    from reference import ReferenceModel, make_trace
+    from util import atomic_open
+
+    parser = argparse.ArgumentParser(
+        prog="memory", description=("Reports the occupancy of a BBQ's "
+                                    "memories over a trace."))
+
+    parser.add_argument("num_bitmap_levels", type=int)
+    parser.add_argument("--num_lps", type=int, default=1)
+    parser.add_argument("--calendar", action="store_true",
+                        help="Use a circular priority space (of L1 buckets)")
+    parser.add_argument("--bitmap_width", type=int, default=32)
+    parser.add_argument("--max_num_entries", type=int, default=((1 << 17) - 1),
+                        help="HEAP_MAX_NUM_ENTRIES to check against")
+    parser.add_argument("--capacity", type=int, default=None,
+                        help=("Entries to model (by default, 4x "
+                              "--max_num_entries)"))
+    parser.add_argument("--trace", type=str, default=None,
+                        help="Trace file (.npy of TRACE_DTYPE records)")
+    parser.add_argument("--random", type=int, default=None,
+                        help="Use a trace of this many random ops instead")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--sample_period", type=int, default=0,
+                        help="Ops between occupancy samples (0 for none)")
+    parser.add_argument("--history", type=str, default=None,
+                        help=("Output path for the sampled occupancy (.npy "
+                              "of OCCUPANCY_DTYPE records, plus 'op')"))
+    parser.add_argument("--output", type=str, default=None,
+                        help="Output path for the report (JSON)")
+    args = parser.parse_args()
+
+    bbq = BBQ(args.num_bitmap_levels, args.num_lps,
+              args.bitmap_width if args.num_lps > 1 else 0,
+              calendar=args.calendar)
+    capacity = args.capacity or (4 * args.max_num_entries)
+    model = ReferenceModel.for_bbq(bbq, args.bitmap_width, capacity)
+    model.memory.sample_period = args.sample_period
+
+    if args.trace is not None:
+        records = np.load(args.trace)
+        trace = make_trace(records["op_type"], records["data"],
+                           records["priority"])
+    elif args.random is not None:
+        trace = random_trace(ReferenceModel.for_bbq(
+            bbq, args.bitmap_width, args.max_num_entries),
+                             args.random, args.seed)
+    else:
+        parser.error("Specify --trace or --random.")
+
+    try: model.run(trace)
+    except ValueError as e:
+        sys.exit("[memory] {} (the trace may need a larger --capacity)"
+                 .format(e))
+
+    # Memory depths in the generated design
+    depths = {name: args.max_num_entries for name in MEMORIES}
+    depths["priority_buckets"] = model.num_priorities
+
+    # The free list is as deep as HEAP_MAX_NUM_ENTRIES, not the model
+    peaks = model.memory.peaks()
+    peaks["free_list"] -= (capacity - args.max_num_entries)
+    report = {
+        "num_ops": len(trace),
+        "model_bytes": model.memory.nbytes,
+        "peaks": peaks,
+        "depths": depths,
+        "fits": peaks["heap_entries"] <= args.max_num_entries,
+    }
+    print("{:<20} {:>12} {:>12}".format("Memory", "Peak", "Depth"),
+          file=sys.stderr)
+    for name in MEMORIES:
+        print("{:<20} {:>12} {:>12}{}".format(
+            name, peaks[name], depths[name],
+            " (min depth)" if name == "free_list" else ""), file=sys.stderr)
+    print("[memory] Peak occupancy {} HEAP_MAX_NUM_ENTRIES ({}); model "
+          "size {:.2f} MB".format("fits in" if report["fits"] else "exceeds",
+                                  args.max_num_entries,
+                                  report["model_bytes"] / (1 << 20)),
+          file=sys.stderr)
+
+    if args.history is not None:
+        (ops, occupancy) = model.memory.history()
+        history = np.zeros(len(ops), dtype=np.dtype(
+            [("op", np.int64)] + OCCUPANCY_DTYPE.descr))
+        history["op"] = ops
+        for name in MEMORIES: history[name] = occupancy[name]
+        history["free_list"] -= (capacity - args.max_num_entries)
+        np.save(args.history, history)
+
+    if args.output is not None:
+        with atomic_open(args.output) as f:
+            json.dump(report, f, indent=4)
+            f.write("\n")
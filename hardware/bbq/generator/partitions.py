@@ -0,0 +1,346 @@
+#!/usr/bin/python3
+from __future__ import annotations
+
+import argparse
+import json
+import sys
+from typing import Dict, List
+
+import numpy as np
+
+from bbq import BBQ
+from difftest import CYCLE_TRACE_DTYPE
+from hazards import HazardAnalyzer
+from reference import make_trace
+from simulator import HeapOp
+from util import atomic_open
+from workloads import WORKLOADS
+
+# A trace with the arrival cycle and tenant of each op
+TENANT_TRACE_DTYPE = np.dtype(CYCLE_TRACE_DTYPE.descr +
+                              [("tenant", np.uint16)])
+
+
+def jain_index(x: np.ndarray) -> float:
+    """Returns Jain's fairness index of the given allocations (1 if all
+    are equal, down to 1/n if one tenant gets everything)."""
+    if not len(x) or not np.any(x): return 1.0
+    return float(np.sum(x) ** 2 / (len(x) * np.sum(x ** 2)))
+
+
+class TenantMix:
+    """Multi-tenant workload for a partitioned BBQ. Each tenant runs its
+    own packet-scheduling workload (see workloads.py) in a logical
+    partition (tenant t uses partition t mod num_lps, so tenants share
+    partitions if there are fewer of them). Each cycle, an op arrives
+    with the given probability, from a tenant drawn by share. Tenants
+    are closed-loop with respect to their own queues only; the entries
+    of the BBQ (and, if shared, the partitions) are contended for."""
+    def __init__(self, names: List[str], shares: List[float], num_lps: int,
+                 lp_size: int, max_num_entries: int=127, load: float=1.0,
+                 seed: int=0, **kwargs) -> None:
+        if not (0 < load <= 1):
+            raise ValueError("Load must be in (0, 1].")
+
+        self.rng = np.random.default_rng(seed)
+        self.num_lps = num_lps
+        self.lp_size = lp_size
+        self.load = load
+        self.shares = np.array(shares, dtype=float) / np.sum(shares)
+        self.workloads = [WORKLOADS[name](lp_size, max_num_entries,
+                                          seed=(seed + 1 + t), **kwargs)
+                          for (t, name) in enumerate(names)]
+
+
+    def trace(self, num_ops: int) -> np.ndarray:
+        """Returns the next num_ops ops (TENANT_TRACE_DTYPE records).
+        Enqueues carry their op index as data."""
+        trace = np.zeros(num_ops, dtype=TENANT_TRACE_DTYPE)
+        tenants = self.rng.choice(len(self.workloads), num_ops, p=self.shares)
+        gaps = self.rng.geometric(self.load, num_ops)
+        trace["cycle"] = np.cumsum(gaps) - gaps[0]
+        trace["tenant"] = tenants
+        trace["data"] = np.arange(num_ops)
+
+        for (t, workload) in enumerate(self.workloads):
+            idx = np.flatnonzero(tenants == t)
+            if not len(idx): continue
+
+            ops = np.concatenate(list(workload.chunks(len(idx))))
+            trace["op_type"][idx] = ops["op_type"]
+            trace["priority"][idx] = (ops["priority"] + self.lp_size *
+                                      (t % self.num_lps))
+        return trace
+
+
+class PartitionAnalyzer:
+    """Trace-driven model of a logically partitioned BBQ shared by
+    several tenants. The partitions share one pipeline (so ops of
+    different tenants queue behind each other at the ingress), and one
+    pool of heap entries (so a tenant with a deep queue can cause the
+    enqueues of others to be dropped); tenants that share a partition
+    also share its min/max. The report breaks down service, drops and
+    delays by tenant, occupancy by partition, and summarizes fairness
+    (Jain's index) and contention. Exact for ops issued at least two
+    cycles apart (see HazardAnalyzer)."""
+    def __init__(self, bbq: BBQ, bitmap_width: int=None,
+                 max_num_entries: int=None) -> None:
+        self.hazards = HazardAnalyzer(bbq, bitmap_width, max_num_entries)
+        model = self.hazards.reference_model()
+        self.num_lps = model.num_lps
+        self.lp_size = model.lp_size
+        self.max_num_entries = model.max_num_entries
+
+
+    def analyze(self, trace: np.ndarray, tenants: np.ndarray=None,
+                arrivals: np.ndarray=None, spacing: int=1) -> dict:
+        """Analyzes the given trace (TRACE_DTYPE records) of the given
+        tenants (by default, one per partition) arriving in the given
+        cycles (by default, one op per cycle)."""
+        trace = make_trace(trace["op_type"], trace["data"], trace["priority"])
+        num_ops = len(trace)
+        lp_size = self.lp_size
+        if tenants is None: tenants = trace["priority"] // lp_size
+        tenants = np.asarray(tenants, dtype=np.int64)
+        if arrivals is None: arrivals = np.arange(num_ops, dtype=np.int64)
+        arrivals = np.asarray(arrivals, dtype=np.int64)
+        issued = self.hazards.schedule(arrivals, spacing)
+        (admitted, _) = self.hazards.admit(trace, issued)
+
+        # Replay the admitted ops, tagging each entry with its op index
+        ops = np.flatnonzero(admitted)
+        tagged = trace[admitted].copy()
+        tagged["data"] = ops
+        outputs = self.hazards.reference_model().run(tagged)
+        is_enque = (tagged["op_type"] == HeapOp.ENQUE)
+        dequeues = ops[~is_enque]
+        sources = outputs["data"][~is_enque].astype(np.int64)
+
+        # Ops ahead of each op in the ingress queue, from any tenant
+        delays = issued - arrivals
+        ahead = np.arange(num_ops) - np.searchsorted(issued, arrivals)
+        ahead_same = np.zeros(num_ops, dtype=np.int64)
+
+        num_tenants = int(tenants.max()) + 1 if num_ops else 0
+        partitions = trace["priority"] // lp_size
+        sojourns = issued[dequeues] - issued[sources]
+        stats = (lambda f, x: float(f(x)) if len(x) else 0.0)
+        per_tenant: Dict[str, dict] = {}
+        (admit_ratio, service_ratio) = ([], [])
+        for t in range(num_tenants):
+            mine = np.flatnonzero(tenants == t)
+            if not len(mine): continue
+            ahead_same[mine] = np.arange(len(mine)) - np.searchsorted(
+                issued[mine], arrivals[mine])
+
+            enques = (trace["op_type"][mine] == HeapOp.ENQUE)
+            num_admitted = int(np.count_nonzero(admitted[mine]))
+            num_enqueued = int(np.count_nonzero(admitted[mine] & enques))
+            served = (tenants[sources] == t)
+            sojourn = sojourns[served]
+
+            admit_ratio.append(num_admitted / len(mine))
+            if num_enqueued:
+                service_ratio.append(np.count_nonzero(served) / num_enqueued)
+
+            per_tenant[str(t)] = {
+                "partitions": np.unique(partitions[mine]).tolist(),
+                "offered_ops": len(mine),
+                "enqueues": int(np.count_nonzero(enques)),
+                "dropped_enqueues": int(np.count_nonzero(
+                    enques & ~admitted[mine])),
+                "dropped_dequeues": int(np.count_nonzero(
+                    ~enques & ~admitted[mine])),
+                "served": int(np.count_nonzero(served)),
+                "cross_dequeues": int(np.count_nonzero(
+                    (tenants[dequeues] == t) & ~served)),
+                "queueing_delay": {
+                    "mean": stats(np.mean, delays[mine]),
+                    "p99": stats(lambda x: np.percentile(x, 99),
+                                 delays[mine]),
+                },
+                "ops_ahead_from_others": stats(
+                    np.mean, (ahead - ahead_same)[mine]),
+                "sojourn": {
+                    "mean": stats(np.mean, sojourn),
+                    "p99": stats(lambda x: np.percentile(x, 99), sojourn),
+                },
+            }
+
+        # Partition occupancy, weighted by the cycles it is held for
+        lps = outputs["priority"] // lp_size
+        deltas = np.where(is_enque, 1, -1)
+        cycles = issued[ops]
+        (start, end) = ((int(issued[0]), int(issued[-1]) + 1) if num_ops
+                        else (0, 1))
+        per_lp: Dict[str, dict] = {}
+        for lp in range(self.num_lps):
+            mine = (lps == lp)
+            occupancy = np.cumsum(deltas[mine])
+            held = np.diff(np.append(cycles[mine], end))
+            per_lp[str(lp)] = {
+                "tenants": np.unique(tenants[partitions == lp]).tolist(),
+                "ops": int(np.count_nonzero(mine)),
+                "mean_occupancy": float(np.dot(occupancy, held) /
+                                        (end - start)),
+                "max_occupancy": int(occupancy.max() if len(occupancy)
+                                     else 0),
+            }
+            per_lp[str(lp)]["peak_share"] = (
+                per_lp[str(lp)]["max_occupancy"] / self.max_num_entries)
+
+        total = np.cumsum(deltas)
+        return {
+            "num_ops": num_ops,
+            "num_lps": self.num_lps,
+            "lp_size": lp_size,
+            "tenants": per_tenant,
+            "partitions": per_lp,
+            "fairness": {
+                "jain_admission": jain_index(np.array(admit_ratio)),
+                "jain_service": jain_index(np.array(service_ratio)),
+            },
+            "contention": {
+                "queued_ops": int(np.count_nonzero(delays)),
+                "mean_queueing_delay": stats(np.mean, delays),
+                "dropped_enqueues": int(np.count_nonzero(
+                    (trace["op_type"] == HeapOp.ENQUE) & ~admitted)),
+                "dropped_dequeues": int(np.count_nonzero(
+                    (trace["op_type"] != HeapOp.ENQUE) & ~admitted)),
+                "cross_dequeues": int(np.count_nonzero(
+                    tenants[dequeues] != tenants[sources])),
+                "peak_occupancy": int(total.max() if len(total) else 0),
+            },
+        }
+
+
+def format_report(report: dict) -> str:
+    """Renders a report as a human-readable table."""
+    lines = ["{:<8} {:>4} {:>9} {:>9} {:>9} {:>7} {:>18} {:>16}".format(
+        "Tenant", "LP", "Offered", "Dropped", "Served", "Cross",
+        "Delay (p99)", "Sojourn (p99)")]
+    for (t, x) in report["tenants"].items():
+        lines.append("{:<8} {:>4} {:>9} {:>9} {:>9} {:>7} {:>18} {:>16}"
+                     .format(t, ",".join(map(str, x["partitions"])),
+                             x["offered_ops"],
+                             x["dropped_enqueues"] + x["dropped_dequeues"],
+                             x["served"], x["cross_dequeues"],
+                             "{:.2f} ({:.0f})".format(
+                                 x["queueing_delay"]["mean"],
+                                 x["queueing_delay"]["p99"]),
+                             "{:.1f} ({:.0f})".format(x["sojourn"]["mean"],
+                                                      x["sojourn"]["p99"])))
+
+    lines.append("{:<8} {:>12} {:>24} {:>11}".format(
+        "LP", "Tenants", "Occupancy (mean, max)", "Peak share"))
+    for (lp, x) in report["partitions"].items():
+        if not x["ops"]: continue
+        lines.append("{:<8} {:>12} {:>24} {:>11.3f}".format(
+            lp, ",".join(map(str, x["tenants"])),
+            "{:.1f}, {}".format(x["mean_occupancy"], x["max_occupancy"]),
+            x["peak_share"]))
+
+    fairness = report["fairness"]
+    contention = report["contention"]
+    lines.append("Fairness (Jain's index): admission {:.3f}, service {:.3f}"
+                 .format(fairness["jain_admission"],
+                         fairness["jain_service"]))
+    lines.append("Contention: {} queued op(s) (mean delay {:.2f}), {} "
+                 "enqueue(s) and {} dequeue(s) dropped, {} cross-tenant "
+                 "dequeue(s), peak occupancy {}".format(
+                     contention["queued_ops"],
+                     contention["mean_queueing_delay"],
+                     contention["dropped_enqueues"],
+                     contention["dropped_dequeues"],
+                     contention["cross_dequeues"],
+                     contention["peak_occupancy"]))
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        prog="partitions", description=("Reports per-partition fairness and "
+                                        "contention of a partitioned BBQ "
+                                        "under a multi-tenant trace."))
+
+    parser.add_argument("num_bitmap_levels", type=int)
+    parser.add_argument("--num_lps", type=int, nargs="+", default=[1],
+                        help="Numbers of logical partitions to compare")
+    parser.add_argument("--bitmap_width", type=int, required=True)
+    parser.add_argument("--max_num_entries", type=int, default=127)
+    parser.add_argument("--tenants", type=str, nargs="+", default=None,
+                        help=("Tenant workloads, as NAME[:SHARE] (e.g., "
+                              "wfq:2 edf pfabric)"))
+    parser.add_argument("--load", type=float, default=1.0,
+                        help="Offered ops per cycle")
+    parser.add_argument("--num_ops", type=int, default=100000)
+    parser.add_argument("--trace", type=str, default=None,
+                        help=("Use a trace file instead (.npy of TRACE_DTYPE "
+                              "records, with optional 'cycle' and 'tenant' "
+                              "fields)"))
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--spacing", type=int, default=1,
+                        help="Minimum number of cycles between ops")
+    parser.add_argument("--save_trace", type=str, default=None,
+                        help=("Output path for the generated trace (with "
+                              "--tenants and a single --num_lps)"))
+    parser.add_argument("--output", type=str, default=None,
+                        help="Output path for the report(s) (JSON)")
+    args = parser.parse_args()
+
+    if (args.trace is None) == (args.tenants is None):
+        parser.error("Specify either --tenants or --trace.")
+    if len(args.num_lps) > 1 and (args.trace or args.save_trace):
+        parser.error("Traces are tied to a single --num_lps.")
+
+    # Validate every configuration before analyzing any
+    bbqs = {}
+    for num_lps in args.num_lps:
+        try: bbqs[num_lps] = BBQ(args.num_bitmap_levels, num_lps,
+                                 args.bitmap_width)
+        except ValueError as e:
+            parser.error("--num_lps {}: {}".format(num_lps, e))
+
+    reports = {}
+    for (num_lps, bbq) in bbqs.items():
+        analyzer = PartitionAnalyzer(bbq, args.bitmap_width,
+                                     args.max_num_entries)
+        if args.trace is not None:
+            trace = np.load(args.trace)
+            names = trace.dtype.names
+            report = analyzer.analyze(
+                trace, trace["tenant"] if "tenant" in names else None,
+                trace["cycle"] if "cycle" in names else None, args.spacing)
+
+        else:
+            specs = [(spec.split(":") + ["1"])[:2] for spec in args.tenants]
+            if any(name not in WORKLOADS for (name, _) in specs):
+                parser.error("Workloads: {}".format(", ".join(
+                    sorted(WORKLOADS))))
+
+            mix = TenantMix([name for (name, _) in specs],
+                            [float(share) for (_, share) in specs],
+                            num_lps, analyzer.lp_size, args.max_num_entries,
+                            args.load, args.seed)
+            trace = mix.trace(args.num_ops)
+            report = analyzer.analyze(trace, trace["tenant"],
+                                      trace["cycle"], args.spacing)
+
+            # Ranks that did not fit in a partition's priority range
+            for (t, workload) in enumerate(mix.workloads):
+                if str(t) not in report["tenants"]: continue
+                report["tenants"][str(t)]["workload"] = workload.name()
+                report["tenants"][str(t)]["clamped"] = (
+                    workload.quantizer.num_clamped)
+
+            if args.save_trace is not None: np.save(args.save_trace, trace)
+
+        print("[partitions] {} logical partition(s) of {} priorities"
+              .format(num_lps, analyzer.lp_size), file=sys.stderr)
+        print(format_report(report), file=sys.stderr)
+        reports[str(num_lps)] = report
+
+    if args.output is not None:
+        with atomic_open(args.output) as f:
+            json.dump(reports if len(reports) > 1 else report, f, indent=4)
+            f.write("\n")
@@ -0,0 +1,163 @@
+#!/usr/bin/python3
+from __future__ import annotations
+
+import re
+from abc import ABC, abstractmethod
+from collections import defaultdict
+from typing import Dict, List, Set
+
+from ir import Assign, Conditional, Decl, Node, Text, walk
+
+# Module-level localparam definitions
+LOCALPARAM_RE = re.compile(r"^localparam (\w+)\s*=.*;")
+
+
+class Pass(ABC):
+    """Represents a generic optimization pass over the IR."""
+    @abstractmethod
+    def name(self) -> str:
+        """Canonical pass name."""
+        raise NotImplementedError()
+
+
+    @abstractmethod
+    def run(self, nodes: List[Node]) -> None:
+        """Transforms the IR in-place."""
+        raise NotImplementedError()
+
+
+    @abstractmethod
+    def report(self) -> str:
+        """Summary of the changes made by the last run."""
+        raise NotImplementedError()
+
+
+class DeadSignalElimination(Pass):
+    """Removes signals that are declared or assigned, but never read."""
+    def __init__(self) -> None:
+        self.removed_signals: List[str] = []    # Removed signals
+        self.removed_flops: List[str] = []      # Removed registers
+
+
+    def name(self) -> str:
+        """Canonical pass name."""
+        return "dead-signal-elimination"
+
+
+    @staticmethod
+    def find_dead_signals(nodes: List[Node]) -> Set[str]:
+        """Returns declared signals that are never read."""
+        declared, reads = set(), set()
+        for node in walk(nodes):
+            if isinstance(node, Decl): declared.add(node.name)
+            else: reads.update(node.reads())
+
+        return declared - reads
+
+
+    @staticmethod
+    def prune(nodes: List[Node], dead: Set[str],
+              assigns: Dict[str, List[Assign]]) -> List[Node]:
+        """Drops declarations and assignments of dead signals,
+        as well as any conditionals that are left empty."""
+        pruned: List[Node] = []
+        for node in nodes:
+            if isinstance(node, Decl) and (node.name in dead): continue
+            if isinstance(node, Assign) and (node.target in dead):
+                assigns[node.target].append(node)
+                continue
+
+            body = node.children()
+            if body: body[:] = DeadSignalElimination.prune(body, dead, assigns)
+            pruned.append(node)
+
+        # Remove conditionals with empty bodies. An empty 'if' may
+        # only be removed if it isn't followed by an 'else' branch.
+        output: List[Node] = []
+        for i, node in enumerate(pruned):
+            if isinstance(node, Conditional) and not node.body:
+                next_node = pruned[i + 1] if (i + 1) < len(pruned) else None
+                has_else = (isinstance(next_node, Conditional) and
+                            next_node.header in ["else", "else if"])
+
+                if (node.header == "else") or not has_else: continue
+
+            output.append(node)
+
+        return output
+
+
+    def run(self, nodes: List[Node]) -> None:
+        """Transforms the IR in-place."""
+        self.removed_signals = []
+        self.removed_flops = []
+
+        # Removing a dead signal's assignments may, in
+        # turn, make its sources dead; iterate until done.
+        while True:
+            dead = self.find_dead_signals(nodes)
+            if not dead: break
+
+            assigns: Dict[str, List[Assign]] = defaultdict(list)
+            nodes[:] = self.prune(nodes, dead, assigns)
+
+            for signal in sorted(dead):
+                self.removed_signals.append(signal)
+                if any((a.op == "<=") for a in assigns[signal]):
+                    self.removed_flops.append(signal)
+
+
+    def report(self) -> str:
+        """Summary of the changes made by the last run."""
+        return ("[{}] Removed {} signal(s), {} of which are registers: {}"
+                .format(self.name(), len(self.removed_signals),
+                        len(self.removed_flops),
+                        ", ".join(self.removed_flops) or "none"))
+
+
+class UnusedParamElimination(Pass):
+    """Removes module-level localparams that are never referenced."""
+    def __init__(self) -> None:
+        self.removed_params: List[str] = []     # Removed localparams
+
+
+    def name(self) -> str:
+        """Canonical pass name."""
+        return "unused-param-elimination"
+
+
+    @staticmethod
+    def param_name(node: Node) -> str:
+        """Returns the localparam defined by the node (if any)."""
+        if not (isinstance(node, Text) and (node.level == 0) and
+                (len(node.lines) == 1) and node.lines[0]): return None
+
+        match = LOCALPARAM_RE.match(node.lines[0])
+        return match.group(1) if match else None
+
+
+    def run(self, nodes: List[Node]) -> None:
+        """Transforms the IR in-place."""
+        self.removed_params = []
+
+        # Removing a localparam may, in turn, make the
+        # ones used to define it unused; iterate until done.
+        while True:
+            reads: Set[str] = set()
+            for node in walk(nodes):
+                name = self.param_name(node)
+                reads.update(x for x in node.reads() if x != name)
+
+            unused = [x for x in nodes if self.param_name(x) and
+                      (self.param_name(x) not in reads)]
+            if not unused: break
+
+            self.removed_params.extend(self.param_name(x) for x in unused)
+            nodes[:] = [x for x in nodes if x not in unused]
+
+
+    def report(self) -> str:
+        """Summary of the changes made by the last run."""
+        return "[{}] Removed {} localparam(s): {}".format(
+            self.name(), len(self.removed_params),
+            ", ".join(self.removed_params) or "none")
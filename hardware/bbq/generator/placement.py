@@ -0,0 +1,162 @@
+#!/usr/bin/python3
+from __future__ import annotations
+
+import argparse
+import json
+import sys
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+from bbq import BBQ
+from resources import ResourceEstimator, top_params
+from util import atomic_open
+
+# Ways of ranking feasible placements (by key, smallest first)
+OBJECTIVES: Dict[str, Callable[[dict], tuple]] = {
+    "latency": lambda x: (x["latency"], x["m20ks"], x["register_bits"]),
+    "m20ks": lambda x: (x["m20ks"], x["register_bits"], x["latency"]),
+    "registers": lambda x: (x["register_bits"], x["m20ks"], x["latency"]),
+}
+
+
+class PlacementOptimizer:
+    """Chooses, per bitmap level, whether bitmaps and counters are stored
+    in SRAM or registers. Each SRAM lookup adds a pipeline stage, while
+    register storage costs the level's full bitmap (or counter) array
+    in flip-flops. Since level L holds W times as many bits as level
+    L-1, and every level's SRAM lookup costs the same stage, it only
+    pays to keep a prefix of levels in registers: the optimizer thus
+    considers every pair of (bitmap, counter) thresholds, and estimates
+    each candidate exactly from its generated IR."""
+    def __init__(self, num_bitmap_levels: int, num_lps: int=1,
+                 bitmap_width: int=32, element_bits: int=17,
+                 calendar: bool=False) -> None:
+        self.num_bitmap_levels = num_bitmap_levels
+        self.num_lps = num_lps
+        self.bitmap_width = bitmap_width
+        self.element_bits = element_bits
+        self.calendar = calendar
+
+        # Validates the configuration, and finds the first bitmap level
+        self.first_level_id = self.bbq().first_level_id
+
+
+    def bbq(self, sram_bitmaps: Tuple[int, ...]=None,
+            sram_counters: Tuple[int, ...]=None) -> BBQ:
+        """Returns a BBQ with the given placement."""
+        return BBQ(self.num_bitmap_levels, self.num_lps,
+                   self.bitmap_width if self.num_lps > 1 else 0,
+                   calendar=self.calendar, sram_bitmaps=sram_bitmaps,
+                   sram_counters=sram_counters)
+
+
+    def candidates(self) -> Iterator[Tuple[Tuple[int, ...],
+                                           Tuple[int, ...]]]:
+        """Yields the (sram_bitmaps, sram_counters) of each candidate,
+        i.e., every level at or past a threshold uses SRAM. L1 always
+        uses registers."""
+        first = max(2, self.first_level_id)
+        last = self.num_bitmap_levels + 1
+        for bitmaps in range(first, last + 1):
+            for counters in range(first, last + 1):
+                yield (tuple(range(bitmaps, last)),
+                       tuple(range(counters, last)))
+
+
+    def evaluate(self, sram_bitmaps: Tuple[int, ...],
+                 sram_counters: Tuple[int, ...]) -> dict:
+        """Returns the latency and (estimated) resources of a placement."""
+        bbq = self.bbq(sram_bitmaps, sram_counters)
+        params = top_params(self.bitmap_width, self.element_bits)
+        totals = ResourceEstimator(bbq).estimate({
+            x: v for (x, v) in params.items()
+            if x in bbq.parameters})["totals"]
+
+        return {
+            "sram_bitmaps": list(sram_bitmaps),
+            "sram_counters": list(sram_counters),
+            "latency": bbq.num_pipeline_stages,
+            "register_bits": totals["register_bits"],
+            "storage_register_bits": totals["storage_register_bits"],
+            "m20ks": totals["m20ks"],
+        }
+
+
+    def optimize(self, max_registers: int=None, max_m20ks: int=None,
+                 max_latency: int=None, objective: str="latency"
+                 ) -> Tuple[Optional[dict], List[dict]]:
+        """Returns the best placement that fits the budgets (or None if
+        none does), and all the evaluated candidates, best first."""
+        results = [self.evaluate(*x) for x in self.candidates()]
+        for x in results:
+            x["fits"] = (
+                ((max_registers is None) or
+                 (x["register_bits"] <= max_registers)) and
+                ((max_m20ks is None) or (x["m20ks"] <= max_m20ks)) and
+                ((max_latency is None) or (x["latency"] <= max_latency)))
+
+        results.sort(key=lambda x: (not x["fits"], OBJECTIVES[objective](x)))
+        best = results[0] if results[0]["fits"] else None
+        return (best, results)
+
+
+def format_results(results: List[dict]) -> str:
+    """Formats evaluated placements as a table."""
+    lines = ["{:<16} {:<16} {:>8} {:>10} {:>8} {:>5}".format(
+        "SRAM bitmaps", "SRAM counters", "Latency", "Reg bits",
+        "M20Ks", "Fits")]
+
+    for x in results:
+        lines.append("{:<16} {:<16} {:>8} {:>10} {:>8} {:>5}".format(
+            " ".join(map(str, x["sram_bitmaps"])) or "-",
+            " ".join(map(str, x["sram_counters"])) or "-",
+            x["latency"], x["register_bits"], x["m20ks"],
+            "yes" if x["fits"] else "no"))
+
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        prog="placement", description=("Chooses the SRAM or register "
+                                       "placement of each level's bitmaps "
+                                       "and counters."))
+
+    parser.add_argument("num_bitmap_levels", type=int)
+    parser.add_argument("--num_lps", type=int, default=1)
+    parser.add_argument("--calendar", action="store_true",
+                        help="Use a circular priority space (of L1 buckets)")
+    parser.add_argument("--bitmap_width", type=int, default=32)
+    parser.add_argument("--element_bits", type=int, default=17,
+                        help=("ELEMENT_BITS (entry data width, and log2 of "
+                              "the number of entries), as in quartus/top.sv"))
+    parser.add_argument("--max_registers", type=int, default=None,
+                        help="Register bit budget")
+    parser.add_argument("--max_m20ks", type=int, default=None,
+                        help="M20K block budget")
+    parser.add_argument("--max_latency", type=int, default=None,
+                        help="Latency target (in pipeline stages)")
+    parser.add_argument("--objective", type=str, default="latency",
+                        choices=sorted(OBJECTIVES),
+                        help="What to minimize among fitting placements")
+    parser.add_argument("--output", type=str, default=None,
+                        help="Output path for the results (JSON)")
+    args = parser.parse_args()
+
+    optimizer = PlacementOptimizer(args.num_bitmap_levels, args.num_lps,
+                                   args.bitmap_width, args.element_bits,
+                                   args.calendar)
+    (best, results) = optimizer.optimize(args.max_registers, args.max_m20ks,
+                                         args.max_latency, args.objective)
+
+    print(format_results(results), file=sys.stderr)
+    if args.output is not None:
+        with atomic_open(args.output) as f:
+            json.dump({"best": best, "candidates": results}, f, indent=4)
+            f.write("\n")
+
+    if best is None:
+        sys.exit("[placement] No placement fits the budgets.")
+
+    # Flags that generate the chosen placement
+    print(" ".join(["--sram_bitmaps"] + list(map(str, best["sram_bitmaps"])) +
+                   ["--sram_counters"] + list(map(str, best["sram_counters"]))))
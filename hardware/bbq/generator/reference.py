@@ -0,0 +1,427 @@
+#!/usr/bin/python3
+from __future__ import annotations
+
+import typing
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+from memory import MemoryModel
+from simulator import HeapOp
+from util import steering_levels
+
+# Hack for type hinting with circular imports
+if typing.TYPE_CHECKING: from bbq import BBQ
+
+# A trace record (one per op); outputs use the same layout
+TRACE_DTYPE = np.dtype([("op_type", np.uint8), ("data", np.uint64),
+                        ("priority", np.int64)])
+
+
+def make_trace(op_type: np.ndarray, data: np.ndarray=0,
+               priority: np.ndarray=0) -> np.ndarray:
+    """Returns a trace (structured array) with the given fields."""
+    trace = np.zeros(len(op_type), dtype=TRACE_DTYPE)
+    trace["op_type"] = op_type
+    trace["data"] = data
+    trace["priority"] = priority
+    return trace
+
+
+class ReferenceModel:
+    """Functional (untimed) model of BBQ's HFFS queue. The state mirrors
+    the generated design: per-level bitmaps (NUM_BITMAPS_L*) and subtree
+    occupancy counters (NUM_COUNTERS_L*), and per-bucket FIFO lists that
+    are threaded through the heap entries, whose addresses are recycled
+    through a free list (see MemoryModel). Partitioned BBQs only hold
+    the levels below the steering level; dequeues start at the bitmap
+    of the op's partition (or, with W^L partitions, at its bucket).
+    In calendar mode, the priority space is circular: dequeues search the
+    L1 bitmap from its base (the L1 index of the last deque-min)."""
+    min_batch_size = 32                     # Shorter runs are not batched
+    min_dequeue_batch_size = 256            # (Dequeues cost more to batch)
+    max_dequeue_batch = 1024                # Dequeue runs are chunked
+
+    def __init__(self, num_bitmap_levels: int, bitmap_width: int,
+                 num_lps: int=1, max_num_entries: int=((1 << 17) - 1),
+                 calendar: bool=False) -> None:
+        if not (2 <= bitmap_width <= 64):
+            raise ValueError("Bitmap width must be in [2, 64].")
+
+        # Level holding the partitions' root bitmaps (validated as in
+        # BBQ, which replaces the levels above it with a steering level).
+        # With W^L partitions, the steering level is also the leaf level:
+        # each partition is a single bucket, and no bitmap level remains.
+        start_level = steering_levels(num_bitmap_levels, bitmap_width,
+                                      num_lps) + 1
+
+        if calendar and (num_lps > 1):
+            raise ValueError("Calendar mode does not support logical "
+                             "partitioning.")
+
+        self.num_bitmap_levels = num_bitmap_levels
+        self.bitmap_width = bitmap_width
+        self.num_lps = num_lps
+        self.max_num_entries = max_num_entries
+        self.num_priorities = bitmap_width ** num_bitmap_levels
+        self.lp_size = self.num_priorities // num_lps # Priorities per LP
+        self.start_level = start_level      # First non-steering level
+        self.calendar = calendar            # Circular priority space?
+        self.base = 0                       # L1 index of the base
+        self.size = 0                       # Number of queued entries
+
+        # Bitmaps and StOCs, indexed by (level - 1)
+        self.bitmaps: List[np.ndarray] = []
+        self.counters: List[np.ndarray] = []
+        for level in range(1, num_bitmap_levels + 1):
+            skip = (level < start_level)
+            self.bitmaps.append(None if skip else np.zeros(
+                self.num_bitmaps(level), dtype=np.uint64))
+            self.counters.append(None if skip else np.zeros(
+                self.num_counters(level), dtype=np.int64))
+
+        # Priority buckets, heap entries, pointers and free list
+        self.memory = MemoryModel(self.num_priorities, max_num_entries)
+
+        # Per-op accesses go through memoryviews of the arrays above,
+        # which are several times faster than indexing NumPy scalars.
+        self.views = {
+            "bitmaps": [None if x is None else memoryview(x)
+                        for x in self.bitmaps],
+            "counters": [None if x is None else memoryview(x)
+                         for x in self.counters],
+        }
+        self.views["roots"] = (
+            self.memory.views["counts"] if self.is_steering_leaf
+            else self.views["bitmaps"][start_level - 1])
+
+
+    @classmethod
+    def for_bbq(cls, bbq: BBQ, bitmap_width: int=None,
+                max_num_entries: int=None) -> ReferenceModel:
+        """Returns a model of the given BBQ. The bitmap width and queue
+        size default to the generated module's parameter defaults."""
+        if bitmap_width is None: bitmap_width = bbq.bitmap_width or 4
+        if max_num_entries is None: max_num_entries = bbq.max_num_entries
+        return cls(bbq.num_bitmap_levels, bitmap_width,
+                   bbq.num_lps, max_num_entries, bbq.calendar)
+
+
+    def num_bitmaps(self, level: int) -> int:
+        """Bitmaps at the given level (NUM_BITMAPS_L*)."""
+        return self.bitmap_width ** (level - 1)
+
+
+    def num_counters(self, level: int) -> int:
+        """StOCs at the given level (NUM_COUNTERS_L*)."""
+        return self.bitmap_width ** level
+
+
+    def __len__(self) -> int:
+        return self.size
+
+
+    def partition(self, priority: int) -> int:
+        """Returns the logical partition a priority belongs to."""
+        return priority // self.lp_size
+
+
+    @property
+    def is_steering_leaf(self) -> bool:
+        """Is the steering level also the leaf level?"""
+        return self.start_level > self.num_bitmap_levels
+
+
+    def roots(self) -> memoryview:
+        """Returns, per partition, a value that is non-zero iff the
+        partition is non-empty: its root bitmap (or, if the steering
+        level is the leaf level, its bucket's number of entries)."""
+        return self.views["roots"]
+
+
+    def occupancy(self) -> np.ndarray:
+        """Returns the number of entries queued in each partition (the
+        sum of the partition's root StOCs)."""
+        if self.is_steering_leaf:
+            return self.memory.counts.astype(np.int64)
+
+        counters = self.counters[self.start_level - 1]
+        return counters.reshape(self.num_lps, -1).sum(axis=1)
+
+
+    def enqueue(self, data: int, priority: int) -> None:
+        """Appends data to the tail of the given priority bucket."""
+        if self.size == self.max_num_entries:
+            raise ValueError("Enqueue into a full queue.")
+        if not (0 <= priority < self.num_priorities):
+            raise ValueError("Invalid priority: {}".format(priority))
+
+        views = self.views
+        self.memory.push(priority, data)
+
+        # Update the StOCs (and bitmaps) along the path to the bucket
+        width = self.bitmap_width
+        for level in range(self.num_bitmap_levels, self.start_level - 1, -1):
+            counters = views["counters"][level - 1]
+            counters[priority] += 1
+            if counters[priority] == 1:
+                views["bitmaps"][level - 1][priority // width] |= (
+                    1 << (priority % width))
+
+            priority //= width
+
+        self.size += 1
+
+
+    def search(self, op: HeapOp, priority: int=0) -> int:
+        """Returns the min (or max) non-empty priority bucket (within the
+        partition of the given priority, if partitioned)."""
+        views = self.views
+        idx = priority // self.lp_size
+        if views["roots"][idx] == 0:
+            raise ValueError("Dequeue from an empty queue.")
+
+        if op == HeapOp.DEQUE_MIN: is_min = True
+        elif op == HeapOp.DEQUE_MAX: is_min = False
+        else: raise ValueError("Not a dequeue: {}".format(op))
+
+        (width, bitmaps) = (self.bitmap_width, views["bitmaps"])
+        for level in range(self.start_level, self.num_bitmap_levels + 1):
+            bitmap = bitmaps[level - 1][idx]
+
+            # Rotate the L1 bitmap so that the base is its LSb
+            rotate = self.calendar and (level == 1)
+            if rotate:
+                bitmap = ((bitmap >> self.base) | (bitmap << (
+                    width - self.base))) & ((1 << width) - 1)
+
+            bit = ((bitmap & -bitmap) if is_min else bitmap).bit_length() - 1
+            if rotate: bit = (bit + self.base) % width
+            idx = idx * width + bit
+
+        return idx
+
+
+    def bounds(self, lp: int=0) -> Optional[Tuple[int, int]]:
+        """Returns the (min, max) non-empty priority of the given logical
+        partition, or None if it is empty."""
+        priority = lp * self.lp_size
+        if self.views["roots"][lp] == 0: return None
+        return (self.search(HeapOp.DEQUE_MIN, priority),
+                self.search(HeapOp.DEQUE_MAX, priority))
+
+
+    def dequeue(self, op: HeapOp, priority: int=0) -> Tuple[int, int]:
+        """Removes the head of the min (or max) non-empty priority bucket
+        (within the partition of the given priority, if partitioned).
+        Returns the (data, priority) of the dequeued entry."""
+        views = self.views
+        idx = self.search(op, priority)
+        width = self.bitmap_width
+        if self.calendar and (op == HeapOp.DEQUE_MIN):
+            self.base = idx // (width ** (self.num_bitmap_levels - 1))
+
+        # Pop the bucket's oldest entry, and recycle its address
+        (data, _) = self.memory.pop(idx)
+
+        # Update the StOCs (and bitmaps) along the path to the bucket
+        bucket = idx
+        for level in range(self.num_bitmap_levels, self.start_level - 1, -1):
+            counters = views["counters"][level - 1]
+            counters[idx] -= 1
+            if counters[idx] == 0:
+                views["bitmaps"][level - 1][idx // width] &= ~(
+                    1 << (idx % width))
+
+            idx //= width
+
+        self.size -= 1
+        return (data, bucket)
+
+
+    def apply(self, op: HeapOp, data: int=0,
+              priority: int=0) -> Tuple[HeapOp, int, int]:
+        """Performs an operation. Returns the (op, data, priority) that the
+        BBQ outputs for it (enqueues are echoed back)."""
+        op = HeapOp(op)
+        if op == HeapOp.ENQUE:
+            self.enqueue(data, priority)
+            return (op, data, priority)
+
+        return (op,) + self.dequeue(op, priority)
+
+
+    def drain(self, lp: int, count: int, descending: bool=False
+              ) -> Optional[np.ndarray]:
+        """Returns the buckets that a run of count deque-mins (or, if
+        descending, deque-maxes) from the given partition pops from, in
+        order, or None if the partition holds fewer entries. Starting
+        from the first non-empty bucket, bucket counts are scanned in a
+        window that doubles until it holds enough entries."""
+        if self.views["roots"][lp] == 0: return None
+        (lo, hi) = (lp * self.lp_size, (lp + 1) * self.lp_size)
+        first = self.search(HeapOp.DEQUE_MAX if descending
+                            else HeapOp.DEQUE_MIN, lo)
+
+        window = count
+        while True:
+            if descending:
+                start = max(lo, first + 1 - window)
+                takes = self.memory.counts[start:(first + 1)][::-1]
+            else: takes = self.memory.counts[first:min(hi, first + window)]
+
+            total = np.cumsum(takes, dtype=np.int64)
+            if total[-1] >= count: break
+            if len(takes) == (first + 1 - lo if descending
+                              else hi - first): return None
+            window *= 2
+
+        # Pop whole buckets, and then the remainder of the last one
+        num_buckets = int(np.searchsorted(total, count)) + 1
+        takes = takes[:num_buckets].astype(np.int64)
+        takes[-1] -= total[num_buckets - 1] - count
+        buckets = (first - np.arange(num_buckets) if descending
+                   else first + np.arange(num_buckets))
+        return np.repeat(buckets, takes)
+
+
+    def dequeue_batch(self, op_type: np.ndarray, priority: np.ndarray
+                      ) -> Optional[Tuple[np.ndarray, np.ndarray]]:
+        """Dequeues a run of entries with vectorized updates (equivalent
+        to dequeueing them one at a time, in order). Returns the (data,
+        priority) of the dequeued entries, or None if the run cannot be
+        batched, in which case the model is left untouched. Deque-mins
+        and deque-maxes drain their partition from opposite ends, so
+        a run is only batched if, in every partition, they never pop
+        from the same bucket (and in calendar mode, where the base moves
+        with every deque-min, runs are never batched)."""
+        if self.calendar: return None
+        is_min = (op_type == HeapOp.DEQUE_MIN)
+        if not np.all(is_min | (op_type == HeapOp.DEQUE_MAX)): return None
+        if not (0 <= priority.min() and
+                priority.max() < self.num_priorities): return None
+
+        # Each partition's deque-mins (deque-maxes) pop from its
+        # non-empty buckets in ascending (descending) order
+        buckets = np.empty(len(priority), dtype=np.int64)
+        partitions = priority // self.lp_size
+        for lp in np.unique(partitions).tolist():
+            mine = (partitions == lp)
+            last = []
+            for (ops, descending) in ((mine & is_min, False),
+                                      (mine & ~is_min, True)):
+                count = int(np.count_nonzero(ops))
+                if not count: continue
+                popped = self.drain(lp, count, descending)
+                if popped is None: return None
+                buckets[ops] = popped
+                last.append(popped[-1])
+
+            if (len(last) == 2) and (last[0] >= last[1]): return None
+
+        data = self.memory.pop_batch(buckets)
+
+        # Update the StOCs (and bitmaps) along the paths to the buckets
+        width = self.bitmap_width
+        (idx, counts) = np.unique(buckets, return_counts=True)
+        for level in range(self.num_bitmap_levels, self.start_level - 1, -1):
+            counters = self.counters[level - 1]
+            counters[idx] -= counts
+            now_clear = idx[counters[idx] == 0]
+            np.bitwise_and.at(self.bitmaps[level - 1], now_clear // width,
+                              ~np.left_shift(np.uint64(1), (now_clear % width)
+                                             .astype(np.uint64)))
+
+            # Merge the paths that share the parent StOC
+            (idx, starts) = np.unique(idx // width, return_index=True)
+            counts = np.add.reduceat(counts, starts)
+
+        self.size -= len(buckets)
+        return (data, buckets)
+
+
+    def enqueue_batch(self, data: np.ndarray, priority: np.ndarray) -> None:
+        """Enqueues a run of entries with vectorized updates (equivalent
+        to enqueueing them one at a time, in order)."""
+        count = len(priority)
+        if self.size + count > self.max_num_entries:
+            raise ValueError("Enqueue into a full queue.")
+        if count and not (0 <= priority.min() and
+                          priority.max() < self.num_priorities):
+            raise ValueError("Invalid priority in batch.")
+
+        self.memory.push_batch(priority, data)
+
+        # Update the StOCs (and bitmaps) along the paths to the buckets
+        width = self.bitmap_width
+        (idx, counts) = np.unique(priority.astype(np.int64),
+                                  return_counts=True)
+        for level in range(self.num_bitmap_levels, self.start_level - 1, -1):
+            counters = self.counters[level - 1]
+            now_set = idx[counters[idx] == 0]
+            counters[idx] += counts
+            np.bitwise_or.at(self.bitmaps[level - 1], now_set // width,
+                             np.left_shift(np.uint64(1), (now_set % width)
+                                           .astype(np.uint64)))
+
+            # Merge the paths that share the parent StOC
+            (idx, starts) = np.unique(idx // width, return_index=True)
+            counts = np.add.reduceat(counts, starts)
+
+        self.size += count
+
+
+    def run(self, trace: np.ndarray) -> np.ndarray:
+        """Applies a trace of ops (TRACE_DTYPE records). Returns what the
+        BBQ outputs for each op, as TRACE_DTYPE records. Long runs of
+        enqueues, and of dequeues (outside calendar mode), are batched;
+        state persists across calls, so traces can be streamed in chunks.
+        Only long runs run at millions of ops/s: ops in short runs are
+        applied one at a time (at a few hundred thousand ops/s, see
+        benchmark.py --reference)."""
+        output = trace.astype(TRACE_DTYPE, copy=True)
+        is_enque = (trace["op_type"] == HeapOp.ENQUE)
+        bounds = np.flatnonzero(is_enque[1:] != is_enque[:-1]) + 1
+        bounds = [0] + bounds.tolist() + [len(trace)]
+
+        # Long dequeue runs are batched in chunks, so that only a chunk
+        # whose deque-mins and deque-maxes meet falls back to single ops
+        runs = []
+        for (start, end) in zip(bounds[:-1], bounds[1:]):
+            step = (end - start) if is_enque[start] else self.max_dequeue_batch
+            runs.extend((x, min(x + step, end))
+                        for x in range(start, end, max(step, 1)))
+
+        for (start, end) in runs:
+            try:
+                ops = trace[start:end]
+                batch = None
+                if (not is_enque[start]) and (
+                        (end - start) >= self.min_dequeue_batch_size):
+                    batch = self.dequeue_batch(ops["op_type"],
+                                               ops["priority"])
+
+                if batch is not None:
+                    output["data"][start:end] = batch[0]
+                    output["priority"][start:end] = batch[1]
+
+                elif not is_enque[start]:
+                    results = [self.dequeue(op, priority) for (op, priority)
+                               in zip(ops["op_type"].tolist(),
+                                      ops["priority"].tolist())]
+                    output["data"][start:end] = [x[0] for x in results]
+                    output["priority"][start:end] = [x[1] for x in results]
+
+                elif (end - start) >= self.min_batch_size:
+                    self.enqueue_batch(ops["data"], ops["priority"])
+
+                else:
+                    for (data, priority) in zip(ops["data"].tolist(),
+                                                ops["priority"].tolist()):
+                        self.enqueue(data, priority)
+
+            except ValueError as e:
+                raise ValueError("Ops [{}, {}): {}".format(start, end, e))
+
+        return output
+
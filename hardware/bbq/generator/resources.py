@@ -0,0 +1,210 @@
+#!/usr/bin/python3
+from __future__ import annotations
+
+import argparse
+import json
+import re
+import sys
+from typing import Dict, List, Optional
+
+from bbq import BBQ
+from ir import Assign, Decl, Instance, base_name, walk
+from passes import DeadSignalElimination
+from simulator import Compiler
+from util import atomic_open
+
+# Simple dual-port (depth, width) configurations of a Stratix 10 M20K
+M20K_MODES = [(512, 40), (1024, 20), (2048, 10)]
+
+# Memory primitives instantiated by the generated design
+MEMORY_MODULES = ("bram_simple2port", "sc_fifo")
+
+# Registers that hold bitmaps and counters (rather than pipeline state)
+STORAGE_RE = re.compile(r"^l\d+_(bitmaps?|counters)$")
+
+
+def m20k_blocks(width: int, depth: int) -> int:
+    """Returns the number of M20K blocks in the smallest (single-mode)
+    tiling of a width x depth memory."""
+    return min(-(-depth // d) * -(-width // w) for (d, w) in M20K_MODES)
+
+
+def top_params(bitmap_width: int, element_bits: int) -> Dict[str, int]:
+    """Returns the parameters quartus/top.sv instantiates the BBQ with,
+    for the given BITMAP_WIDTH and ELEMENT_BITS macros."""
+    return {
+        "HEAP_BITMAP_WIDTH": bitmap_width,
+        "HEAP_ENTRY_DWIDTH": element_bits,
+        "HEAP_MAX_NUM_ENTRIES": (1 << element_bits) - 1,
+    }
+
+
+class ResourceEstimator:
+    """Analytically estimates the resources a generated BBQ takes, from
+    its IR: register bits (signals assigned non-blockingly, split into
+    bitmap/counter storage and pipeline state), BRAM bits and M20K
+    blocks (of every memory instance, including the free list), and
+    the number of FFS instances. Everything is broken down by level;
+    state shared across levels is attributed to "common". Resources
+    internal to the memory and FFS modules are not counted."""
+    def __init__(self, bbq: BBQ) -> None:
+        if not bbq.codegen.nodes: bbq.generate()
+
+        self.bbq = bbq
+        nodes = list(walk(bbq.codegen.nodes))
+        names = [level.name() for level in bbq.levels]
+
+        def owner(name: str, node_owner: Optional[str]) -> str:
+            if node_owner: return node_owner
+            return next((x for x in name.split("_") if x in names), "common")
+
+        # Registers and memories, and the level each belongs to
+        owners = {node.name: node.owner for node in nodes
+                  if isinstance(node, Decl)}
+
+        self.registers: Dict[str, str] = {
+            x: owner(x, owners.get(x)) for x in sorted(
+                {base_name(node.lhs) for node in nodes if
+                 isinstance(node, Assign) and (node.op == "<=")})}
+
+        self.instances: List[Instance] = [
+            node for node in nodes if isinstance(node, Instance)]
+
+        self.instance_owners: Dict[str, str] = {
+            node.name: owner(node.name, node.owner)
+            for node in self.instances}
+
+
+    def estimate(self, params: Dict[str, int]) -> dict:
+        """Returns the resource estimate for the given parameters."""
+        compiler = Compiler()
+        overrides = dict(params)
+        compiler.elaborate(self.bbq.codegen.nodes, overrides)
+        if overrides:
+            raise ValueError("Unknown parameter(s): {}".format(
+                ", ".join(sorted(overrides))))
+
+        levels = {x: {
+            "storage_register_bits": 0, "pipeline_register_bits": 0,
+            "bram_bits": 0, "m20ks": 0, "num_ffs": 0,
+        } for x in ["common"] + [y.name() for y in self.bbq.levels]}
+
+        for (name, level) in self.registers.items():
+            t = compiler.signals[name]
+            kind = "storage" if STORAGE_RE.match(name) else "pipeline"
+            levels[level]["{}_register_bits".format(kind)] += (
+                t.width * (t.depth or 1))
+
+        memories = []
+        for node in self.instances:
+            level = self.instance_owners[node.name]
+            if node.module == "ffs":
+                levels[level]["num_ffs"] += 1
+
+            elif node.module in MEMORY_MODULES:
+                values = {x: compiler.constant(v) for (x, v) in node.params}
+                (width, depth) = (values["DWIDTH"], values["DEPTH"])
+                memory = {
+                    "name": node.name, "module": node.module,
+                    "level": level, "width": width, "depth": depth,
+                    "bits": width * depth, "m20ks": m20k_blocks(width, depth),
+                }
+                levels[level]["bram_bits"] += memory["bits"]
+                levels[level]["m20ks"] += memory["m20ks"]
+                memories.append(memory)
+
+        for x in levels.values():
+            x["register_bits"] = (x["storage_register_bits"] +
+                                  x["pipeline_register_bits"])
+
+        totals = {x: sum(y[x] for y in levels.values())
+                  for x in levels["common"]}
+
+        return {
+            "bbq": self.bbq.config,
+            "parameters": dict(params),
+            "levels": levels,
+            "memories": memories,
+            "totals": totals,
+        }
+
+
+def format_report(report: dict) -> str:
+    """Formats a resource estimate as a table."""
+    lines = ["{:<12} {:>12} {:>12} {:>12} {:>8} {:>6}".format(
+        "Level", "Reg (store)", "Reg (pipe)", "BRAM bits", "M20Ks", "FFSs")]
+
+    for (name, x) in list(report["levels"].items()) + [
+            ("total", report["totals"])]:
+        lines.append("{:<12} {:>12} {:>12} {:>12} {:>8} {:>6}".format(
+            name, x["storage_register_bits"], x["pipeline_register_bits"],
+            x["bram_bits"], x["m20ks"], x["num_ffs"]))
+
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        prog="resources", description=("Estimates the registers, BRAM and "
+                                       "FFSs of BBQ configurations."))
+
+    parser.add_argument("num_bitmap_levels", type=int, nargs="+")
+    parser.add_argument("--num_lps", type=int, nargs="+", default=[1])
+    parser.add_argument("--bitmap_width", type=int, nargs="+", default=[32])
+    parser.add_argument("--element_bits", type=int, nargs="+", default=[17],
+                        help=("ELEMENT_BITS (entry data width, and log2 of "
+                              "the number of entries), as in quartus/top.sv"))
+    parser.add_argument("--eliminate_dead_signals", action="store_true",
+                        help="Remove signals that are never read")
+    parser.add_argument("--max_registers", type=int, default=None,
+                        help="Register bits available on the device")
+    parser.add_argument("--max_m20ks", type=int, default=None,
+                        help="M20K blocks available on the device")
+    parser.add_argument("--check", action="store_true",
+                        help=("Exit with status 1 unless every configuration "
+                              "fits the budgets"))
+    parser.add_argument("--quiet", action="store_true",
+                        help="Do not print tables to stderr")
+    parser.add_argument("--output", type=str, default=None,
+                        help="Output path for the estimates (JSON)")
+    args = parser.parse_args()
+
+    reports = []
+    for num_bitmap_levels in args.num_bitmap_levels:
+        for num_lps in args.num_lps:
+            for bitmap_width in args.bitmap_width:
+                bbq = BBQ(num_bitmap_levels, num_lps,
+                          bitmap_width if num_lps > 1 else 0)
+                if args.eliminate_dead_signals:
+                    bbq.passes.append(DeadSignalElimination())
+
+                estimator = ResourceEstimator(bbq)
+                for element_bits in args.element_bits:
+                    # Partitioned BBQs have the bitmap width baked in
+                    params = top_params(bitmap_width, element_bits)
+                    report = estimator.estimate({
+                        x: v for (x, v) in params.items()
+                        if x in bbq.parameters})
+
+                    totals = report["totals"]
+                    report["fits"] = (
+                        ((args.max_registers is None) or
+                         (totals["register_bits"] <= args.max_registers)) and
+                        ((args.max_m20ks is None) or
+                         (totals["m20ks"] <= args.max_m20ks)))
+
+                    reports.append(report)
+                    if not args.quiet:
+                        print("[resources] l{}_b{}_n{}{}{}".format(
+                            num_bitmap_levels, bitmap_width, element_bits,
+                            "_p{}".format(num_lps) if num_lps > 1 else "",
+                            "" if report["fits"] else " (does not fit)"),
+                            file=sys.stderr)
+                        print(format_report(report) + "\n", file=sys.stderr)
+
+    if args.output is not None:
+        with atomic_open(args.output) as f:
+            json.dump(reports, f, indent=4)
+            f.write("\n")
+
+    if args.check and not all(x["fits"] for x in reports): sys.exit(1)
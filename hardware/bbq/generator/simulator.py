@@ -0,0 +1,995 @@
+#!/usr/bin/python3
+from __future__ import annotations
+
+import heapq
+import re
+import typing
+from enum import IntEnum
+from typing import Callable, Dict, List, NamedTuple, Optional, Tuple
+
+from ir import (Assign, Block, CaseItem, Comment, Conditional, Decl, Enum,
+                For, Ifdef, Instance, Node, Switch, Text)
+from util import clog2
+
+# Hack for type hinting with circular imports
+if typing.TYPE_CHECKING: from bbq import BBQ
+
+# SystemVerilog tokens (comments and whitespace are skipped)
+TOKEN_RE = re.compile(r"""\s*(?:
+    (?P<comment>//[^\n]*|/\*.*?\*/) |
+    (?P<string>"(?:[^"\\]|\\.)*") |
+    (?P<number>\d+'[bdhBDH][0-9a-fA-F_]+|\d+) |
+    (?P<name>\$?[A-Za-z_]\w*) |
+    (?P<op>===|!==|==|!=|<=|>=|&&|\|\||<<|>>|\*\*|[-+*/%<>!~&|^?:()\[\]{},.;=@\#])
+    )""", re.S | re.X)
+
+# Binary operator precedence (higher binds tighter)
+BINARY_OPS = {
+    "||": 1, "&&": 2, "|": 3, "^": 4, "&": 5,
+    "==": 6, "!=": 6, "===": 6, "!==": 6,
+    "<": 7, "<=": 7, ">": 7, ">=": 7,
+    "<<": 8, ">>": 8, "+": 9, "-": 9,
+    "*": 10, "/": 10, "%": 10, "**": 11,
+}
+
+# Module-level declarations in free-form text
+PARAM_RE = re.compile(r"^(parameter|localparam)\s+(\w+)\s*=\s*(.+?)\s*[,;]?$")
+PORT_RE = re.compile(r"^(input|output)\s+(.+?)\s+(\w+)\s*,?$")
+TYPEDEF_RE = re.compile(r"^typedef\s+(logic(?:\s*\[.*\])?)\s+(\w+);$")
+STRUCT_RE = re.compile(r"^typedef\s+struct\s+packed\s*\{(.*)\}\s*(\w+);$")
+
+
+class HeapOp(IntEnum):
+    """Heap operation types (mirrors heap_ops.sv)."""
+    ENQUE = 0
+    DEQUE_MIN = 1
+    DEQUE_MAX = 2
+
+
+class SimulationError(Exception):
+    """Raised for code the simulator cannot model."""
+
+
+class Type(NamedTuple):
+    """Packed width, unpacked depth (for arrays) and struct fields."""
+    width: int
+    depth: int = None
+    fields: Dict[str, Tuple[int, int]] = None
+
+
+class Expr(NamedTuple):
+    """Compiled (Python) expression and its width (None if unsized)."""
+    code: str
+    width: Optional[int]
+    type: Type = None
+
+
+class LValue(NamedTuple):
+    """Compiled assignment target."""
+    name: str                               # Signal name
+    index: Optional[str]                    # Array index (if any)
+    lo: Optional[str]                       # Select LSb (if any)
+    width: int                              # Assigned width
+
+
+class Process(NamedTuple):
+    """A compiled process and the signals it reads and writes."""
+    name: str
+    function: Callable
+    reads: frozenset
+    writes: frozenset
+
+
+def mask(width: int) -> int:
+    """All-ones mask of the given width."""
+    return (1 << width) - 1
+
+
+def tokenize(code: str) -> List[str]:
+    """Splits SystemVerilog code into tokens."""
+    tokens, pos, code = [], 0, code.rstrip()
+    while pos < len(code):
+        match = TOKEN_RE.match(code, pos)
+        if match is None:
+            raise SimulationError("Unexpected input: {}".format(
+                code[pos:pos + 40]))
+
+        pos = match.end()
+        if match.lastgroup != "comment":
+            tokens.append(match.group(match.lastgroup))
+
+    return tokens
+
+
+def apply(v: dict, name: str, index: Optional[int],
+          lo: Optional[int], width_mask: int, value: int) -> bool:
+    """Performs a (non-blocking) assignment. Returns True on change."""
+    container, key = v, name
+    if index is not None: container, key = v[name], index
+
+    old = container[key]
+    if lo is None: new = value & width_mask
+    else: new = (old & ~(width_mask << lo)) | ((value & width_mask) << lo)
+
+    container[key] = new
+    return new != old
+
+
+class Compiler:
+    """Compiles a subset of SystemVerilog (expressions, statements and
+    procedural blocks, as emitted by the generator) into Python."""
+    def __init__(self) -> None:
+        self.params: Dict[str, int] = {}    # Parameter values
+        self.consts: Dict[str, Tuple[int, int]] = {
+            "HEAP_OP_" + op.name: (op.value, 2) for op in HeapOp}
+        self.types: Dict[str, Type] = {     # Type names
+            "logic": Type(1), "integer": Type(32), "heap_op_t": Type(2)}
+        self.signals: Dict[str, Type] = {}  # Declared signals
+        self.loop_vars: List[str] = []      # Loop variables in scope
+        self.reads = set()                  # Signals read by the process
+        self.writes = set()                 # Signals written (blocking)
+        self.num_temps = 0                  # Temporary variable count
+
+        # Token stream
+        self.tokens: List[str] = []
+        self.pos = 0
+
+
+    def load(self, code: str) -> None:
+        """Sets the token stream to parse."""
+        self.tokens = tokenize(code)
+        self.pos = 0
+
+
+    def done(self) -> bool:
+        return self.pos >= len(self.tokens)
+
+
+    def peek(self) -> Optional[str]:
+        return None if self.done() else self.tokens[self.pos]
+
+
+    def next(self) -> str:
+        if self.done(): raise SimulationError("Unexpected end of input")
+        self.pos += 1
+        return self.tokens[self.pos - 1]
+
+
+    def expect(self, token: str) -> None:
+        actual = self.next()
+        if actual != token:
+            raise SimulationError("Expected '{}', found '{}' in: {}".format(
+                token, actual, " ".join(self.tokens)))
+
+
+    def expression(self, code: str) -> Expr:
+        """Compiles a complete expression."""
+        self.load(code)
+        expr = self.ternary()
+        if not self.done():
+            raise SimulationError("Trailing input in: {}".format(code))
+
+        return expr
+
+
+    @staticmethod
+    def evaluate(expr: Expr) -> int:
+        """Evaluates a constant expression."""
+        try:
+            return eval(expr.code, {"_clog2": clog2})
+
+        except NameError:
+            raise SimulationError("Not a constant: {}".format(expr.code))
+
+
+    def constant(self, code: str) -> int:
+        """Evaluates a constant expression (e.g., a parameter)."""
+        return self.evaluate(self.expression(code))
+
+
+    def dims(self) -> Tuple[int, int]:
+        """Parses a [hi:lo] range (at the current token)."""
+        self.expect("[")
+        hi = self.evaluate(self.ternary())
+        self.expect(":")
+        lo = self.evaluate(self.ternary())
+        self.expect("]")
+        return (hi, lo)
+
+
+    def elaborate(self, nodes: List[Node], overrides: Dict[str, int]
+                  ) -> Tuple[Dict[str, Optional[int]], Dict[str, str]]:
+        """Elaborates the module-level declarations (enums, typedefs,
+        parameters, ports and signals) among the given nodes, consuming
+        the parameter overrides it applies. Returns the initial values
+        of the declared signals, and the direction of each port."""
+        (values, ports) = ({}, {})
+        for node in nodes:
+            if isinstance(node, Enum):
+                self.types[node.name] = self.resolve_type(node.logictype)
+
+                value = 0
+                for x in node.values:
+                    (name, _, init) = x.partition("=")
+                    if init: value = self.constant(init)
+                    self.consts[name.strip()] = (
+                        value, self.types[node.name].width)
+                    value += 1
+
+            elif isinstance(node, Decl):
+                values[node.name] = self.declare(node.name, node.type,
+                                                 node.suffix)
+
+            elif isinstance(node, Text):
+                for line in "".join(node.render(0)).split("\n"):
+                    port = self.module_item(line.split("//")[0].strip(),
+                                            overrides)
+                    if port: ports[port[1]] = port[0]
+
+        return (values, ports)
+
+
+    def module_item(self, line: str, overrides: Dict[str, int]
+                    ) -> Optional[Tuple[str, str]]:
+        """Handles a module-level line (parameter, port or typedef).
+        Returns the (direction, name) of ports."""
+        match = PARAM_RE.match(line)
+        if match:
+            (kind, name, value) = match.groups()
+            if kind == "parameter" and name in overrides:
+                self.params[name] = overrides.pop(name)
+            else: self.params[name] = self.constant(value)
+            return None
+
+        match = PORT_RE.match(line)
+        if match:
+            (direction, type, name) = match.groups()
+            self.declare(name, type)
+            return (direction, name)
+
+        match = TYPEDEF_RE.match(line)
+        if match:
+            self.types[match.group(2)] = self.resolve_type(match.group(1))
+            return None
+
+        match = STRUCT_RE.match(line)
+        if match:
+            fields = [x.split() for x in match.group(1).split(";") if x.strip()]
+            offsets, lo = {}, 0
+            for (type, name) in reversed(fields):
+                width = self.resolve_type(type).width
+                offsets[name] = (lo, width)
+                lo += width
+
+            self.types[match.group(2)] = Type(lo, None, offsets)
+
+        return None
+
+
+    def resolve_type(self, name: str) -> Type:
+        """Returns the type corresponding to a type declaration."""
+        self.load(name)
+        base = self.types.get(self.next())
+        if base is None: raise SimulationError("Unknown type: " + name)
+        if self.peek() == "[":
+            (hi, lo) = self.dims()
+            base = Type(hi - lo + 1)
+
+        if not self.done(): raise SimulationError("Unknown type: " + name)
+        return base
+
+
+    def declare(self, name: str, type: str, suffix: str="") -> Optional[int]:
+        """Declares a signal. Returns its initial value (if any)."""
+        signal_type = self.resolve_type(type)
+        self.load(suffix.split(";")[0])
+
+        if self.peek() == "[":
+            (hi, lo) = self.dims()
+            if lo != 0: raise SimulationError("Unsupported array: " + name)
+            signal_type = signal_type._replace(depth=(hi + 1))
+
+        self.signals[name] = signal_type
+        if self.peek() == "=":
+            self.next()
+            return self.evaluate(self.ternary())
+
+        return None
+
+
+    def ternary(self) -> Expr:
+        cond = self.binary(1)
+        if self.peek() != "?": return cond
+
+        self.next()
+        a = self.ternary()
+        self.expect(":")
+        b = self.ternary()
+        return Expr("({} if {} else {})".format(a.code, cond.code, b.code),
+                    self.max_width(a, b))
+
+
+    @staticmethod
+    def max_width(a: Expr, b: Expr) -> Optional[int]:
+        """Self-determined width of a binary expression."""
+        if a.width is None and b.width is None: return None
+        return max(32 if a.width is None else a.width,
+                   32 if b.width is None else b.width)
+
+
+    def binary(self, min_prec: int) -> Expr:
+        lhs = self.unary()
+        while True:
+            op = self.peek()
+            prec = BINARY_OPS.get(op)
+            if prec is None or prec < min_prec: return lhs
+
+            self.next()
+            rhs = self.binary(prec + 1)
+            width = self.max_width(lhs, rhs)
+            if op in ("&&", "||"):
+                lhs = Expr("(1 if ({}) {} ({}) else 0)".format(
+                    lhs.code, "and" if op == "&&" else "or", rhs.code), 1)
+
+            elif BINARY_OPS[op] in (6, 7):
+                lhs = Expr("int({} {} {})".format(lhs.code, {
+                    "===": "==", "!==": "!="}.get(op, op), rhs.code), 1)
+
+            elif op in ("<<", ">>"):
+                lhs = Expr("({} {} {})".format(lhs.code, op, rhs.code),
+                           lhs.width)
+
+            elif op == "-" and width is not None:
+                lhs = Expr("(({} - {}) & {})".format(
+                    lhs.code, rhs.code, mask(width)), width)
+
+            else:
+                lhs = Expr("({} {} {})".format(
+                    lhs.code, "//" if op == "/" else op, rhs.code), width)
+
+
+    def unary(self) -> Expr:
+        op = self.peek()
+        if op not in ("!", "~", "-", "+", "&", "|", "^"):
+            return self.postfix(self.primary())
+
+        self.next()
+        e = self.unary()
+        width = 32 if e.width is None else e.width
+        if op == "!": return Expr("(0 if {} else 1)".format(e.code), 1)
+        if op == "~":
+            return Expr("(~{} & {})".format(e.code, mask(width)), width)
+        if op == "-":
+            if e.width is None: return Expr("(-{})".format(e.code), None)
+            return Expr("(-{} & {})".format(e.code, mask(width)), width)
+        if op == "+": return e
+        if op == "&":
+            return Expr("int({} == {})".format(e.code, mask(width)), 1)
+        if op == "|": return Expr("int({} != 0)".format(e.code), 1)
+        return Expr("(bin({}).count('1') & 1)".format(e.code), 1)
+
+
+    def primary(self) -> Expr:
+        token = self.next()
+        if token == "(":
+            e = self.ternary()
+            self.expect(")")
+            return Expr("({})".format(e.code), e.width, e.type)
+
+        if token == "{": return self.concatenation()
+        if token[0].isdigit():
+            if "'" not in token: return Expr(token, None)
+            (width, value) = token.split("'")
+            base = {"b": 2, "d": 10, "h": 16}[value[0].lower()]
+            return Expr(str(int(value[1:].replace("_", ""), base)), int(width))
+
+        if token == "$clog2":
+            self.expect("(")
+            e = self.ternary()
+            self.expect(")")
+            return Expr("_clog2({})".format(e.code), None)
+
+        if token in self.loop_vars: return Expr("_" + token, 32)
+        if token in self.params: return Expr(str(self.params[token]), None)
+        if token in self.consts:
+            (value, width) = self.consts[token]
+            return Expr(str(value), width)
+
+        if token in self.signals:
+            self.reads.add(token)
+            t = self.signals[token]
+            return Expr("v[{!r}]".format(token), t.width, t)
+
+        raise SimulationError("Unknown identifier: {}".format(token))
+
+
+    def concatenation(self) -> Expr:
+        """Compiles a concatenation (or replication), sans the '{'."""
+        parts = [self.ternary()]
+        if self.peek() == "{":
+            self.next()
+            inner = self.concatenation()
+            self.expect("}")
+            parts = [inner] * self.evaluate(parts[0])
+
+        while self.peek() == ",":
+            self.next()
+            parts.append(self.ternary())
+
+        self.expect("}")
+        if any(p.width is None for p in parts):
+            raise SimulationError("Unsized operand in concatenation")
+
+        terms, shift = [], 0
+        for p in reversed(parts):
+            terms.append("(({} & {}) << {})".format(
+                p.code, mask(p.width), shift))
+            shift += p.width
+
+        return Expr("({})".format(" | ".join(terms)), shift)
+
+
+    def postfix(self, e: Expr) -> Expr:
+        """Compiles element, bit, part and field selects."""
+        while e.type is not None:
+            if self.peek() == "[":
+                self.next()
+                index = self.ternary()
+                if self.peek() == ":":
+                    self.next()
+                    lo = self.evaluate(self.ternary())
+                    self.expect("]")
+                    width = self.evaluate(index) - lo + 1
+                    e = Expr("(({} >> {}) & {})".format(
+                        e.code, lo, mask(width)), width, Type(width))
+                    continue
+
+                self.expect("]")
+                if e.type.depth is not None:
+                    element = e.type._replace(depth=None)
+                    e = Expr("{}[{}]".format(e.code, index.code),
+                             element.width, element)
+                else:
+                    e = Expr("(({} >> {}) & 1)".format(
+                        e.code, index.code), 1, Type(1))
+
+            elif self.peek() == "." and e.type.fields:
+                self.next()
+                (lo, width) = e.type.fields[self.next()]
+                e = Expr("(({} >> {}) & {})".format(
+                    e.code, lo, mask(width)), width, Type(width))
+
+            else: break
+
+        return e
+
+
+    def lvalue(self) -> LValue:
+        """Compiles an assignment target (at the current token)."""
+        name = self.next()
+        t = self.signals.get(name)
+        if t is None: raise SimulationError("Unknown lvalue: {}".format(name))
+
+        index = lo = None
+        width = t.width
+        if self.peek() == "[" and t.depth is not None:
+            self.next()
+            index = self.ternary().code
+            self.expect("]")
+
+        if self.peek() == "[":
+            self.next()
+            hi = self.ternary()
+            if self.peek() == ":":
+                self.next()
+                low = self.evaluate(self.ternary())
+                width = self.evaluate(hi) - low + 1
+                lo = str(low)
+            else:
+                width, lo = 1, hi.code
+
+            self.expect("]")
+
+        elif self.peek() == ".":
+            self.next()
+            (field_lo, width) = t.fields[self.next()]
+            lo = str(field_lo)
+
+        return LValue(name, index, lo, width)
+
+
+    def store(self, lv: LValue, value: str) -> str:
+        """Returns the code for a blocking assignment."""
+        self.writes.add(lv.name)
+        target = "v[{!r}]".format(lv.name)
+        if lv.index is not None: target += "[{}]".format(lv.index)
+
+        if lv.lo is None:
+            return "{} = ({}) & {}".format(target, value, mask(lv.width))
+
+        return "{0} = ({0} & ~({1} << {2})) | ((({3}) & {1}) << {2})".format(
+            target, mask(lv.width), lv.lo, value)
+
+
+    @staticmethod
+    def schedule(lv: LValue, value: str) -> str:
+        """Returns the code for a non-blocking assignment."""
+        return "nba.append(({!r}, {}, {}, {}, {}))".format(
+            lv.name, lv.index, lv.lo, mask(lv.width), value)
+
+
+    def statement(self, indent: int) -> List[str]:
+        """Compiles a single (leaf) statement at the current token."""
+        token = self.peek()
+        if token == ";":
+            self.next()
+            return []
+
+        # System tasks (e.g., $display) do not affect state
+        if token.startswith("$"):
+            while self.next() != ";": pass
+            return []
+
+        lv = self.lvalue()
+        op = self.next()
+        if op not in ("=", "<="):
+            raise SimulationError("Unsupported statement: {}".format(
+                " ".join(self.tokens)))
+
+        value = self.ternary().code
+        self.expect(";")
+
+        line = self.store(lv, value) if op == "=" else self.schedule(lv, value)
+        return ["    " * indent + line]
+
+
+    def leaves(self, nodes: List[Node], indent: int) -> List[str]:
+        """Compiles a run of leaf statements."""
+        if not nodes: return []
+        self.load("\n".join("".join(n.render(0)) for n in nodes))
+
+        lines = []
+        while not self.done():
+            lines.extend(self.statement(indent))
+
+        return lines
+
+
+    def body(self, nodes: List[Node], indent: int) -> List[str]:
+        """Compiles the body of a procedural block."""
+        lines, leaves = [], []
+        for node in nodes:
+            if not isinstance(node, Block):
+                if not isinstance(node, Comment): leaves.append(node)
+                continue
+
+            lines.extend(self.leaves(leaves, indent))
+            leaves = []
+
+            # Debug-only code does not affect state
+            if not isinstance(node, Ifdef):
+                lines.extend(self.block(node, indent))
+
+        lines.extend(self.leaves(leaves, indent))
+        return lines
+
+
+    def block(self, node: Block, indent: int) -> List[str]:
+        """Compiles a nested procedural block."""
+        prefix = "    " * indent
+        if isinstance(node, Conditional):
+            if node.condition is None: header = "else:"
+            else:
+                header = "{} {}:".format(
+                    "if" if node.header == "if" else "elif",
+                    self.expression(" ".join(node.text())).code)
+
+            return ([prefix + header] +
+                    (self.body(node.body, indent + 1) or
+                     [prefix + "    pass"]))
+
+        if isinstance(node, For):
+            self.loop_vars.append(node.var)
+            var = "_" + node.var
+            lines = ["{}{} = 0".format(prefix, var),
+                     "{}while {}:".format(
+                         prefix, self.expression(node.condition).code)]
+
+            lines.extend(self.body(node.body, indent + 1))
+            lines.append("{}    {} += 1".format(prefix, var))
+            self.loop_vars.pop()
+            return lines
+
+        if isinstance(node, Switch): return self.switch(node, indent)
+        raise SimulationError("Unsupported block: {}".format(node.header))
+
+
+    def switch(self, node: Switch, indent: int) -> List[str]:
+        """Compiles a case statement into an if/elif chain."""
+        prefix = "    " * indent
+        var = "_case{}".format(self.num_temps)
+        self.num_temps += 1
+
+        # Case items as (labels, body); default has no labels
+        items: List[Tuple[Optional[List[str]], List[str]]] = []
+        for child in node.body:
+            if isinstance(child, Comment): continue
+            if isinstance(child, CaseItem):
+                labels = None
+                if child.header != "default":
+                    labels = [self.expression(x).code
+                              for x in child.header.split(",")]
+
+                items.append((labels, self.body(child.body, indent + 1)))
+                continue
+
+            # Inline items (e.g., "default: ;")
+            self.load("".join(child.render(0)))
+            while not self.done():
+                labels = []
+                while True:
+                    if self.peek() == "default":
+                        self.next()
+                        labels = None
+                    else: labels.append(self.ternary().code)
+                    if self.next() == ":": break
+
+                items.append((labels, self.statement(indent + 1)))
+
+        lines = ["{}{} = {}".format(
+            prefix, var, self.expression(node.header).code)]
+
+        keyword = "if"
+        for (labels, body) in items:
+            if labels is None: continue
+            lines.append("{}{} {}:".format(prefix, keyword, " or ".join(
+                "{} == {}".format(var, x) for x in labels)))
+            lines.extend(body or [prefix + "    pass"])
+            keyword = "elif"
+
+        for (labels, body) in items:
+            if labels is not None or not body: continue
+            if keyword == "if": lines.extend(
+                x[4:] for x in body)    # Default-only case
+            else:
+                lines.append(prefix + "else:")
+                lines.extend(body)
+
+        return lines
+
+
+    def process(self, name: str, lines: List[str]) -> Process:
+        """Wraps the compiled code into a Python function. Resets the
+        per-process read/write sets."""
+        source = "def process(v, nba):\n{}\n".format(
+            "\n".join(lines) if lines else "    pass")
+
+        namespace = {"_clog2": clog2}
+        exec(compile(source, "<{}>".format(name), "exec"), namespace)
+
+        p = Process(name, namespace["process"],
+                    frozenset(self.reads), frozenset(self.writes))
+        self.reads, self.writes = set(), set()
+        return p
+
+
+class Simulator:
+    """Cycle-accurate simulator of a generated BBQ. The simulator is
+    compiled from the BBQ's IR (i.e., the code each BBQLevel emits),
+    so it reproduces the RTL's stage timing, free-list pipeline and
+    PB read/write conflict handling by construction. Memories (BRAM),
+    the free-list FIFO and FFS instances are modeled behaviorally."""
+    def __init__(self, bbq: BBQ, params: Dict[str, int]=None) -> None:
+        if not bbq.codegen.nodes: bbq.generate()
+
+        self.bbq = bbq                      # Simulated BBQ
+        self.cycle = 0                      # Elapsed clock cycles
+        self.compiler = Compiler()
+        self.values: Dict[str, object] = {} # Signal values
+        self.inputs: Dict[str, Type] = {}   # Input ports
+        self.outputs: Dict[str, Type] = {}  # Output ports
+
+        self.combinational: List[Process] = []
+        self.sequential: List[Process] = []
+        self.elaborate(params or {})
+        self.schedule()
+
+        # Settle the initial state
+        self.settle(set(self.values))
+
+
+    def elaborate(self, params: Dict[str, int]) -> None:
+        """Populates the symbol table and compiles all processes."""
+        compiler = self.compiler
+        overrides = dict(params)
+        (values, ports) = compiler.elaborate(self.bbq.codegen.nodes,
+                                             overrides)
+        self.values.update(values)
+        for (name, direction) in ports.items():
+            port_types = self.inputs if direction == "input" else self.outputs
+            port_types[name] = compiler.signals[name]
+
+        processes: List[Node] = []
+        checks: List[Conditional] = []
+        for node in self.bbq.codegen.nodes:
+            if isinstance(node, Conditional): checks.append(node)
+            elif isinstance(node, Block):
+                if not isinstance(node, Ifdef): processes.append(node)
+
+            elif isinstance(node, (Assign, Instance)): processes.append(node)
+
+        if overrides:
+            raise ValueError("Unknown parameter(s): {}".format(
+                ", ".join(sorted(overrides))))
+
+        # Elaboration-time checks
+        for check in checks:
+            if compiler.constant(" ".join(check.text())):
+                message = next((t for b in check.body for t in
+                                tokenize("".join(b.render(0)))
+                                if t.startswith('"')), '"Failed check"')
+                raise ValueError(message[1:-1])
+
+        # Initialize state
+        for (name, t) in compiler.signals.items():
+            value = self.values.get(name)
+            if value is None: value = 0
+            if t.depth is not None: value = [value] * t.depth
+            self.values[name] = value
+
+        for node in processes:
+            if isinstance(node, Instance): self.instantiate(node)
+            elif isinstance(node, Assign):
+                compiler.load("{} = {}".format(node.lhs, "\n".join(
+                    node.rhs) if isinstance(node.rhs, list) else node.rhs))
+                self.combinational.append(compiler.process(
+                    "assign " + node.lhs, compiler.statement(1)))
+
+            elif node.header == "always_comb":
+                self.combinational.append(compiler.process(
+                    node.header, compiler.body(node.body, 1)))
+
+            elif node.header in ("always @(posedge clk)",
+                                 "always_ff @(posedge clk)"):
+                self.sequential.append(compiler.process(
+                    node.header, compiler.body(node.body, 1)))
+
+            else:
+                raise SimulationError("Unsupported block: {}".format(
+                    node.header))
+
+
+    def instantiate(self, node: Instance) -> None:
+        """Compiles behavioral models of the instantiated IP."""
+        compiler = self.compiler
+        params = {k: compiler.constant(v) for (k, v) in node.params}
+        ports = {k: v for (k, v) in node.ports if v}
+
+        def read(port: str) -> str:
+            return compiler.expression(ports[port]).code
+
+        def write(port: str, value: str, blocking: bool) -> List[str]:
+            if port not in ports: return []
+            compiler.load(ports[port])
+            lv = compiler.lvalue()
+            return ["    " + (compiler.store(lv, value) if blocking
+                              else compiler.schedule(lv, value))]
+
+        def internal(name: str, width: int, depth: int=None) -> str:
+            name = "{}.{}".format(node.name, name)
+            compiler.signals[name] = Type(width, depth)
+            self.values[name] = [0] * depth if depth else 0
+            return name
+
+        if node.module == "ffs":
+            width = 1 << params["WIDTH_LOG"]
+            lines = ["    x = ({}) & {}".format(read("x"), mask(width)),
+                     "    msb = (x.bit_length() - 1) if x else 0",
+                     "    lsb = ((x & -x).bit_length() - 1) if x else {}".format(
+                         width - 1)]
+            lines += write("msb", "msb", True)
+            lines += write("lsb", "lsb", True)
+            lines += write("msb_onehot", "1 << msb", True)
+            lines += write("lsb_onehot", "x & -x", True)
+            lines += write("zero", "int(x == 0)", True)
+            self.combinational.append(compiler.process(node.name, lines))
+
+        # Simple dual-port RAM with registered inputs. Mixed-port
+        # read-during-write returns the old data (DONT_CARE in HW).
+        elif node.module == "bram_simple2port":
+            mem = internal("mem", params["DWIDTH"], params["DEPTH"])
+            lines = ["    if {}:".format(read("rden"))]
+            if params["IS_OUTDATA_REG"]:
+                q = internal("q", params["DWIDTH"])
+                lines += ["    " + compiler.schedule(LValue(q, None, None,
+                    params["DWIDTH"]), "v[{!r}][{}]".format(mem, read(
+                        "rdaddress")))]
+                lines += write("q", "v[{!r}]".format(q), False)
+            else:
+                lines += ["    " + x for x in write(
+                    "q", "v[{!r}][{}]".format(mem, read("rdaddress")), False)]
+
+            lines += ["    if {}:".format(read("wren")),
+                      "        " + compiler.schedule(
+                          LValue(mem, read("wraddress"), None,
+                                 params["DWIDTH"]), read("data"))]
+            self.sequential.append(compiler.process(node.name, lines))
+
+        # Single-clock FIFO (normal mode) with overflow and underflow
+        # checking; q is valid the cycle after a read request.
+        elif node.module == "sc_fifo":
+            (dwidth, depth) = (params["DWIDTH"], params["DEPTH"])
+            mem = internal("mem", dwidth, depth)
+            rdptr = internal("rdptr", 32)
+            wrptr = internal("wrptr", 32)
+            count = internal("count", 32)
+
+            def update(name: str, value: str) -> str:
+                return "    " + compiler.schedule(
+                    LValue(name, None, None, 32), value)
+
+            lines = ["    count = v[{!r}]".format(count),
+                     "    rd = ({}) and count != 0".format(read("rdreq")),
+                     "    wr = ({}) and count != {}".format(
+                         read("wrreq"), depth),
+                     "    if rd:"]
+            lines += ["    " + x for x in write("q", "v[{!r}][v[{!r}]]".format(
+                mem, rdptr), False)]
+            lines += ["    " + update(rdptr, "(v[{!r}] + 1) % {}".format(
+                rdptr, depth)),
+                      "    if wr:",
+                      "        " + compiler.schedule(LValue(
+                          mem, "v[{!r}]".format(wrptr), None, dwidth),
+                          read("data")),
+                      "    " + update(wrptr, "(v[{!r}] + 1) % {}".format(
+                          wrptr, depth)),
+                      "    count += (1 if wr else 0) - (1 if rd else 0)",
+                      update(count, "count")]
+
+            lines += write("empty", "int(count == 0)", False)
+            lines += write("full", "int(count == {})".format(depth), False)
+            lines += write("usedw", "count", False)
+            self.sequential.append(compiler.process(node.name, lines))
+
+            # Power-up state (empty)
+            compiler.process(node.name, write("empty", "1", True)).function(
+                self.values, None)
+
+        else:
+            raise SimulationError("No model for module: {}".format(
+                node.module))
+
+
+    def schedule(self) -> None:
+        """Orders combinational processes topologically (ignoring
+        feedback paths) and indexes them by the signals they read."""
+        writers: Dict[str, List[int]] = {}
+        for (idx, p) in enumerate(self.combinational):
+            for x in p.writes: writers.setdefault(x, []).append(idx)
+
+        order, visited = [], set()
+        def visit(idx: int) -> None:
+            visited.add(idx)
+            for x in self.combinational[idx].reads:
+                for w in writers.get(x, ()):
+                    if w not in visited: visit(w)
+
+            order.append(idx)
+
+        for idx in range(len(self.combinational)):
+            if idx not in visited: visit(idx)
+
+        self.combinational = [self.combinational[i] for i in order]
+        self.readers: Dict[str, List[int]] = {}
+        for (idx, p) in enumerate(self.combinational):
+            for x in p.reads: self.readers.setdefault(x, []).append(idx)
+
+        # Signals written with blocking assignments on clock edges
+        self.sequential_writes = set().union(
+            *(p.writes for p in self.sequential))
+
+
+    def settle(self, changed: set) -> None:
+        """Re-evaluates combinational logic until it reaches a fixpoint."""
+        v, readers = self.values, self.readers
+        queued = set()
+        for x in changed: queued.update(readers.get(x, ()))
+        dirty = list(queued)
+        heapq.heapify(dirty)
+
+        limit = 64 * (len(self.combinational) + 1)
+        while dirty:
+            idx = heapq.heappop(dirty)
+            queued.discard(idx)
+            p = self.combinational[idx]
+            before = [(x, v[x][:] if isinstance(v[x], list) else v[x])
+                      for x in p.writes]
+
+            p.function(v, None)
+            for (x, old) in before:
+                if v[x] == old: continue
+                for r in readers.get(x, ()):
+                    if r != idx and r not in queued:
+                        queued.add(r)
+                        heapq.heappush(dirty, r)
+
+            limit -= 1
+            if limit == 0:
+                raise SimulationError("Combinational logic does not settle")
+
+
+    def step(self, inputs: Dict[str, int]=None) -> None:
+        """Drives the given inputs and applies a rising clock edge."""
+        changed = set()
+        for (name, value) in (inputs or {}).items():
+            if name not in self.inputs:
+                raise ValueError("Unknown input: {}".format(name))
+
+            value = int(value) & mask(self.inputs[name].width)
+            if self.values[name] != value:
+                self.values[name] = value
+                changed.add(name)
+
+        self.settle(changed)
+
+        # Clock edge: evaluate all sequential processes, then commit
+        nba = []
+        for p in self.sequential: p.function(self.values, nba)
+
+        changed = set(self.sequential_writes)
+        for update in nba:
+            if apply(self.values, *update): changed.add(update[0])
+
+        self.settle(changed)
+        self.cycle += 1
+
+
+    def reset(self, max_cycles: int=None) -> int:
+        """Resets the BBQ and waits until it is ready (i.e., the free
+        list is initialized). Returns the number of elapsed cycles."""
+        start = self.cycle
+        self.step({"rst": 1, "in_valid": 0})
+        self.step({"rst": 0})
+
+        # The free list and the SRAM bitmaps and counters are initialized
+        # in parallel (the deepest, the leaf counters, hold a priority each)
+        if max_cycles is None:
+            params = self.compiler.params
+            max_cycles = 2 * max(params["HEAP_MAX_NUM_ENTRIES"],
+                                 params["HEAP_NUM_PRIORITIES"]) + 16
+
+        while not self.values["ready"]:
+            if (self.cycle - start) > max_cycles:
+                raise SimulationError("BBQ did not become ready")
+            self.step()
+
+        return self.cycle - start
+
+
+    def tick(self, valid: bool=False, op: HeapOp=HeapOp.ENQUE,
+             data: int=0, priority: int=0) -> Optional[
+                 Tuple[HeapOp, int, int]]:
+        """Issues an operation (if valid) and advances one cycle. Returns
+        the completed (op, data, priority), if any. Results emerge after
+        NUM_PIPELINE_STAGES cycles."""
+        self.step({"in_valid": int(valid), "in_op_type": op,
+                   "in_he_data": data, "in_he_priority": priority})
+
+        v = self.values
+        if not v["out_valid"]: return None
+        return (HeapOp(v["out_op_type"]), v["out_he_data"],
+                v["out_he_priority"])
+
+
+    def occupancy(self) -> Dict[str, List[int]]:
+        """Returns, for each level, which of its stages (start_cycle
+        through end_cycle) hold a valid op. Stage k consumes the op
+        registered in reg_valid_s[k - 1]."""
+        valid = self.values["reg_valid_s"]
+        return {level.name(): valid[level.start_cycle - 1:level.end_cycle]
+                for level in self.bbq.levels}
+
+
+    def __getitem__(self, name: str) -> object:
+        """Returns the current value of a signal."""
+        return self.values[name]
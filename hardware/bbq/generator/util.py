@@ -0,0 +1,50 @@
+#!/usr/bin/python3
+import os
+import tempfile
+from contextlib import contextmanager
+from typing import Iterator, TextIO
+
+
+@contextmanager
+def atomic_open(path: str) -> Iterator[TextIO]:
+    """Opens a temporary file that replaces path on success."""
+    fd, tmp_path = tempfile.mkstemp(
+        dir=os.path.dirname(os.path.abspath(path)),
+        prefix=".{}.".format(os.path.basename(path)))
+    try:
+        with os.fdopen(fd, "w") as f:
+            yield f
+
+        # Use the default permissions (mkstemp uses 0600)
+        umask = os.umask(0); os.umask(umask)
+        os.chmod(tmp_path, 0o666 & ~umask)
+        os.replace(tmp_path, path)
+
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+def clog2(x: int) -> int:
+    """Ceil(log2(x)), matching SystemVerilog's $clog2."""
+    return (x - 1).bit_length() if (x > 1) else 0
+
+
+def steering_levels(num_bitmap_levels: int, bitmap_width: int,
+                    num_lps: int) -> int:
+    """Returns the number of bitmap levels that the steering level of a
+    logically partitioned BBQ replaces (log_W of the number of LPs)."""
+    if bitmap_width < 2:
+        raise ValueError("Bitmap width must be GEQ 2.")
+
+    num_levels = 0
+    while (bitmap_width ** num_levels) < num_lps: num_levels += 1
+    if (bitmap_width ** num_levels) != num_lps:
+        raise ValueError("Number of logical partitions must be a "
+                         "power of the bitmap width.")
+
+    # With W^L partitions, the steering level is also the leaf level
+    if num_levels > num_bitmap_levels:
+        raise ValueError("Too many logical partitions.")
+
+    return num_levels
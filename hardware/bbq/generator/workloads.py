@@ -0,0 +1,374 @@
+#!/usr/bin/python3
+from __future__ import annotations
+
+import argparse
+import heapq
+import sys
+from abc import ABC, abstractmethod
+from typing import Dict, Iterator, List, Tuple
+
+import numpy as np
+
+from reference import TRACE_DTYPE
+from simulator import HeapOp
+
+# Packet sizes (in 64B cells; i.e., 64B, 576B and 1500B packets), and
+# their frequencies
+PACKET_SIZES = np.array([1, 9, 24], dtype=np.int64)
+PACKET_SIZE_PROBS = np.array([0.5, 0.2, 0.3])
+
+# Relative deadlines of latency classes (in time units)
+DEADLINES = np.array([16, 64, 256, 1024], dtype=np.int64)
+
+
+class Quantizer:
+    """Maps ranks to BBQ keys. Keys are buckets of the given granularity
+    (in rank units) above a base rank. For schedulers whose ranks increase
+    over time (e.g., virtual times or deadlines), the base is advanced
+    whenever the queue is empty (i.e., the priority window is rebased in
+    software, while no queued entry depends on it). Ranks outside the
+    window are clamped to its edges.
+
+    For a calendar-mode BBQ (given the span of its L1 buckets, in keys),
+    keys are unwrapped instead: the window starts at the L1 bucket of the
+    last dequeued key (where the BBQ's base is), and priorities are keys
+    modulo the number of priorities, so the window slides with dequeues
+    and never needs rebasing."""
+    def __init__(self, num_priorities: int, granularity: float=1,
+                 calendar_span: int=0) -> None:
+        if granularity <= 0:
+            raise ValueError("Granularity must be positive.")
+        if calendar_span and (num_priorities % calendar_span):
+            raise ValueError("Calendar span must divide the number of "
+                             "priorities.")
+
+        self.num_priorities = num_priorities
+        self.granularity = granularity
+        self.calendar_span = calendar_span  # L1 bucket span, or 0
+        self.base = 0                       # Rank of key 0
+        self.start = 0                      # First key in the window
+        self.num_clamped = 0                # Ranks outside the window
+
+
+    def __call__(self, rank: float) -> int:
+        key = int((rank - self.base) // self.granularity)
+        end = self.start + self.num_priorities - 1
+        if self.start <= key <= end: return key
+
+        self.num_clamped += 1
+        return min(max(key, self.start), end)
+
+
+    def priority(self, key: int) -> int:
+        """Returns the BBQ priority of a key."""
+        return key % self.num_priorities
+
+
+    def dequeued(self, key: int) -> None:
+        """Slides the window (in calendar mode) after a deque-min."""
+        if self.calendar_span:
+            self.start = key - (key % self.calendar_span)
+
+
+class Workload(ABC):
+    """Represents a packet-scheduling workload. Packets from a set of
+    flows (of Zipf-distributed popularity) arrive at a scheduler, which
+    ranks them, and are enqueued into a BBQ at their quantized rank; the
+    link dequeues the min-priority packet (FIFO within a priority, as
+    BBQ does). Each op takes one time unit, and is an enqueue with the
+    given probability (unless the queue is empty or full). The stream
+    of ops is generated lazily, so traces of any length can be streamed
+    (e.g., into ReferenceModel.run) without being held in memory. For a
+    calendar-mode BBQ, pass the span of its L1 buckets (see Quantizer)."""
+    def __init__(self, num_priorities: int, max_num_entries: int=127,
+                 num_flows: int=16, enque_fraction: float=0.45,
+                 granularity: float=1, seed: int=0,
+                 calendar_span: int=0) -> None:
+        self.rng = np.random.default_rng(seed)
+        self.quantizer = Quantizer(num_priorities, granularity,
+                                   calendar_span)
+        self.max_num_entries = max_num_entries
+        self.num_flows = num_flows
+        self.enque_fraction = enque_fraction
+
+        popularity = 1 / np.arange(1, num_flows + 1)
+        self.popularity = popularity / popularity.sum()
+        self.weights = self.rng.integers(1, 5, num_flows) # Flow weights
+
+        self.now = 0                        # Current time (ops so far)
+        self.num_packets = 0                # Packets enqueued so far
+        self.queue: List[Tuple[int, int, float, int]] = [] # (key,
+                                            # packet, rank, flow) heap
+
+
+    @abstractmethod
+    def name(self) -> str:
+        """Canonical workload name."""
+        raise NotImplementedError()
+
+
+    @abstractmethod
+    def rank(self, flow: int, size: int) -> float:
+        """Returns the rank of a packet that arrives now, and updates
+        the scheduler's (e.g., per-flow) state accordingly."""
+        raise NotImplementedError()
+
+
+    def base(self) -> float:
+        """Returns the rank that should map to key 0 (applied when the
+        queue is empty, unless in calendar mode)."""
+        return 0
+
+
+    def departed(self, rank: float, flow: int) -> None:
+        """Updates the scheduler's state when a packet departs."""
+
+
+    def chunks(self, num_ops: int,
+               chunk_size: int=(1 << 16)) -> Iterator[np.ndarray]:
+        """Yields the next num_ops ops, as TRACE_DTYPE chunks. Enqueues
+        carry the packet number as data; dequeues are deque-mins."""
+        while num_ops > 0:
+            count = min(num_ops, chunk_size)
+            num_ops -= count
+
+            # Draw the random choices for the whole chunk up front
+            coins = (self.rng.random(count) < self.enque_fraction).tolist()
+            flows = self.rng.choice(self.num_flows, count,
+                                    p=self.popularity).tolist()
+            sizes = self.rng.choice(PACKET_SIZES, count,
+                                    p=PACKET_SIZE_PROBS).tolist()
+
+            chunk = np.zeros(count, dtype=TRACE_DTYPE)
+            (ops, data, priorities) = ([HeapOp.DEQUE_MIN] * count,
+                                       [0] * count, [0] * count)
+            queue = self.queue
+            quantizer = self.quantizer
+            rebase = not quantizer.calendar_span
+            for i in range(count):
+                enque = (coins[i] or not queue) and (
+                    len(queue) < self.max_num_entries)
+
+                if enque:
+                    rank = self.rank(flows[i], sizes[i])
+                    if rebase and not queue: quantizer.base = self.base()
+                    key = quantizer(rank)
+                    heapq.heappush(queue, (key, self.num_packets,
+                                           rank, flows[i]))
+
+                    ops[i] = HeapOp.ENQUE
+                    data[i] = self.num_packets
+                    priorities[i] = quantizer.priority(key)
+                    self.num_packets += 1
+
+                else:
+                    (key, _, rank, flow) = heapq.heappop(queue)
+                    quantizer.dequeued(key)
+                    self.departed(rank, flow)
+
+                self.now += 1
+
+            chunk["op_type"] = ops
+            chunk["data"] = data
+            chunk["priority"] = priorities
+            yield chunk
+
+
+    def ops(self, num_ops: int) -> Iterator[Tuple[HeapOp, int, int]]:
+        """Yields the next num_ops ops, as (op, data, priority)."""
+        for chunk in self.chunks(num_ops):
+            for (op, data, priority) in zip(chunk["op_type"].tolist(),
+                                            chunk["data"].tolist(),
+                                            chunk["priority"].tolist()):
+                yield (HeapOp(op), data, priority)
+
+
+class VirtualTimeWorkload(Workload):
+    """Fair queueing with a self-clocked virtual time (i.e., the tag of
+    the last departed packet), which the priority window is based at."""
+    def __init__(self, *args, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self.virtual_time = 0.0             # System virtual time
+        self.finish_tags = np.zeros(self.num_flows).tolist()
+
+
+    def base(self) -> float:
+        return self.virtual_time
+
+
+    def departed(self, rank: float, flow: int) -> None:
+        self.virtual_time = max(self.virtual_time, rank)
+
+
+class STFQWorkload(VirtualTimeWorkload):
+    """Start-time fair queueing: packets are ranked by their start tags,
+    max(V, F_prev), where F = S + size / weight."""
+    def name(self) -> str:
+        return "stfq"
+
+
+    def rank(self, flow: int, size: int) -> float:
+        start = max(self.virtual_time, self.finish_tags[flow])
+        self.finish_tags[flow] = start + size / self.weights[flow]
+        return start
+
+
+class WFQWorkload(VirtualTimeWorkload):
+    """Weighted fair queueing: packets are ranked by their finish tags,
+    max(V, F_prev) + size / weight."""
+    def name(self) -> str:
+        return "wfq"
+
+
+    def rank(self, flow: int, size: int) -> float:
+        finish = (max(self.virtual_time, self.finish_tags[flow]) +
+                  size / self.weights[flow])
+        self.finish_tags[flow] = finish
+        return finish
+
+
+class PFabricWorkload(Workload):
+    """pFabric: packets are ranked by the remaining size of their flow
+    (in cells). Flow sizes are heavy-tailed (Pareto); when a flow ends,
+    a new one takes its place."""
+    def __init__(self, *args, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self.remaining = [self.flow_size() for _ in range(self.num_flows)]
+
+
+    def name(self) -> str:
+        return "pfabric"
+
+
+    def flow_size(self) -> int:
+        """Returns the size of a new flow (in cells)."""
+        return int(PACKET_SIZES[-1] * (1 + self.rng.pareto(1.2)))
+
+
+    def rank(self, flow: int, size: int) -> float:
+        rank = self.remaining[flow]
+        self.remaining[flow] -= size
+        if self.remaining[flow] <= 0: self.remaining[flow] = self.flow_size()
+        return rank
+
+
+class EDFWorkload(Workload):
+    """Earliest deadline first: packets are ranked by their deadlines,
+    given by their flow's latency class. The priority window is based at
+    the current time."""
+    def __init__(self, *args, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self.deadlines = self.rng.choice(DEADLINES, self.num_flows).tolist()
+
+
+    def name(self) -> str:
+        return "edf"
+
+
+    def base(self) -> float:
+        return self.now
+
+
+    def rank(self, flow: int, size: int) -> float:
+        return self.now + self.deadlines[flow]
+
+
+class LSTFWorkload(EDFWorkload):
+    """Least slack time first: packets are ranked by their slack (the
+    time to their deadline, less their transmission time) plus their
+    arrival time, so waiting packets grow more urgent."""
+    def name(self) -> str:
+        return "lstf"
+
+
+    def rank(self, flow: int, size: int) -> float:
+        return self.now + self.deadlines[flow] - size
+
+
+class TokenBucketWorkload(Workload):
+    """Token-bucket shaping: packets are ranked by the time they conform
+    to their flow's token bucket, which fills (in cells per time unit)
+    at the flow's mean arrival rate plus some headroom, up to a burst of
+    the largest packet. Uses the virtual-scheduling formulation, where
+    theoretical arrival times (TATs) advance by size / rate per packet."""
+    headroom = 1.25                         # Rate over the mean arrival rate
+
+    def __init__(self, *args, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        mean_size = np.dot(PACKET_SIZES, PACKET_SIZE_PROBS)
+        self.rates = (self.popularity * self.enque_fraction * mean_size *
+                      self.headroom).tolist()
+        self.tats = np.zeros(self.num_flows).tolist()
+
+
+    def name(self) -> str:
+        return "token_bucket"
+
+
+    def base(self) -> float:
+        return self.now
+
+
+    def rank(self, flow: int, size: int) -> float:
+        burst = PACKET_SIZES[-1] / self.rates[flow]
+        eligible = max(self.now, self.tats[flow] - burst)
+        self.tats[flow] = max(self.now, self.tats[flow]) + (
+            size / self.rates[flow])
+        return eligible
+
+
+# Workloads selectable from the command line
+WORKLOADS: Dict[str, type] = {
+    "stfq": STFQWorkload,
+    "wfq": WFQWorkload,
+    "pfabric": PFabricWorkload,
+    "edf": EDFWorkload,
+    "lstf": LSTFWorkload,
+    "token_bucket": TokenBucketWorkload,
+}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        prog="workloads", description=("Generates a packet-scheduling trace "
+                                       "for a BBQ configuration."))
+
+    parser.add_argument("workload", type=str, choices=sorted(WORKLOADS))
+    parser.add_argument("num_bitmap_levels", type=int)
+    parser.add_argument("--bitmap_width", type=int, default=32)
+    parser.add_argument("--calendar", action="store_true",
+                        help="Target a calendar-mode BBQ")
+    parser.add_argument("--max_num_entries", type=int, default=127)
+    parser.add_argument("--num_flows", type=int, default=16)
+    parser.add_argument("--enque_fraction", type=float, default=0.45,
+                        help="Fraction of ops that are enqueues")
+    parser.add_argument("--granularity", type=float, default=1,
+                        help="Ranks per priority")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--num_ops", type=int, required=True)
+    parser.add_argument("--output", type=str, required=True,
+                        help=("Output path for the trace (.npy of TRACE_DTYPE "
+                              "records, written one chunk at a time)"))
+    args = parser.parse_args()
+
+    calendar_span = (args.bitmap_width ** (args.num_bitmap_levels - 1)
+                     if args.calendar else 0)
+    workload = WORKLOADS[args.workload](
+        args.bitmap_width ** args.num_bitmap_levels, args.max_num_entries,
+        args.num_flows, args.enque_fraction, args.granularity, args.seed,
+        calendar_span)
+
+    trace = np.lib.format.open_memmap(args.output, mode="w+",
+                                      dtype=TRACE_DTYPE,
+                                      shape=(args.num_ops,))
+    offset = 0
+    for chunk in workload.chunks(args.num_ops):
+        trace[offset:offset + len(chunk)] = chunk
+        offset += len(chunk)
+
+    trace.flush()
+    print("[workloads] {}: {} op(s), {} enqueue(s), {} clamped to the "
+          "priority window".format(workload.name(), args.num_ops,
+                                   workload.num_packets,
+                                   workload.quantizer.num_clamped),
+          file=sys.stderr)
@@ -1,6 +1,9 @@
 #!/usr/bin/env bash
 #
-# Usage: ./sweep_params.sh [SEED]
+# Usage: [MAX_REGISTERS=XXX] [MAX_M20KS=YYY] ./sweep_params.sh [SEED]
+#
+# If MAX_REGISTERS (register bits) and/or MAX_M20KS are set, configs
+# that the resource estimator predicts will not fit are skipped.
 #
 PROJECT_NAME="bbq"
 
@@ -40,6 +43,15 @@ do
             if [[ ${num_priorities} -le ${max_num_priorities} ]]
             then
                 midfix="l${l}_b${b}_n${n}"
+                if [[ -n "${MAX_REGISTERS}${MAX_M20KS}" ]] && ! python3     \
+                    ${PROJECT_DIR}/generator/resources.py ${l} --quiet      \
+                    --bitmap_width ${b} --element_bits ${n} --check         \
+                    ${MAX_REGISTERS:+--max_registers ${MAX_REGISTERS}}      \
+                    ${MAX_M20KS:+--max_m20ks ${MAX_M20KS}}
+                then
+                    echo "Skipping ${midfix} (does not fit)"
+                    continue
+                fi
 
                 dst_dir=${PROJECT_DIR}/quartus/sweep_params/${midfix}
                 rm -rf ${dst_dir}
@@ -39,10 +39,11 @@ set -e
 trap 'last_command=$current_command; current_command=$BASH_COMMAND' DEBUG
 trap 'echo "\"${last_command}\" command exited with code $?."' EXIT
 
-# Re-generate bbq.sv with the appropriate number of levels
+# Re-generate bbq.sv with the appropriate number of levels. The output
+# is left untouched if it is already up-to-date (per the cache).
 cd ${PROJECT_DIR}/generator
-rm -f ../src/bbq.sv
-python3 bbq.py ${NUM_LEVELS} > ../src/bbq.sv
+python3 bbq.py ${NUM_LEVELS} --output ../src/bbq.sv \
+  --cache_dir ${BBQ_CACHE_DIR:-${HOME}/.cache/bbq}
 
 cd ${PROJECT_DIR}/quartus
 
@@ -32,6 +32,11 @@ declare -a testcases=(
   'TEST_RESET'
 )
 
+# Replay golden files (generated by generator/golden.py), if present
+if [ -f stimulus.hex ] && [ -f expected.hex ]; then
+  testcases+=('TEST_GOLDEN')
+fi
+
 max_testcase_name_length ${testcases[@]}
 for c in ${testcases[@]}; do
   run_testcase $c
@@ -46,6 +46,7 @@ typedef logic [HEAP_PRIORITY_AWIDTH-1:0] heap_priority_t;
  * TEST_PIPELINING_DEQUE_DEQUE_MIXED
  * TEST_DEQUE_FIFO
  * TEST_RESET
+ * TEST_GOLDEN
  */
 
 // Global state
@@ -1544,6 +1545,136 @@ always @(posedge clk) begin
 end
 end
 
+else if (`TEST_CASE == "TEST_GOLDEN") begin
+// Replay a stimulus file, and compare the outputs against golden ones
+// cycle by cycle (both generated by generator/golden.py). The paths
+// default to stimulus.hex and expected.hex, and can be overridden with
+// the +STIMULUS=<path> and +EXPECTED=<path> plusargs.
+localparam NUM_FIELDS = 4; // (cycle, op, priority, data)
+
+string stimulus_path;
+string expected_path;
+integer stimulus_fd;
+integer expected_fd;
+integer stimulus_count;
+integer expected_count;
+logic [31:0] num_outputs;
+logic [31:0] last_cycle;
+
+// Next stimulus and expected records
+logic [31:0] stimulus_cycle;
+logic [1:0] stimulus_op_type;
+heap_priority_t stimulus_priority;
+heap_entry_data_t stimulus_data;
+logic [31:0] expected_cycle;
+logic [1:0] expected_op_type;
+heap_priority_t expected_priority;
+heap_entry_data_t expected_data;
+heap_op_t expected_out_op_type;
+
+initial begin
+    num_outputs = 0;
+    last_cycle = 0;
+    if (!$value$plusargs("STIMULUS=%s", stimulus_path)) begin
+        stimulus_path = "stimulus.hex";
+    end
+    if (!$value$plusargs("EXPECTED=%s", expected_path)) begin
+        expected_path = "expected.hex";
+    end
+    stimulus_fd = $fopen(stimulus_path, "r");
+    expected_fd = $fopen(expected_path, "r");
+    if ((stimulus_fd == 0) || (expected_fd == 0)) begin
+        $display("FAIL %s: Could not open %s or %s", `TEST_CASE,
+                 stimulus_path, expected_path);
+        $finish;
+    end
+    stimulus_count = $fscanf(stimulus_fd, "%h %h %h %h\n", stimulus_cycle,
+                             stimulus_op_type, stimulus_priority,
+                             stimulus_data);
+
+    expected_count = $fscanf(expected_fd, "%h %h %h %h\n", expected_cycle,
+                             expected_op_type, expected_priority,
+                             expected_data);
+end
+
+assign expected_out_op_type = heap_op_t'(expected_op_type);
+
+always @(posedge clk) begin
+    rst <= 0;
+    heap_in_valid <= 0;
+    heap_in_data <= 0;
+    heap_in_priority <= 0;
+    test_timer <= test_timer + 1;
+    heap_in_op_type <= HEAP_OP_ENQUE;
+    init_done <= init_done | heap_ready;
+
+    if (init_done) begin
+        counter <= counter + 1;
+
+        // Issue the next op
+        if ((stimulus_count == NUM_FIELDS) &&
+            (counter == stimulus_cycle)) begin
+            heap_in_valid <= 1;
+            heap_in_data <= stimulus_data;
+            heap_in_priority <= stimulus_priority;
+            heap_in_op_type <= heap_op_t'(stimulus_op_type);
+            last_cycle <= counter;
+
+            stimulus_count = $fscanf(stimulus_fd, "%h %h %h %h\n",
+                                     stimulus_cycle, stimulus_op_type,
+                                     stimulus_priority, stimulus_data);
+        end
+
+        // Compare the output against the next expected one
+        if (heap_out_valid) begin
+            if (expected_count != NUM_FIELDS) begin
+                $display("FAIL %s: Unexpected output (%s, %0d, %0d) ",
+                         `TEST_CASE, heap_out_op_type.name, heap_out_data,
+                         heap_out_priority, "at cycle %0d", counter);
+                $finish;
+            end
+            else if ((counter !== expected_cycle) ||
+                     (heap_out_op_type !== expected_out_op_type) ||
+                     (heap_out_data !== expected_data) ||
+                     (heap_out_priority !== expected_priority)) begin
+                $display("FAIL %s: Expected output %0d ", `TEST_CASE,
+                         num_outputs, "(op: %s, data: %0d, priority: %0d) ",
+                         expected_out_op_type.name, expected_data,
+                         expected_priority, "at cycle %0d, got ",
+                         expected_cycle, "(%s, %0d, %0d) at cycle %0d",
+                         heap_out_op_type.name, heap_out_data,
+                         heap_out_priority, counter);
+                $finish;
+            end
+            else begin
+                num_outputs <= num_outputs + 1;
+                last_cycle <= counter;
+                expected_count = $fscanf(expected_fd, "%h %h %h %h\n",
+                                         expected_cycle, expected_op_type,
+                                         expected_priority, expected_data);
+            end
+        end
+        else if ((expected_count == NUM_FIELDS) &&
+                 (counter > expected_cycle)) begin
+            $display("FAIL %s: Missing output %0d at cycle %0d",
+                     `TEST_CASE, num_outputs, expected_cycle);
+            $finish;
+        end
+        // Wait out the pipeline (for spurious outputs) before passing
+        else if ((expected_count != NUM_FIELDS) &&
+                 (stimulus_count != NUM_FIELDS) &&
+                 (counter > (last_cycle + P))) begin
+            $display("PASS %s", `TEST_CASE);
+            $finish;
+        end
+    end
+    else if (test_timer > MAX_HEAP_INIT_CYCLES) begin
+        $display("FAIL %s: Heap init timed out", `TEST_CASE);
+        $finish;
+    end
+end
+end
+
 else begin
     $error("FAIL: Unknown test %s", `TEST_CASE);
 end